@@ -0,0 +1,264 @@
+# =============================================================================
+#  End-to-end benchmark of the capture pipeline (capture -> sync -> encode ->
+#  write) with synthetic cameras (syntheticSpin.py), so a pipeline change can be
+#  checked for performance regressions on any machine, without cameras or a DAQ.
+#
+#  For each number of cameras, trials are run at increasing frame rates
+#  (doubling, then bisecting) to find the maximum sustainable frame rate: the
+#  highest rate at which (almost) no frame was dropped anywhere (camera host
+#  buffer, frame synchronizer or frame ring) and the camera threads never had
+#  to wait for a free ring slot. The synthetic cameras deliver frames on a
+#  sleep-based timer whose jitter now and then overflows a host buffer, so a
+#  rate counts as sustained when a majority of --trials trials at that rate
+#  drop at most --drop-tolerance of the frames; a single unlucky trial does not
+#  decide the result. CPU use (this process plus the ffmpeg processes, in % of
+#  one core), peak memory (resident set size, including ffmpeg) and latency
+#  are the medians of the trials at that rate, e.g.
+#      python benchmarkCapture.py --cameras 1,2,4,8 --width 400 --height 400 --sink libx264
+#      python benchmarkCapture.py --sink none --json results.json
+#      python benchmarkCapture.py --sink rawfile --baseline results.json
+#
+#  --sink is 'none' (frames are discarded, capture and pairing only), 'rawfile'
+#  (rawCapture.RawSink) or an encoder name from encoders.ENCODERS. With
+#  --baseline, the run fails (exit code 1) if the maximum frame rate of any
+#  configuration dropped by more than --tolerance compared to a saved --json.
+#
+#  --acquisition poll,event benchmarks both acquisition backends (a thread per
+#  camera blocking in GetNextImage, or ImageEventHandler callbacks) side by side;
+#  besides CPU use, each trial reports the latency from the (synthetic) trigger
+#  until the image had been copied into the frame ring, e.g.
+#      python benchmarkCapture.py --cameras 2,4 --acquisition poll,event
+#
+#  --pixel-format takes a comma separated list too, to compare formats at the
+#  same ROI: BayerRG8 against RGB8Packed shows what capturing color cameras in
+#  their Bayer format (debayered by ffmpeg, see debayer.py) gains, and
+#  Mono8,Mono12Packed,Mono16 what the 12-bit path costs (highBitDepth.py), e.g.
+#      python benchmarkCapture.py --cameras 2 --pixel-format Mono8,Mono12Packed,Mono16 --sink ffv1
+# =============================================================================
+
+import os, io, sys, copy, json, time, shutil, tempfile, threading, argparse, contextlib
+import numpy as np
+import syntheticSpin
+from captureEngine import CaptureEngine, CameraSettings, initCam
+from encoders import ENCODERS
+from perCameraSink import PerCameraSink
+from rawCapture import RawSink
+try:
+    import resource
+except ImportError: #Windows
+    resource = None
+
+MEMORY_INTERVAL = 0.05 #in seconds; how often memory use is sampled during a trial
+DROP_TOLERANCE = 0.005 #fraction of frames a sustained trial may drop, for the synthetic cameras' timer jitter
+MEDIAN_KEYS = ('cpu', 'memoryMB', 'seconds', 'latencyMs', 'latencyP99Ms') #reported as the median of the trials at one frame rate
+
+class NullSink: #discards every frame, to measure capture and pairing without a writer
+    def writeFrame(self, frame):
+        pass
+
+    def close(self):
+        pass
+
+def processRss(pid='self'): #resident set size in bytes of a process and its children (e.g. ffmpeg), or None without /proc
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            rss = next(int(line.split()[1])*1024 for line in f if line.startswith('VmRSS:'))
+        pid = os.getpid() if pid == 'self' else pid
+        with open('/proc/{}/task/{}/children'.format(pid, pid)) as f:
+            children = f.read().split()
+    except (OSError, StopIteration):
+        return None
+    return rss + sum(processRss(child) or 0 for child in children)
+
+class MemorySampler(threading.Thread): #peak resident memory during a trial
+    def __init__(self):
+        threading.Thread.__init__(self, name='memorySampler', daemon=True)
+        self.stopEvent = threading.Event()
+        self.peak = 0
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            self.peak = max(self.peak, processRss() or 0)
+            self.stopEvent.wait(MEMORY_INTERVAL)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.join()
+        if self.peak == 0 and resource is not None: #no /proc: peak of this process over its whole lifetime
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform == 'darwin' else 1024)
+        return self.peak
+
+def makeSink(sinkName, numCams, settings, frameRate, tempDir, perCamera=False): #sink stage under test
+    if sinkName == 'none':
+        return NullSink()
+    if sinkName == 'rawfile':
+        return RawSink([os.path.join(tempDir, 'cam{}.raw'.format(c+1)) for c in range(numCams)])
+    encoder = ENCODERS[sinkName]
+    pixFmt = settings.pixFmt()
+    if perCamera:
+        return PerCameraSink([encoder.fileName(os.path.join(tempDir, 'cam{}'.format(c+1))) for c in range(numCams)], factory=encoder.writer,
+                             width=settings.width, height=settings.height, pixFmt=pixFmt, rate=frameRate)
+    return encoder.writer(encoder.fileName(os.path.join(tempDir, 'cams')), width=settings.width*numCams, height=settings.height,
+                          pixFmt=pixFmt, rate=frameRate)
+
+def triggerLatency(trace, cams): #(p50, p99) in ms from each synthetic trigger until the image was copied into the ring
+    if trace.lastIndex is None:
+        return float('nan'), float('nan')
+    times = trace.rows(trace.firstIndex, trace.lastIndex + 1)
+    indexes = np.arange(trace.firstIndex, trace.lastIndex + 1) #frame index == FrameID, and the synthetic clock is perf_counter
+    latency = np.concatenate([times[:, 3*c + 2] - (cam.t0 + indexes*cam.period) for c, cam in enumerate(cams)])
+    latency = latency[latency == latency]
+    if len(latency) == 0:
+        return float('nan'), float('nan')
+    p50, p99 = np.percentile(latency, [50, 99])*1000
+    return float(p50), float(p99)
+
+def runTrial(numCams, frameRate, duration, settings, sinkName='none', perCamera=False, ringSlots=64, bufferCount=10, dropTolerance=DROP_TOLERANCE):
+    #one capture session with synthetic cameras; dict of results
+    syntheticSpin.configure(numCams, frameRate=frameRate, sensorWidth=settings.width + settings.offsetX,
+                            sensorHeight=settings.height + settings.offsetY, bufferCount=bufferCount)
+    system = syntheticSpin.System.GetInstance()
+    cams = system.GetCameras()
+    for cam in cams:
+        initCam(cam, settings, spin=syntheticSpin)
+    tempDir = tempfile.mkdtemp(prefix='benchmarkCapture_')
+    sampler = MemorySampler()
+    try:
+        sink = makeSink(sinkName, numCams, settings, frameRate, tempDir, perCamera)
+        engine = CaptureEngine(cams, settings, sink=sink, numFrames=int(round(frameRate*duration)), ringSlots=ringSlots, statusInterval=None,
+                               spin=syntheticSpin)
+        sampler.start()
+        times = os.times()
+        tStart = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()): #the engine's own reports
+            framesCombined = engine.run()
+        wall = time.perf_counter() - tStart
+        cpu = sum(os.times()[:4]) - sum(times[:4]) #user + system, including ffmpeg processes that have exited
+    finally:
+        peak = sampler.stop() if sampler.is_alive() else 0
+        system.ReleaseInstance()
+        shutil.rmtree(tempDir, ignore_errors=True)
+    ring = engine.ring
+    dropped = sum(engine.sync.dropCounts) + ring.droppedNewest + ring.droppedOldest #frames missing from the output; includes host buffer drops
+    latency50, latency99 = triggerLatency(engine.trace, cams)
+    return {'cameras': numCams, 'acquisition': settings.acquisition, 'pixelFormat': settings.pixelFormat,
+            'usbMBps': numCams*settings.imageBytes()*frameRate/1e6, 'fps': frameRate, 'frames': framesCombined, 'dropped': dropped,
+            'blocked': ring.blockedCount, 'bufferDrops': sum(cam.droppedFull for cam in cams),
+            'sustained': dropped <= dropTolerance*numCams*engine.numFrames and ring.blockedCount == 0 and framesCombined == engine.numFrames,
+            'cpu': 100.0*cpu/wall, 'memoryMB': peak/1e6, 'ringMB': ring.memoryBytes/1e6, 'seconds': wall,
+            'latencyMs': latency50, 'latencyP99Ms': latency99}
+
+def sustainedTrial(numCams, frameRate, duration, settings, trials=3, verbose=True, **kwargs):
+    #trials at one frame rate until a majority passed or failed; the first trial with the median of MEDIAN_KEYS and the majority verdict
+    majority = trials//2 + 1
+    results = []
+    while sum(trial['sustained'] for trial in results) < majority and sum(not trial['sustained'] for trial in results) < majority:
+        trial = runTrial(numCams, frameRate, duration, settings, **kwargs)
+        results.append(trial)
+        if verbose:
+            print('  {} cameras @ {:g}fps ({}, {}): {}'.format(numCams, frameRate, settings.acquisition, settings.pixelFormat, 'ok' if trial['sustained'] else
+                  'failed ({} dropped, blocked {}x)'.format(trial['dropped'], trial['blocked'])))
+    trial = dict(results[0])
+    for key in MEDIAN_KEYS:
+        trial[key] = float(np.median([result[key] for result in results]))
+    trial['trials'] = len(results)
+    trial['passed'] = sum(result['sustained'] for result in results)
+    trial['sustained'] = trial['passed'] >= majority
+    return trial
+
+def maxSustainable(numCams, settings, startFps=100, maxFps=4000, steps=3, duration=3.0, **kwargs):
+    #highest frame rate sustained by the pipeline (doubling from startFps, then bisecting steps times); the trial dict at that rate
+    best = None
+    failed = None
+    frameRate = startFps
+    while frameRate <= maxFps:
+        trial = sustainedTrial(numCams, frameRate, duration, settings, **kwargs)
+        if not trial['sustained']:
+            failed = frameRate
+            break
+        best = trial
+        frameRate *= 2
+    if failed is not None and best is not None:
+        low, high = best['fps'], failed
+        for step in range(steps):
+            frameRate = round((low + high)/2.0)
+            if frameRate in (low, high):
+                break
+            trial = sustainedTrial(numCams, frameRate, duration, settings, **kwargs)
+            if trial['sustained']:
+                best, low = trial, frameRate
+            else:
+                high = frameRate
+    return best
+
+def benchmarkReport(results): #one line per configuration
+    lines = ['{:>7s} {:>6s} {:>12s} {:>10s} {:>8s} {:>8s} {:>10s} {:>8s} {:>16s}'.format('cameras', 'acq', 'format', 'max fps', 'USB MB/s',
+                                                                                          'cpu %', 'memory MB', 'ring MB', 'latency p50/p99')]
+    for (numCams, acquisition, pixelFormat), result in results:
+        if result is None:
+            lines.append('{:7d} {:>6s} {:>12s} {:>10s}'.format(numCams, acquisition, pixelFormat, 'none'))
+        else:
+            lines.append(('{cameras:7d} {acquisition:>6s} {pixelFormat:>12s} {fps:10g} {usbMBps:8.0f} {cpu:8.0f} {memoryMB:10.0f} {ringMB:8.1f} '
+                          '{latencyMs:8.2f}/{latencyP99Ms:.2f}ms').format(**result))
+    return lines
+
+def compareBaseline(results, baseline, tolerance=0.1): #lines describing regressions against a saved run (empty if none)
+    before = {(entry['cameras'], entry.get('acquisition', 'poll'), entry.get('pixelFormat', baseline.get('pixelFormat', 'Mono8'))): entry
+              for entry in baseline['results'] if entry is not None}
+    regressions = []
+    for key, result in results:
+        if key not in before:
+            continue
+        fps = result['fps'] if result is not None else 0
+        if fps < before[key]['fps']*(1 - tolerance):
+            regressions.append('REGRESSION: {} cameras ({}, {}) sustain {:g}fps, baseline {:g}fps'.format(key[0], key[1], key[2], fps, before[key]['fps']))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the capture pipeline end to end with synthetic cameras')
+    parser.add_argument('--cameras', default='1,2,4,8', help='comma separated numbers of cameras')
+    parser.add_argument('--width', type=int, default=400)
+    parser.add_argument('--height', type=int, default=400)
+    parser.add_argument('--pixel-format', default='Mono8', help="comma separated pixel formats, e.g. 'Mono8,Mono12Packed,Mono16' or 'RGB8Packed,BayerRG8'")
+    parser.add_argument('--sink', default='none', choices=['none', 'rawfile'] + list(ENCODERS))
+    parser.add_argument('--per-camera', action='store_true', help='one file and encoder per camera (perCameraSink.py)')
+    parser.add_argument('--start', type=float, default=100, help='first frame rate tried')
+    parser.add_argument('--max', type=float, default=4000, help='highest frame rate tried')
+    parser.add_argument('--steps', type=int, default=3, help='bisection steps after the first failed rate')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds per trial')
+    parser.add_argument('--ring-slots', type=int, default=64)
+    parser.add_argument('--trials', type=int, default=3, help='trials per frame rate; a rate is sustained if a majority of them pass')
+    parser.add_argument('--drop-tolerance', type=float, default=DROP_TOLERANCE, help='fraction of frames a passing trial may drop')
+    parser.add_argument('--buffer-count', type=int, default=10, help='camera host buffers')
+    parser.add_argument('--acquisition', default='poll', help="comma separated acquisition backends: 'poll' and/or 'event'")
+    parser.add_argument('--json', default=None, help='save the results to this file')
+    parser.add_argument('--baseline', default=None, help='results file of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed drop in max fps against the baseline')
+    args = parser.parse_args()
+    settings = CameraSettings(width=args.width, height=args.height, offsetX=0, offsetY=0)
+    results = []
+    for numCams in [int(n) for n in args.cameras.split(',')]:
+        for acquisition in args.acquisition.split(','):
+            for pixelFormat in args.pixel_format.split(','):
+                print('Benchmarking {} cameras ({}), {}x{} {}, sink {}{}...'.format(numCams, acquisition, args.width, args.height, pixelFormat,
+                                                                                    args.sink, ' (per camera)' if args.per_camera else ''))
+                trialSettings = copy.copy(settings)
+                trialSettings.acquisition = acquisition
+                trialSettings.pixelFormat = pixelFormat
+                results.append(((numCams, acquisition, pixelFormat), maxSustainable(numCams, trialSettings, args.start, args.max, args.steps,
+                                                                                    args.duration, sinkName=args.sink, trials=args.trials,
+                                                                                    dropTolerance=args.drop_tolerance,
+                                                                                    perCamera=args.per_camera, ringSlots=args.ring_slots,
+                                                                                    bufferCount=args.buffer_count)))
+    for line in benchmarkReport(results):
+        print(line)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'width': args.width, 'height': args.height, 'pixelFormat': args.pixel_format, 'sink': args.sink,
+                       'perCamera': args.per_camera, 'results': [result for key, result in results]}, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compareBaseline(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(line)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,98 @@
+# =============================================================================
+#  Camera registry: maps logical camera names (e.g. 'camTop', 'camSide') to
+#  serial numbers, so cameras always end up in the same place in the video
+#  whatever order the USB enumeration returns them in. The camera list is
+#  enumerated once; cameras without a serial number take the remaining cameras
+#  in enumeration order.
+#
+#  The registry also re-acquires cameras lost mid-session: pass its reacquire
+#  method to CaptureEngine(reconnect=...) and a camera that disconnects or
+#  stops delivering images while the others keep recording is looked up again
+#  by serial number and re-initialized with the same settings; the camera's
+#  thread then restarts acquisition (after registering its image event handler,
+#  for event acquisition), while the other cameras keep recording. The missed frames are filled and logged as
+#  'disconnected' in the drop log (see frameSync.py), e.g.
+#      registry = CameraRegistry([('camTop', '21253509'), ('camSide', '21253501')])
+#      registry.initAll(settings)
+#      engine = CaptureEngine(registry.cameras(), settings, ..., names=registry.names, reconnect=registry.reacquire)
+#      engine.run()
+#      registry.release()
+# =============================================================================
+
+import threading
+from captureEngine import CameraSettings, ConfigCache, cameraSerial, initCam, initCams
+try:
+    import PySpin
+except ImportError: #e.g. with synthetic cameras (syntheticSpin.py)
+    PySpin = None
+
+class CameraRegistry: #cameras by logical name, looked up by serial number
+    def __init__(self, cameras, spin=None):
+        self.spin = spin or PySpin #PySpin module, or a compatible module such as syntheticSpin
+        cameras = list(cameras.items()) if isinstance(cameras, dict) else list(cameras) #(name, serial or None) pairs, in video order
+        self.names = [str(name) for name, serial in cameras]
+        self.serials = [str(serial) if serial is not None else None for name, serial in cameras]
+        self.lock = threading.Lock() #one re-acquisition at a time
+        self.settings = {} #name -> CameraSettings applied by initAll(), reused to re-initialize a lost camera
+        self.cache = None
+        self.system = self.spin.System.GetInstance()
+        self.camList = self.system.GetCameras() #enumerated once
+        self.found = {} #name -> serial number of the camera selected for it, read while it is connected
+        self.cams = self.select(self.camList)
+
+    def select(self, camList): #name -> camera, by serial number where given, otherwise in enumeration order
+        bySerial = {cameraSerial(camList[i]): camList[i] for i in range(camList.GetSize())}
+        unclaimed = [serial for serial in bySerial if serial not in self.serials]
+        cams = {}
+        for name, serial in zip(self.names, self.serials):
+            found = serial if serial is not None else (unclaimed.pop(0) if unclaimed else None)
+            cam = bySerial.get(found)
+            if cam is None:
+                raise RuntimeError('camera {} ({}) not found; connected serial numbers: {}'.format(name, 'serial ' + serial if serial else 'any serial',
+                                                                                              ', '.join(bySerial) or 'none'))
+            cams[name] = cam
+            self.found[name] = found
+        return cams
+
+    def __getitem__(self, name):
+        return self.cams[name]
+
+    def cameras(self): #cameras in registry order
+        return [self.cams[name] for name in self.names]
+
+    def serial(self, name): #serial number of a camera, as enumerated (so it is known even once the camera is lost)
+        return self.found[name]
+
+    def initAll(self, settings, cache=None, userSet=None): #initialize all cameras in parallel (see captureEngine.initCams); returns init times
+        if isinstance(settings, CameraSettings):
+            settings = [settings]*len(self.names)
+        self.settings = dict(zip(self.names, settings))
+        self.cache = ConfigCache(cache) if isinstance(cache, str) else cache
+        return initCams(self.cameras(), settings, self.spin, self.names, self.cache, userSet)
+
+    def reacquire(self, name): #find a lost camera again by serial number and re-initialize it (not acquiring yet); None if it is not back yet
+        with self.lock:
+            serial = self.serial(name) #cameras without a configured serial are looked for by the one they had at enumeration
+            self.system.UpdateCameras()
+            camList = self.system.GetCameras()
+            cam = camList.GetBySerial(serial)
+            if cam is None or (hasattr(cam, 'IsValid') and not cam.IsValid()): #PySpin returns an invalid pointer for a missing serial
+                camList.Clear()
+                return None
+            if cam.IsInitialized():
+                cam.DeInit()
+            initCam(cam, self.settings[name], self.spin, self.cache)
+            self.cams[name] = cam
+            self.camList = camList
+            return cam
+
+    def release(self): #de-initialize all cameras and release the Spinnaker system
+        for cam in self.cams.values():
+            try:
+                if cam.IsInitialized():
+                    cam.DeInit()
+            except Exception: #camera was lost
+                pass
+        self.cams = {}
+        self.camList.Clear()
+        self.system.ReleaseInstance()
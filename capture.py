@@ -0,0 +1,159 @@
+# =============================================================================
+#  Command line entry point that runs one capture session from a rig profile
+#  (rigProfile.py) without any prompts, so sessions can be launched back to back
+#  by the behavior controller, e.g.
+#      python capture.py rig1.yaml --subject mouse12
+#      python capture.py rig1.yaml --subject mouse12 --seconds 30 --preview none
+#      python capture.py rig1.yaml --subject test --synthetic   # dry run with synthetic cameras (syntheticSpin.py)
+#
+#  The profile replaces the constants at the top of the cameraCapture*.py
+#  scripts; the subject ID replaces their input() prompt. Files are named from
+#  the profile's fileName pattern, e.g. mouse12_2021_02_01_09_30_59.mp4, and the
+#  exit code is 0 if all frames were captured, 1 if capture ended early (e.g. a
+#  camera timed out waiting for triggers) and 2 if the session could not start.
+# =============================================================================
+
+import os, sys, argparse
+from datetime import datetime
+from captureEngine import CaptureEngine, streamPixFmt
+from cameraRegistry import CameraRegistry
+from rigProfile import RigProfile
+from encoders import getEncoder
+from perCameraSink import PerCameraSink
+from rawCapture import RawSink
+from segmentedSink import SegmentedSink
+from frameTransform import FrameTransform, TransformStream, TransformSink
+from debayer import isBayer
+
+def makeSink(profile, movieName): #writer stage for the profile; returns (sink, name of the output file(s))
+    settings = profile.settings
+    numFrames = profile['framesToRecord']
+    tracking = profile['trackingBinning'] or any(crop is not None for crop in profile.trackingCrops)
+    if profile['rawCapture'] and (tracking or profile['archiveEvery'] > 1):
+        raise ValueError('tracking files and archiveEvery need rawCapture: false')
+    if profile['rawCapture']: # compress later with: python rawCapture.py <movie>_<camera>.raw ...
+        fileNames = [movieName + '_' + name + '.raw' for name in profile.names]
+        return RawSink(fileNames, maxFrames=numFrames, pixFmts=[s.pixFmt() for s in settings]), ', '.join(fileNames)
+    if profile['separateFiles']:
+        width = max(s.width for s in settings)
+        pixFmts = [s.pixFmt() for s in settings]
+        pixFmt = 'rgb24' if 'rgb24' in pixFmts else pixFmts[0] #format the encoder is probed with
+    else:
+        width = sum(s.width for s in settings)
+        pixFmt = streamPixFmt(settings) #e.g. bayer_rggb8 for Bayer cameras, which ffmpeg debayers while encoding
+    encoder = getEncoder(profile['encoder'], width, max(s.height for s in settings), pixFmt, profile['framesPerSecond'])
+    if pixFmt == 'gray16le' and not encoder.lossless:
+        print('WARNING: {} keeps 8 bits per pixel; use encoder ffv1 or rawCapture to store high bit depth frames losslessly'.format(encoder.name))
+    outputdict = {} if encoder.hardware else {'-threads': str(profile['ffmpegThreads'])}
+    if encoder.name == 'libx264':
+        outputdict['-crf'] = str(profile['crf'])
+    def writerFactory(frameRate): #writer for files receiving frameRate frames per second (less than framesPerSecond for decimated files)
+        if not profile['segmentSeconds']:
+            return encoder.writer
+        # rolling files, e.g. mouse12_2021_02_01_09_30_59_000.mp4, _001.mp4, ... listed in <file>_segments.json
+        return lambda fileName, **kwargs: SegmentedSink(fileName, factory=encoder.writer, segmentSeconds=profile['segmentSeconds'], frameRate=frameRate,
+                                                        manifestName=os.path.splitext(fileName)[0] + '_segments.json', **kwargs)
+    factory = writerFactory(profile['framesPerSecond'])
+    if tracking or profile['archiveEvery'] > 1: # cropped/binned/decimated copies of the ring frames (frameTransform.py)
+        return makeTransformSink(profile, movieName, encoder, writerFactory, outputdict, tracking)
+    if profile['separateFiles']: # one encoder per camera, e.g. mouse12_2021_02_01_09_30_59_camTop.mp4
+        sink = PerCameraSink([encoder.fileName(movieName + '_' + name) for name in profile.names], factory=factory,
+                             indexName=movieName + '_index.csv', pixFmts=pixFmts, outputdict=outputdict)
+        return sink, encoder.fileName(movieName)
+    sink = factory(encoder.fileName(movieName), outputdict=outputdict, pixFmt=pixFmt)
+    return sink, sink.segmentName(0) + ', ...' if profile['segmentSeconds'] else encoder.fileName(movieName)
+
+def makeTransformSink(profile, movieName, encoder, writerFactory, outputdict, tracking): #full resolution file(s) with every archiveEvery-th frame,
+    #plus <movie>_tracking with the trackingCrop of each camera binned by trackingBinning at the full frame rate
+    settings = profile.settings
+    factory = writerFactory(profile['framesPerSecond']/profile['archiveEvery']) #so segments of the decimated files still last segmentSeconds
+    if profile['trackingBinning'] and any(isBayer(s.pixelFormat) for s in settings):
+        raise ValueError('trackingBinning mixes the colors of Bayer images; use trackingCrop alone')
+    if profile['separateFiles']: # one file per camera; a stream that leaves out the other cameras
+        fileNames = [encoder.fileName(movieName + '_' + name) for name in profile.names]
+        streams = [TransformStream(factory(fileName, outputdict=outputdict, pixFmt=s.pixFmt()),
+                                   [FrameTransform() if c == n else None for c in range(len(settings))], profile['archiveEvery'])
+                   for n, (fileName, s) in enumerate(zip(fileNames, settings))]
+    else:
+        fileNames = [encoder.fileName(movieName)]
+        streams = [TransformStream(factory(fileNames[0], outputdict=outputdict, pixFmt=streamPixFmt(settings)), every=profile['archiveEvery'])]
+    if tracking:
+        fileNames.append(encoder.fileName(movieName + '_tracking'))
+        transforms = [FrameTransform(crop, profile['trackingBinning'] or 1) for crop in profile.trackingCrops]
+        streams.append(TransformStream(writerFactory(profile['framesPerSecond'])(fileNames[-1], outputdict=outputdict, pixFmt=streamPixFmt(settings)), transforms))
+    return TransformSink(streams, indexName=movieName + '_index.csv'), ', '.join(fileNames) #index: frame number of each frame index in each file
+
+def makePreview(profile): #preview stage from the profile's preview option, or None
+    preview = profile['preview']
+    if preview in (None, 'none', False):
+        return None
+    if preview == 'tk':
+        from preview import TkPreview #imported here so headless rigs do not need tkinter
+        return TkPreview(sum(s.width for s in profile.settings), max(s.height for s in profile.settings), title="camera acquisition")
+    from previewServer import PreviewServer
+    return PreviewServer(profile.previewPort(), host='0.0.0.0', title="camera acquisition")
+
+def runSession(profile, subject, spin=None, now=None): #capture one session; returns the number of frames captured
+    if spin is None:
+        import PySpin as spin
+    now = now or datetime.now()
+    saveFolder = profile.saveFolder(subject, now)
+    os.makedirs(saveFolder, exist_ok=True)
+    movieName = os.path.join(saveFolder, profile.movieName(subject, now))
+    registry = CameraRegistry(list(zip(profile.names, profile.serials)), spin) #cameras by serial number, in profile order
+    engine = None
+    try:
+        registry.initAll(profile.settings, profile['configCache'], profile['userSet']) #in parallel; prints each camera's init time
+        sink, fileName = makeSink(profile, movieName)
+        print('Video will be saved to: {}'.format(fileName))
+        print('# frames = {:d}'.format(profile['framesToRecord']))
+        engine = CaptureEngine(registry.cameras(), profile.settings, sink=sink, preview=makePreview(profile), numFrames=profile['framesToRecord'],
+                               camTimeout=profile['camTimeout'], names=registry.names, ringSlots=profile['ringSlots'], overflow=profile['overflow'],
+                               dropLogName=movieName + '_drops.csv' if profile['dropLog'] else None,
+                               traceName=movieName + '_trace.npy' if profile['trace'] else None,
+                               reconnect=registry.reacquire if profile['reconnect'] else None, reconnectTimeout=profile['reconnectTimeout'],
+                               spin=spin, streamLogName=movieName + '_stream.csv' if profile['streamLog'] else None,
+                               metadataName=None if profile['metadata'] in (None, 'none', False) else movieName + '_{camera}_meta.' + profile['metadata'])
+        framesCaptured = engine.run()
+    finally:
+        del engine #the engine's cameras, workers and event handlers must be gone before the Spinnaker system is released
+        try:
+            registry.release()
+        except Exception as e: #never replaces the session result or the error that ended it
+            print('WARNING: releasing the cameras failed: {}'.format(e))
+    return framesCaptured
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a capture session from a rig profile (.yaml or .toml)')
+    parser.add_argument('profile', help='rig profile file')
+    parser.add_argument('--subject', required=True, help='subject (mouse) ID, used in the file names')
+    parser.add_argument('--seconds', type=float, default=None, help='override the session length')
+    parser.add_argument('--frames', type=int, default=None, help='override the number of frames to record')
+    parser.add_argument('--save-folder', default=None, help='override the profile saveFolder')
+    parser.add_argument('--preview', default=None, help="override the preview: 'tk', 'none' or a port number")
+    parser.add_argument('--encoder', default=None, help='override the encoder')
+    parser.add_argument('--synthetic', action='store_true', help='use synthetic cameras (syntheticSpin.py) at framesPerSecond instead of PySpin')
+    args = parser.parse_args()
+    try:
+        profile = RigProfile.load(args.profile)
+    except (OSError, ValueError, RuntimeError) as e:
+        print('ERROR: {}'.format(e))
+        sys.exit(2)
+    for key, value in (('saveFolder', args.save_folder), ('preview', args.preview), ('encoder', args.encoder), ('framesToRecord', args.frames)):
+        if value is not None:
+            profile.session[key] = value
+    if args.seconds is not None and args.frames is None:
+        profile.session['framesToRecord'] = int(round(profile['framesPerSecond']*args.seconds))
+    spin = None
+    if args.synthetic:
+        import syntheticSpin as spin
+        spin.configure(len(profile.names), serials=[serial or str(20000000 + n) for n, serial in enumerate(profile.serials)],
+                       frameRate=profile['framesPerSecond'], sensorWidth=max(s.width + s.offsetX for s in profile.settings),
+                       sensorHeight=max(s.height + s.offsetY for s in profile.settings))
+    try:
+        framesCaptured = runSession(profile, args.subject, spin)
+    except (RuntimeError, ValueError) as e: #e.g. a camera in the profile is not connected, or settings that cannot be combined
+        print('ERROR: {}'.format(e))
+        sys.exit(2)
+    print('Done!')
+    sys.exit(0 if framesCaptured == profile['framesToRecord'] else 1)
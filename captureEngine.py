@@ -0,0 +1,799 @@
+# =============================================================================
+#  Shared capture engine for any number of FLIR cameras, based on the original
+#  cameraCapture*.py scripts. Each camera gets its own acquisition thread that
+#  grabs images with GetNextImage and copies them straight into its column slice
+#  of a preallocated composite frame (frameRing.py), so frames from all cameras
+#  end up side by side without np.concatenate. A FrameSynchronizer (frameSync.py)
+#  hands each completed composite frame to the acquisition loop (its own thread),
+#  which passes it to a pluggable sink stage (anything with writeFrame() and close(),
+#  e.g. ffmpegWriter.FFmpegPipeWriter) that reads the ring slot in place and frees
+#  it once the frame has been written. The pluggable preview stage (anything with
+#  update(frame, text), setStatus(text) and close(), e.g. preview.TkPreview or
+#  previewServer.PreviewServer for headless rigs; a list shows several at once) runs
+#  on its own in the main thread: it samples a downscaled copy of the latest frame
+#  at a fixed wall-clock rate, so its cost does not depend on the camera frame rate
+#  and a slow redraw never holds up frame pairing or the sink. The ring
+#  has a fixed size, and its overflow policy (block, dropNewest, dropOldest or
+#  spill) decides what happens when the sink falls behind. A sink can also take
+#  over the whole saving thread by providing consume(ring), and ask for the ring
+#  to be allocated in shared memory with sharedMemory = True; processSink.py uses
+#  this to run the encoder in a separate process, and perCameraSink.py asks for
+#  a per-camera ring layout (ringLayout = 'perCamera') to encode each camera to
+#  its own file in parallel.
+#
+#  Cameras only need to be PySpin-compatible objects (Init, GetNextImage,
+#  BeginAcquisition, EndAcquisition and the QuickSpin nodes used in initCam), so
+#  a synthetic in-process camera can drive the engine without any hardware.
+#
+#  Instead of a thread blocking in GetNextImage, a camera can deliver its images
+#  through a Spinnaker ImageEventHandler (CameraSettings(acquisition='event')):
+#  the driver's event thread calls back for every image, the callback copies it
+#  into the ring and returns, and the camera's thread only watches for timeouts
+#  and lost cameras. Polling and event cameras can be mixed in one session.
+#
+#  During acquisition a StreamMonitor (streamStats.py) reads each camera's
+#  transport layer counters, so the end of session report can say whether
+#  missing frames were lost in the camera, on USB or in the host buffers, and
+#  suggests a host buffer count (CameraSettings(bufferCount=...)). With a
+#  metadataName, each camera thread also records FrameID, timestamps and (with
+#  CameraSettings(chunkData=True)) the chunk data of every image into a sidecar
+#  file per camera (frameMetadata.py).
+#
+#  Color cameras can capture in their Bayer 8-bit format (e.g.
+#  CameraSettings(pixelFormat='BayerRG8')), 1 byte per pixel like Mono8; the
+#  colors are interpolated by ffmpeg while encoding (streamPixFmt gives the
+#  sink's bayer_* input format) and the preview is debayered at half resolution
+#  in NumPy (debayer.py), so nothing is debayered on the acquisition path.
+#  Mono12Packed/Mono12p/Mono16 cameras keep the bits of the 10/12-bit ADC: the
+#  camera thread unpacks each image into a uint16 ring slot (highBitDepth.py),
+#  the sink gets gray16le frames and the preview shows their top 8 bits.
+#  CameraSettings(binning=2) bins 2x2 on the sensor (width, height and offsets
+#  are then in binned pixels); cameras without binning nodes send the full
+#  region and the camera thread mean-pools it straight into the ring slot.
+#  Cropping, binning and decimating only some outputs is frameTransform.py.
+#
+#  run() ends capture on Ctrl-C or SIGTERM (e.g. from a scheduler) the same
+#  way: the signal only sets a flag, and the main thread then stops the
+#  cameras (all at once), flushes the metadata, and waits for the sink to write
+#  what is left in the ring while showing how many frames are left and an ETA.
+#  Repeated signals during shutdown do not interrupt the writing, and a failure
+#  while starting or reporting still closes the sink, so the video is kept.
+# =============================================================================
+
+import os, json, time, signal, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from frameRing import FrameRing
+from frameSync import FrameSynchronizer
+from stageTrace import StageTrace
+from streamStats import StreamMonitor, BacklogMeter, STREAM_INTERVAL
+from frameMetadata import FrameMetadata, CHUNK_ENTRIES
+from debayer import isBayer, bayerPixFmt, debayerComposite
+from highBitDepth import HIGH_BIT_FORMATS, UNPACKERS, isHighBitDepth, imageBytes, preview8
+from frameTransform import meanPool, accumulatorDtype
+try:
+    import PySpin
+except ImportError: #the engine can still run PySpin-compatible cameras without the Spinnaker SDK installed
+    PySpin = None
+
+COLOR_PIXEL_FORMATS = ('RGB8Packed', 'RGB8', 'BGR8') #pixel formats delivered as 3 x 8-bit channels per pixel
+RECONNECT_INTERVAL = 0.5 #in seconds; how often a lost camera is looked for
+ACQUISITION_MODES = ('poll', 'event')
+SHUTDOWN_SIGNALS = ('SIGINT', 'SIGTERM', 'SIGBREAK') #end capture gracefully; SIGBREAK is Ctrl-Break on Windows
+DRAIN_INTERVAL = 0.5 #in seconds; how often the progress of writing the rest of the ring is shown during shutdown
+
+class CameraSettings: #per-camera acquisition parameters; defaults match cameraCapture2cams.py
+    def __init__(self, exposureTime=500, gain=0, gamma=0.4, adcBitDepth='Bit10', pixelFormat='Mono8',
+                 width=400, height=400, offsetX=160, offsetY=72, triggered=True, acquisition='poll',
+                 bufferCount=None, chunkData=False, binning=1):
+        self.exposureTime = exposureTime #in microseconds
+        self.gain = gain #in dB, 0-40
+        self.gamma = gamma #0.25-1
+        self.adcBitDepth = adcBitDepth #'Bit8', 'Bit10' or 'Bit12'
+        self.pixelFormat = pixelFormat #'Mono8', 'RGB8Packed', a Bayer format such as 'BayerRG8' (1 byte per pixel, debayered by ffmpeg),
+                                        #or 'Mono12Packed', 'Mono12p' or 'Mono16' to keep the bits of a 10/12-bit ADC (uint16 frames)
+        self.width = width #should be divisible by 16 for H264 compressed encoding
+        self.height = height #should be divisible by 16 for H264 compressed encoding
+        self.offsetX = offsetX #must be divisible by 4
+        self.offsetY = offsetY #must be divisible by 4
+        self.triggered = triggered #True to wait for triggers on Line 0, False to free run as fast as possible
+        self.acquisition = acquisition #'poll' (a thread blocks in GetNextImage) or 'event' (ImageEventHandler callbacks)
+        self.bufferCount = bufferCount #host stream buffers: a number, 'auto' to let Spinnaker choose, or None to leave the camera's setting
+        self.chunkData = chunkData #True to send FrameID, timestamp, exposure time, gain and line status with every image (frameMetadata.py)
+        self.binning = binning #1, 2 or 4; bin on the sensor (mean of binning x binning pixels), or in software on cameras that cannot
+
+    def frameShape(self): #numpy shape of one frame from this camera
+        if self.pixelFormat in COLOR_PIXEL_FORMATS:
+            return (self.height, self.width, 3)
+        return (self.height, self.width)
+
+    def frameDtype(self): #numpy dtype of one frame from this camera, as stored in the frame ring
+        return np.uint16 if isHighBitDepth(self.pixelFormat) else np.uint8
+
+    def imageBytes(self): #bytes of one image as sent by the camera and held in a host buffer
+        if isHighBitDepth(self.pixelFormat):
+            return imageBytes(self.pixelFormat, self.height, self.width)
+        return int(np.prod(self.frameShape()))
+
+    def pixFmt(self): #ffmpeg rawvideo pix_fmt of frames from this camera
+        if self.pixelFormat in COLOR_PIXEL_FORMATS:
+            return 'rgb24'
+        if isHighBitDepth(self.pixelFormat):
+            return 'gray16le'
+        if isBayer(self.pixelFormat):
+            return bayerPixFmt(self.pixelFormat)
+        return 'gray'
+
+def streamPixFmt(settings): #ffmpeg pix_fmt of the side by side stream of cameras with these CameraSettings
+    pixFmts = set(camSettings.pixFmt() for camSettings in settings)
+    if len(pixFmts) > 1 and any(isBayer(camSettings.pixelFormat) for camSettings in settings):
+        raise ValueError('Bayer cameras can only share a video file with cameras of the same Bayer pattern; write one file per camera instead')
+    return 'rgb24' if 'rgb24' in pixFmts else pixFmts.pop()
+
+# SETUP FUNCTIONS #############################################################################################################
+def cameraSerial(cam): #serial number string of a PySpin camera
+    return cam.TLDevice.DeviceSerialNumber.ToString()
+
+def cameraConfig(settings, spin=None, sensorBinning=True): #ordered (node name, value) writes that configure a camera for synchronized capture
+    #sensorBinning=False for cameras without binning nodes: they send the unbinned region, which CameraWorker bins in software
+    spin = spin or PySpin #PySpin module, or a compatible module providing the same enumeration constants
+    # set acquisition. Continuous acquisition. Auto exposure off. Set frame rate using exposure time.
+    config = [('AcquisitionMode', spin.AcquisitionMode_Continuous), ('ExposureAuto', spin.ExposureAuto_Off),
+              ('ExposureMode', spin.ExposureMode_Timed), #Timed or TriggerWidth (must comment out trigger parameters other that Line)
+              ('ExposureTime', settings.exposureTime), ('AcquisitionFrameRateEnable', False)]
+    # set analog. Set Gain + Gamma.
+    config += [('GainAuto', spin.GainAuto_Off), ('Gain', settings.gain), ('GammaEnable', True), ('Gamma', settings.gamma)]
+    # set ADC bit depth and image pixel depth, binning (before the size, which is in binned pixels), size
+    config += [('AdcBitDepth', getattr(spin, 'AdcBitDepth_' + settings.adcBitDepth)), ('PixelFormat', getattr(spin, 'PixelFormat_' + settings.pixelFormat))]
+    scale = 1
+    if sensorBinning:
+        config += [('BinningHorizontal', settings.binning), ('BinningVertical', settings.binning)]
+    else:
+        scale = settings.binning
+    config += [('Width', settings.width*scale), ('Height', settings.height*scale), ('OffsetX', settings.offsetX*scale), ('OffsetY', settings.offsetY*scale)]
+    if settings.triggered: # set trigger input to Line0 (the black wire)
+        config += [('TriggerMode', spin.TriggerMode_On), ('TriggerOverlap', spin.TriggerOverlap_ReadOut), #Off or ReadOut to speed up
+                   ('TriggerSource', spin.TriggerSource_Line0), ('TriggerActivation', spin.TriggerActivation_RisingEdge), #LevelHigh or RisingEdge
+                   ('TriggerSelector', spin.TriggerSelector_FrameStart)] # require trigger for each frame
+    else:
+        config += [('TriggerMode', spin.TriggerMode_Off)] #just free run
+    # send exposure active signal on Line 1 (the white wire)
+    config += [('LineSelector', spin.LineSelector_Line1), ('LineMode', spin.LineMode_Output),
+               ('LineSource', spin.LineSource_ExposureActive)] #route desired output to Line 1 (try Counter0Active or ExposureActive)
+    return config
+
+class ConfigCache: #JSON file with the configuration last applied to each camera (by serial number), to skip unchanged node writes
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock = threading.Lock() #cameras are initialized in parallel
+        self.entries = {}
+        if os.path.exists(fileName):
+            try:
+                with open(fileName) as f:
+                    self.entries = json.load(f)
+            except ValueError: #damaged cache; every camera is configured from scratch
+                print('WARNING: ignoring unreadable camera config cache {}'.format(fileName))
+
+    def get(self, serial): #{'config': [[node, value], ...], 'userSet': name or None}, or None
+        with self.lock:
+            return self.entries.get(serial)
+
+    def put(self, serial, config, userSet=None):
+        with self.lock:
+            self.entries[serial] = {'config': [list(write) for write in config], 'userSet': userSet}
+            tempName = self.fileName + '.tmp'
+            with open(tempName, 'w') as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(tempName, self.fileName) #never leave a half-written cache behind
+
+def hasSensorBinning(cam, spin=None): #True if the camera has writable binning nodes (e.g. Blackfly S)
+    spin = spin or PySpin
+    try:
+        return spin.IsAvailable(cam.BinningHorizontal) and spin.IsWritable(cam.BinningHorizontal) and spin.IsWritable(cam.BinningVertical)
+    except AttributeError: #no such node
+        return False
+
+def cameraBinning(cam): #binning currently applied by the camera, 1 for cameras without binning nodes
+    try:
+        return int(cam.BinningHorizontal.GetValue())
+    except Exception: #no such node, or not readable
+        return 1
+
+def softwareBinning(settings, factor): #unpack function for the ring: mean of each factor x factor block of an unbinned image, written into the slot
+    shape = (settings.height*factor, settings.width*factor) + settings.frameShape()[2:]
+    unpack = UNPACKERS.get(settings.pixelFormat)
+    full = np.empty(shape, settings.frameDtype()) if unpack is not None else None #unpacked high bit depth image, reused for every frame
+    acc = np.empty(settings.frameShape(), accumulatorDtype(settings.frameDtype()))
+    def unpackBinned(raw, out):
+        if unpack is not None:
+            unpack(raw, full)
+            meanPool(full, factor, out, acc)
+        else:
+            meanPool(raw.reshape(shape), factor, out, acc)
+    return unpackBinned
+
+def readNodes(cam, config): #current value of each node in config; nodes that cannot be read are left out (and so written)
+    current = {}
+    for name, value in config:
+        try:
+            current[name] = getattr(cam, name).GetValue()
+        except Exception: #e.g. not readable in the camera's current mode
+            pass
+    return current
+
+def sameValue(current, value): #floats read back from the camera are rounded to the node's increment
+    if isinstance(value, float) or isinstance(current, float):
+        return isinstance(current, (int, float)) and abs(current - value) <= 1e-3*max(abs(value), 1.0)
+    return current == value
+
+def writeNodes(cam, config, current): #write the nodes whose value differs from current (dict of node -> value); returns the number written
+    written = 0
+    if any(not sameValue(current.get(name), value) for name, value in config if name in ('Width', 'Height')):
+        for name in ('OffsetX', 'OffsetY'): #a larger ROI may not fit at the old offsets
+            if current.get(name, 0) != 0:
+                getattr(cam, name).SetValue(0)
+                current[name] = 0
+                written += 1
+    for name, value in config:
+        if name not in current or not sameValue(current[name], value):
+            getattr(cam, name).SetValue(value)
+            written += 1
+    return written
+
+def enableChunkData(cam, spin): #send the chunk data recorded by frameMetadata.py with every image; returns the number of node writes
+    written = 0
+    if not cam.ChunkModeActive.GetValue():
+        cam.ChunkModeActive.SetValue(True)
+        written += 1
+    for entry in CHUNK_ENTRIES:
+        cam.ChunkSelector.SetValue(getattr(spin, 'ChunkSelector_' + entry))
+        written += 1
+        if not cam.ChunkEnable.GetValue():
+            cam.ChunkEnable.SetValue(True)
+            written += 1
+    return written
+
+def initCam(cam, settings, spin=None, cache=None, userSet=None): #function to initialize camera parameters for synchronized capture
+    #with a ConfigCache, only nodes that changed since this camera was last configured are written; with userSet (e.g. 'UserSet1')
+    #the configuration is also saved on the camera, so the next session with the same settings loads it in one call
+    #returns the number of node writes
+    spin = spin or PySpin #PySpin module, or a compatible module providing the same enumeration constants
+    cam.Init()
+    config = cameraConfig(settings, spin, hasSensorBinning(cam, spin))
+    serial = cameraSerial(cam) if cache is not None else None
+    entry = cache.get(serial) if cache is not None else None
+    cached = entry is not None and [list(write) for write in config] == entry['config']
+    if cached and entry['userSet']: # whole configuration saved on the camera; read back in case the user set was overwritten since
+        cam.UserSetSelector.SetValue(getattr(spin, 'UserSetSelector_' + entry['userSet']))
+        cam.UserSetLoad()
+        written = 2 + writeNodes(cam, config, readNodes(cam, config))
+    elif entry is not None: # camera was configured by us before: write only what differs from its current values
+        written = writeNodes(cam, config, readNodes(cam, config))
+    else: # load default configuration, then apply every setting
+        cam.UserSetSelector.SetValue(spin.UserSetSelector_Default)
+        cam.UserSetLoad()
+        written = 2 + writeNodes(cam, config, {})
+    if settings.chunkData:
+        written += enableChunkData(cam, spin)
+    if userSet is not None and not (cached and entry['userSet'] == userSet):
+        cam.UserSetSelector.SetValue(getattr(spin, 'UserSetSelector_' + userSet))
+        cam.UserSetSave()
+        written += 2
+    # setup FIFO buffer (stream settings are not part of user sets)
+    camTransferLayerStream = cam.GetTLStreamNodeMap()
+    handling_mode1 = spin.CEnumerationPtr(camTransferLayerStream.GetNode('StreamBufferHandlingMode'))
+    handling_mode_entry = handling_mode1.GetEntryByName('OldestFirst')
+    handling_mode1.SetIntValue(handling_mode_entry.GetValue())
+    if settings.bufferCount is not None: # host buffers absorb stalls in the program; see the buffer count suggested after a session
+        buffer_count_mode = spin.CEnumerationPtr(camTransferLayerStream.GetNode('StreamBufferCountMode'))
+        if settings.bufferCount == 'auto':
+            buffer_count_mode.SetIntValue(buffer_count_mode.GetEntryByName('Auto').GetValue())
+        else:
+            buffer_count_mode.SetIntValue(buffer_count_mode.GetEntryByName('Manual').GetValue())
+            buffer_count = spin.CIntegerPtr(camTransferLayerStream.GetNode('StreamBufferCountManual'))
+            buffer_count.SetValue(int(settings.bufferCount))
+            written += 1
+        written += 1
+    if cache is not None:
+        cache.put(serial, config, userSet if userSet is not None else (entry['userSet'] if cached else None))
+    return written + 1
+
+def initCams(cams, settings, spin=None, names=None, cache=None, userSet=None): #initialize all cameras in parallel; returns init times in seconds
+    if isinstance(settings, CameraSettings):
+        settings = [settings]*len(cams)
+    names = list(names) if names is not None else ['cam' + str(n+1) for n in range(len(cams))]
+    if isinstance(cache, str): #file name
+        cache = ConfigCache(cache)
+    def timedInit(cam, camSettings):
+        t = time.perf_counter()
+        written = initCam(cam, camSettings, spin, cache, userSet)
+        return time.perf_counter() - t, written
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(cams)) as pool: #node access waits on USB, so the cameras overlap
+        results = list(pool.map(timedInit, cams, settings))
+    for name, (initTime, written) in zip(names, results):
+        print('{} initialized in {:.3f}sec ({} node writes)'.format(name, initTime, written))
+    print('Cameras initialized in {:.3f}sec'.format(time.perf_counter() - t))
+    return [initTime for initTime, written in results]
+
+def saveImage(ring, writer): #function to save completed video frames from the frame ring in a separate thread
+    failed = False #once the writer fails, the ring is still drained so the cameras and the engine can finish
+    while True:
+        index, frame = ring.nextCompleted()
+        if index is None: #ring has been drained after the end of acquisition
+            break
+        try:
+            if frame is not None and not failed: #None if the frame was dropped by the ring's overflow policy
+                writer.writeFrame(ring.compositeOf(frame)) #call to ffmpeg, reading the composite frame in place
+        except Exception as error: #e.g. BrokenPipeError when ffmpeg has exited
+            failed = True
+            print('\nERROR: writing frame {} failed ({!r}); the rest of the session is not written'.format(index, error))
+        finally:
+            ring.finishRead(index) #slot can now be reused by the cameras
+
+# ACQUISITION ##################################################################################################################
+class CameraWorker(threading.Thread): #acquisition thread for one camera: grab image, copy into the frame ring, release from buffer
+    def __init__(self, name, cam, settings, sync, camIndex, numFrames=None, camTimeout=1000, matchBy='arrival', frameRate=None, trace=None,
+                 reconnect=None, reconnectTimeout=None, metadata=None):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.cam = cam
+        self.sync = sync #FrameSynchronizer shared by all cameras
+        self.camIndex = camIndex
+        self.settings = settings
+        self.numFrames = numFrames #None to capture until stop() is called
+        self.camTimeout = camTimeout #in ms; time to wait for another image before aborting
+        self.stopEvent = threading.Event()
+        self.matchBy = matchBy #'frameID', 'timestamp' or 'arrival'; how frames are matched across cameras
+        self.framePeriod = 1e9/frameRate if frameRate else None #in ns, to convert timestamps to frame indexes
+        self.firstTimestamp = None
+        self.trace = trace #StageTrace shared by all stages, or None
+        self.reconnect = reconnect #function(name) returning the lost camera re-initialized (resume() begins acquisition), or None; None to end on a timeout
+        self.reconnectTimeout = reconnectTimeout #in seconds; how long to look for a lost camera, None until capture ends
+        self.indexOffset = 0 #added to the frame indexes of a re-acquired camera, whose FrameID starts again at 0
+        self.realign = False
+        self.reconnects = 0
+        self.unpack = UNPACKERS.get(settings.pixelFormat) #writes a packed or 16-bit image into the ring slot, None for a plain copy
+        if settings.binning > cameraBinning(cam): #camera could not bin (see initCam): mean-pool each image into the slot instead
+            self.unpack = softwareBinning(settings, settings.binning//cameraBinning(cam))
+        self.backlog = BacklogMeter() #longest wait of images in the host buffers, for the buffer count suggestion
+        self.metadata = metadata #FrameMetadata recording every image received, or None
+        self.lastIndex = -1
+        self.framesCaptured = 0
+        self.timedOut = False
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def begin(self): #begin acquisition on the camera
+        self.cam.BeginAcquisition()
+
+    def end(self): #end acquisition, e.g. on a lost camera before looking for it again
+        try:
+            self.cam.EndAcquisition()
+        except Exception: #camera is gone, or acquisition already ended
+            pass
+
+    def resume(self, cam): #carry on with a re-acquired camera (initialized, not acquiring yet)
+        self.cam = cam
+        self.begin()
+
+    def grab(self): #get pointer to next image in camera buffer; blocks until image arrives via USB
+        if self.framesCaptured == 0 and self.settings.triggered:
+            return self.cam.GetNextImage() #wait infinitely for trigger for first image while waiting for DAQ to start sending triggers
+        return self.cam.GetNextImage(self.camTimeout)
+
+    def frameIndex(self, image): #index used to match this image with the other cameras' images
+        if self.matchBy == 'frameID':
+            return image.GetFrameID() #counts triggers on the camera, so dropped frames leave a gap
+        if self.matchBy == 'timestamp': #chunk timestamp in ns since this camera's first frame, in frame periods
+            timestamp = image.GetTimeStamp()
+            if self.firstTimestamp is None:
+                self.firstTimestamp = timestamp
+            return int(round((timestamp - self.firstTimestamp)/self.framePeriod))
+        return self.framesCaptured
+
+    def reacquire(self): #look for the lost camera until it is back, capture ends or reconnectTimeout passes; True if it is back
+        self.end()
+        tEnd = None if self.reconnectTimeout is None else time.perf_counter() + self.reconnectTimeout
+        while not self.stopEvent.is_set() and (tEnd is None or time.perf_counter() < tEnd):
+            cam = None
+            try:
+                cam = self.reconnect(self.name)
+                if cam is not None:
+                    self.resume(cam)
+                    return True
+            except Exception: #e.g. camera found but not ready yet
+                if cam is not None:
+                    self.end() #e.g. unregister the event handler before trying again
+            self.stopEvent.wait(RECONNECT_INTERVAL)
+        return False
+
+    def lost(self): #True if this camera failed while the other cameras were still receiving images (not the end of the triggers)
+        return self.reconnect is not None and self.sync.othersReceiving(self.camIndex, time.perf_counter() - self.camTimeout/1000.0)
+
+    def recover(self): #after no image arrived in time: True if the camera was lost and is back, False if capture ends here
+        if self.stopEvent.is_set():
+            return False
+        if self.lost(): #e.g. a USB hiccup: keep the session going without this camera and try to get it back
+            print('WARNING: {} lost after frame {}; trying to reconnect while the other cameras keep recording'.format(self.name, self.lastIndex))
+            self.sync.disconnect(self.camIndex)
+            if self.reacquire():
+                print('{} reconnected'.format(self.name))
+                self.realign = True
+                self.firstTimestamp = None
+                self.backlog.restart()
+                self.reconnects += 1
+                return True
+            print('WARNING: {} could not be reconnected'.format(self.name))
+            return False
+        self.timedOut = True
+        print('WARNING: {} timeout waiting for trigger! Aborting...press Ctrl-C to stop'.format(self.name))
+        print('{} frames captured'.format(self.framesCaptured))
+        return False
+
+    def store(self, image, tRequested, tReceived): #match an image to its frame index and copy it into the ring
+        index = self.frameIndex(image)
+        if self.realign: #first image from a re-acquired camera: match it to the frame the others received at the same time
+            matched = self.sync.indexAt(tReceived)
+            self.indexOffset = (matched if matched is not None else self.lastIndex + 1) - index
+            self.sync.reconnect(self.camIndex, index + self.indexOffset)
+            self.realign = False
+        self.lastIndex = index + self.indexOffset
+        self.backlog.add(tReceived, image.GetTimeStamp())
+        if self.metadata is not None:
+            self.metadata.record(self.lastIndex, image, tReceived)
+        stored = self.sync.put(self.camIndex, np.asarray(image.GetData()), self.lastIndex, self.unpack) #copied (or unpacked) from the PySpin buffer into the ring
+        if stored and self.trace is not None:
+            self.trace.markCamera(self.lastIndex, self.camIndex, tRequested, tReceived, time.perf_counter())
+        self.framesCaptured += 1
+
+    def run(self):
+        try:
+            while not self.stopEvent.is_set():
+                if self.numFrames is not None and self.lastIndex + 1 >= self.numFrames:
+                    break #stop loop when expected # frames found
+                tRequested = time.perf_counter()
+                try:
+                    image = self.grab()
+                except Exception: #PySpin will throw an exception upon timeout, so end gracefully
+                    if self.recover():
+                        continue
+                    break
+                self.store(image, tRequested, time.perf_counter())
+                image.Release() #release from camera buffer
+        finally: #always let the synchronizer know, so the main loop never waits for a dead thread
+            self.sync.end(self.camIndex)
+
+def imageEventHandler(spin, onImage): #spin.ImageEventHandler that calls onImage(image) on the driver's event thread for every image
+    class ImageHandler(spin.ImageEventHandler):
+        def OnImageEvent(self, image): #the image is released by Spinnaker when this returns
+            onImage(image)
+    return ImageHandler()
+
+class EventCameraWorker(CameraWorker): #acquisition by image events: the callback copies each image into the ring, this thread watches for timeouts
+    def __init__(self, name, cam, settings, sync, camIndex, spin, **kwargs):
+        CameraWorker.__init__(self, name, cam, settings, sync, camIndex, **kwargs)
+        self.handler = imageEventHandler(spin, self.onImage)
+        self.arrived = threading.Event() #set by every callback
+        self.storeLock = threading.Lock() #no image is stored once the thread has ended
+        self.done = False
+        self.tReturned = None #when the last callback returned; the grab stage is the time between callbacks
+
+    def stop(self):
+        self.stopEvent.set()
+        self.arrived.set()
+
+    def begin(self): #the handler must be registered before acquisition begins
+        self.cam.RegisterEventHandler(self.handler)
+        self.tReturned = time.perf_counter()
+        self.cam.BeginAcquisition()
+
+    def end(self):
+        CameraWorker.end(self)
+        try:
+            self.cam.UnregisterEventHandler(self.handler)
+        except Exception: #camera is gone, or the handler was already unregistered
+            pass
+
+    def onImage(self, image): #called on the driver's event thread; copies the image into the ring and returns
+        tReceived = time.perf_counter()
+        with self.storeLock:
+            if not self.done and not self.stopEvent.is_set() and (self.numFrames is None or self.lastIndex + 1 < self.numFrames):
+                self.store(image, self.tReturned, tReceived)
+        self.arrived.set()
+        self.tReturned = time.perf_counter()
+
+    def run(self):
+        try:
+            while not self.stopEvent.is_set():
+                if self.numFrames is not None and self.lastIndex + 1 >= self.numFrames:
+                    break #stop loop when expected # frames found
+                firstTrigger = self.framesCaptured == 0 and self.settings.triggered #wait infinitely for the DAQ to start sending triggers
+                if self.arrived.wait(None if firstTrigger else self.camTimeout/1000.0):
+                    self.arrived.clear()
+                elif not self.recover():
+                    break
+        finally:
+            with self.storeLock:
+                self.done = True
+            self.sync.end(self.camIndex)
+
+class CaptureEngine: #runs one CameraWorker per camera, combines frames and feeds the sink and preview stages
+    def __init__(self, cams, settings, sink=None, preview=None, numFrames=None, camTimeout=1000, previewRate=30, previewStride=1, names=None,
+                 matchBy=None, fill='blank', frameRate=None, dropLogName=None, ringSlots=64, overflow='block', spillDir=None,
+                 traceName=None, statusInterval=1.0, reconnect=None, reconnectTimeout=None, spin=None, streamLogName=None,
+                 streamInterval=STREAM_INTERVAL, metadataName=None):
+        self.cams = list(cams)
+        if isinstance(settings, CameraSettings):
+            settings = [settings]*len(self.cams)
+        self.settings = list(settings)
+        for camSettings in self.settings:
+            if camSettings.acquisition not in ACQUISITION_MODES:
+                raise ValueError('unknown acquisition {!r}; valid values are: {}'.format(camSettings.acquisition, ', '.join(ACQUISITION_MODES)))
+            if isBayer(camSettings.pixelFormat) and any(value % 2 for value in (camSettings.width, camSettings.height, camSettings.offsetX, camSettings.offsetY)):
+                raise ValueError('{} needs an even width, height and offsets to keep the Bayer pattern'.format(camSettings.pixelFormat))
+            if isBayer(camSettings.pixelFormat) and camSettings.binning > 1:
+                raise ValueError('binning mixes the colors of {} images; use a mono pixel format'.format(camSettings.pixelFormat))
+            if camSettings.pixelFormat in HIGH_BIT_FORMATS and camSettings.width % 2:
+                raise ValueError('{} needs an even width (pixels are packed in pairs)'.format(camSettings.pixelFormat))
+        self.spin = spin or PySpin #module providing ImageEventHandler for event acquisition (PySpin or e.g. syntheticSpin)
+        if self.spin is None and any(camSettings.acquisition == 'event' for camSettings in self.settings):
+            raise ValueError("acquisition='event' needs PySpin (or spin=<compatible module>)")
+        self.sink = sink #object with writeFrame(frame) and close(), or None to only preview
+        self.preview = preview #object with update(frame, text), setStatus(text) and close(), a list of them, or None
+        self.previews = [] if preview is None else list(preview) if isinstance(preview, (list, tuple)) else [preview]
+        self.numFrames = numFrames #None to run until Ctrl-C or stop()
+        self.camTimeout = camTimeout
+        self.previewRate = previewRate #in Hz (wall clock); the preview shows the latest frame at this rate whatever the camera rate
+        self.previewStride = previewStride #show every Nth row and column of the composite frame
+        self.bayerPreview = any(isBayer(camSettings.pixelFormat) for camSettings in self.settings) #debayer the preview at half resolution (counts as a stride of 2)
+        self.names = list(names) if names is not None else ['cam' + str(n+1) for n in range(len(self.cams))]
+        if matchBy is None: #triggered cameras share trigger counts, free running cameras can only be paired by arrival
+            matchBy = 'frameID' if all(camSettings.triggered for camSettings in self.settings) else 'arrival'
+        if matchBy == 'timestamp' and not frameRate:
+            raise ValueError('frameRate is needed to match frames by timestamp')
+        self.matchBy = matchBy
+        self.frameRate = frameRate #nominal frames per second
+        self.dropLogName = dropLogName #CSV file listing dropped/late frames, or None
+        self.workers = []
+        shared = getattr(sink, 'sharedMemory', False) #sink reads the ring from another process
+        layout = getattr(sink, 'ringLayout', 'sideBySide') #'perCamera' for sinks writing one file per camera
+        self.ring = FrameRing.forSettings(ringSlots, self.settings, overflow, spillDir, shared, layout) #preallocated composite frames shared by all stages
+        self.sync = FrameSynchronizer(self.ring, fill)
+        self.trace = StageTrace(self.names) #per-frame stage timestamps, cheap enough to always record
+        self.ring.trace = self.trace
+        self.traceName = traceName #file for the stage trace (.csv or .npy), or None
+        self.statusInterval = statusInterval #in seconds; how often the live stage status line is printed, None for never
+        self.statusLength = 0
+        self.reconnect = reconnect #function(name) that re-acquires a lost camera (e.g. CameraRegistry.reacquire), or None
+        self.reconnectTimeout = reconnectTimeout #in seconds; how long to look for a lost camera, None for the rest of the session
+        self.streamLogName = streamLogName #CSV file of each camera's stream counters every streamInterval, or None
+        self.streamInterval = streamInterval #in seconds; how often the stream counters are read, None for never
+        self.monitor = None
+        self.metadataName = metadataName #per-frame metadata file of each camera, with {camera} replaced by its name (e.g. movie_{camera}_meta.npy), or None
+        self.saveThread = None
+        self.combineThread = None
+        self.framesCombined = 0
+        self.tStart = None
+        self.tEndAcq = None
+        self.tEndWrite = None
+        self.stopEvent = threading.Event()
+        self.stopSignal = None #name of the signal that ended capture, e.g. 'SIGTERM'
+        self.signalCount = 0
+
+    def stop(self): #request the main loop to end after the current frame
+        self.stopEvent.set()
+        self.sync.close()
+
+    def makeWorker(self, name, cam, camSettings, camIndex): #acquisition thread for one camera, polling or event driven
+        metadata = None
+        if self.metadataName is not None:
+            metadata = FrameMetadata(self.metadataName.format(camera=name), camSettings.chunkData)
+        options = dict(numFrames=self.numFrames, camTimeout=self.camTimeout, matchBy=self.matchBy, frameRate=self.frameRate, trace=self.trace,
+                       reconnect=self.reconnect, reconnectTimeout=self.reconnectTimeout, metadata=metadata)
+        if camSettings.acquisition == 'event':
+            return EventCameraWorker(name, cam, camSettings, self.sync, camIndex, self.spin, **options)
+        return CameraWorker(name, cam, camSettings, self.sync, camIndex, **options)
+
+    def start(self): #start saving and combining threads, begin acquisition on all cameras and start their threads
+        if self.sink is not None:
+            if hasattr(self.sink, 'consume'): #sink reads the ring itself, e.g. processSink.ProcessSink
+                self.saveThread = threading.Thread(target=self.sink.consume, args=(self.ring,), daemon=True)
+            else:
+                self.saveThread = threading.Thread(target=saveImage, args=(self.ring, self.sink,), daemon=True)
+            self.saveThread.start()
+        self.workers = [self.makeWorker(name, cam, camSettings, c) for c, (name, cam, camSettings) in enumerate(zip(self.names, self.cams, self.settings))]
+        if self.streamInterval:
+            self.monitor = StreamMonitor(self.workers, self.names, self.streamInterval, self.streamLogName)
+            self.monitor.baseline()
+        for worker in self.workers:
+            worker.begin()
+        if self.monitor is not None:
+            self.monitor.start()
+        for worker in self.workers:
+            worker.start()
+        self.combineThread = threading.Thread(target=self.loop, name='combine', daemon=True)
+        self.combineThread.start()
+
+    def nextFrame(self): #wait for the next composite frame (gaps filled); (index, slot), or None if capture has ended
+        return self.sync.get()
+
+    def statusText(self, i):
+        bufferStr = " (buffer " + str(self.ring.fillLevel()) + "/" + str(self.ring.numSlots) + ")"
+        if self.numFrames is not None:
+            return "frame #: " + str(i+1) + " of " + str(self.numFrames) + bufferStr
+        timeElapsed = str(time.time() - self.tStart)
+        return "elapsed time: " + timeElapsed[0:5] + " sec" + bufferStr
+
+    def loop(self): # acquisition loop, in its own thread so a slow preview never holds up frame pairing
+        i = 0
+        while not self.stopEvent.is_set() and i != self.numFrames:
+            nextFrame = self.nextFrame()
+            if nextFrame is None:
+                break
+            if i == 0:
+                self.tStart = time.time()
+                print('Capture begins')
+            index, slot = nextFrame
+            self.trace.mark(index, 'completed', time.perf_counter())
+            if self.sink is None: #nothing else reads the ring, so free the slot here
+                self.ring.nextCompleted()
+                self.ring.finishRead(index)
+            i = i + 1
+            self.framesCombined = i
+        if i == self.numFrames:
+            print('Complete ' + str(i) + ' frames captured')
+
+    def watch(self): #main thread: show the latest frame at previewRate until the acquisition loop ends
+        period = 1.0/self.previewRate
+        lastShown = None
+        tNext = time.perf_counter()
+        tStatus = tNext
+        while self.combineThread.is_alive() and self.stopSignal is None:
+            tNext += period
+            time.sleep(max(0.0, tNext - time.perf_counter())) #sleep (rather than wait on a lock) so Ctrl-C is handled on Windows
+            if tNext < time.perf_counter(): #preview fell behind (e.g. window dragged), skip the missed updates
+                tNext = time.perf_counter()
+            if self.statusInterval and self.framesCombined > 0 and tNext >= tStatus:
+                self.printStatus()
+                tStatus = tNext + self.statusInterval
+            if not self.previews:
+                continue
+            index, frame = self.ring.sampleLatest(1 if self.bayerPreview else self.previewStride) #a copy, so drawing never holds a ring slot
+            if frame is not None and frame.dtype != np.uint8:
+                frame = preview8(frame)
+            if frame is not None and self.bayerPreview:
+                frame = debayerComposite(frame, [s.pixelFormat for s in self.settings], [s.width for s in self.settings])
+                stride = max(1, self.previewStride//2)
+                frame = frame[::stride, ::stride]
+            if frame is not None and index != lastShown and self.framesCombined > 0:
+                text = self.statusText(self.framesCombined - 1)
+                for preview in self.previews:
+                    preview.update(frame, text) #this must be called from main thread
+                lastShown = index
+
+    def printStatus(self): #overwrite the live status line on the console
+        line = self.trace.statusLine(self.ring)
+        if self.monitor is not None:
+            line += ' | ' + self.monitor.statusText()
+        print('\r' + line.ljust(self.statusLength), end='', flush=True)
+        self.statusLength = len(line)
+
+    def finish(self): #end acquisition, wait for the sink to finish writing and close all stages
+        tShutdown = time.perf_counter()
+        self.tEndAcq = time.time()
+        if self.stopSignal is not None:
+            print('\nStopping on {}'.format(self.stopSignal))
+        for worker in self.workers:
+            worker.stop()
+        self.sync.close() #wake camera threads waiting for a ring slot
+        if self.monitor is not None:
+            self.monitor.stop() #last read of the stream counters, while the streams are still open
+        with ThreadPoolExecutor(max_workers=max(1, len(self.workers))) as pool: #EndAcquisition of all cameras at once
+            list(pool.map(lambda worker: worker.end(), self.workers)) #also unregisters image event handlers
+            for worker in self.workers:
+                if worker.ident is not None: #started
+                    worker.join()
+            list(pool.map(lambda worker: worker.metadata.close(), [worker for worker in self.workers if worker.metadata is not None]))
+        self.cams = [worker.cam for worker in self.workers] #re-acquired cameras replace lost ones
+        if self.combineThread is not None:
+            self.combineThread.join()
+        self.ring.endInput() #no more frames will be completed; the saving thread stops once the ring is written
+        tStopped = time.perf_counter()
+        if self.tStart is None: #no frames arrived before the end of acquisition
+            self.tStart = self.tEndAcq
+        if self.statusLength: #end the live status line
+            print('')
+            self.statusLength = 0
+        for preview in self.previews:
+            preview.setStatus('Capture complete, still writing to disk...')
+        try: #the sink writes in the background meanwhile
+            print('Capture ends at: {:.2f}sec'.format(self.tEndAcq - self.tStart))
+            if len(self.cams) > 1:
+                for line in self.sync.waitReport(self.names):
+                    print(line)
+            for line in self.sync.dropReport(self.names):
+                print(line)
+            if self.monitor is not None:
+                for line in self.monitor.report(self.sync, self.settings, self.frameRate):
+                    print(line)
+            print(self.ring.report())
+            if self.dropLogName is not None:
+                self.sync.writeDropLog(self.dropLogName, self.names)
+        finally: #whatever happened, write the rest of the ring and close the files
+            if self.sink is not None:
+                if self.saveThread is not None:
+                    self.drain() #wait until compression and saving queue is done writing to disk
+                tWritten = time.perf_counter()
+                self.tEndWrite = time.time()
+                print('File written at: {:.2f}sec'.format(self.tEndWrite - self.tStart))
+                self.sink.close() #close to FFMPEG writer
+                print('Shutdown took {:.2f}sec: cameras stopped in {:.2f}sec, ring written in {:.2f}sec, files closed in {:.2f}sec'.format(
+                    time.perf_counter() - tShutdown, tStopped - tShutdown, tWritten - tStopped, time.perf_counter() - tWritten))
+            for line in self.trace.report(): #after the sink has written every frame
+                print(line)
+            if self.traceName is not None:
+                self.trace.save(self.traceName)
+            self.ring.close()
+            for preview in self.previews:
+                preview.close()
+
+    def framesLeft(self): #frames in the ring (or spilled to disk) that the sink has not finished writing
+        return self.ring.fillLevel() + len(self.ring.spilled)
+
+    def drain(self): #wait for the saving thread to write the rest of the ring, showing the frames left and an ETA
+        tDrain = time.perf_counter()
+        leftAtStart = self.framesLeft()
+        while self.saveThread.is_alive():
+            self.saveThread.join(DRAIN_INTERVAL)
+            if not self.saveThread.is_alive():
+                break
+            left = self.framesLeft()
+            elapsed = time.perf_counter() - tDrain
+            text = 'Writing to disk: {} frames left'.format(left)
+            if left == 0: #the sink is closing its files
+                text = 'Writing to disk: closing files'
+            elif leftAtStart > left:
+                rate = (leftAtStart - left)/elapsed
+                text += ' ({:.0f}fps, about {:.0f}sec)'.format(rate, left/rate)
+            if self.signalCount > 1:
+                text += '; already stopping, please wait'
+            print('\r' + text.ljust(self.statusLength), end='', flush=True)
+            self.statusLength = len(text)
+            for preview in self.previews:
+                preview.setStatus(text)
+        if self.statusLength:
+            print('')
+            self.statusLength = 0
+
+    def requestStop(self, signum, frame): #signal handler: only sets a flag, the main thread ends capture at its next preview tick
+        self.signalCount += 1
+        if self.stopSignal is None:
+            self.stopSignal = signal.Signals(signum).name
+
+    def installSignals(self, handler): #handle the shutdown signals with handler; {signal: previous handler} (only possible in the main thread)
+        previous = {}
+        if threading.current_thread() is not threading.main_thread():
+            return previous
+        for name in SHUTDOWN_SIGNALS:
+            if hasattr(signal, name):
+                signum = getattr(signal, name)
+                previous[signum] = signal.signal(signum, handler)
+        return previous
+
+    def run(self): #start, loop until done, Ctrl-C or SIGTERM, then finish; returns the number of combined frames
+        previous = self.installSignals(self.requestStop)
+        try:
+            try:
+                self.start()
+                self.watch()
+            except KeyboardInterrupt: #Ctrl-C while the handler could not be installed (not the main thread)
+                pass
+            except BaseException: #still end acquisition and close the files before passing the error on
+                self.finish()
+                raise
+            self.finish()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        return self.framesCombined
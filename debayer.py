@@ -0,0 +1,52 @@
+# =============================================================================
+#  Bayer 8-bit capture for color cameras. With pixelFormat='BayerRG8' (or
+#  BayerGB8/BayerGR8/BayerBG8, whichever pattern the sensor has) the camera
+#  sends its raw color filter array, 1 byte per pixel, instead of debayering on
+#  the camera and sending RGB8 (3 bytes per pixel). That is a third of the USB
+#  bandwidth, host buffer memory and frame ring traffic, so color cameras run at
+#  the frame rates otherwise reached only in Mono8.
+#
+#  Nothing is debayered on the acquisition path. The frames go through the ring
+#  as single-channel images and ffmpeg is given the matching bayer_* rawvideo
+#  pix_fmt (see bayerPixFmt), so it interpolates the colors itself while
+#  encoding. Raw files (rawCapture.py) keep the pattern in their header, so
+#  debayering is deferred entirely to transcoding. Only the preview is
+#  debayered in NumPy, at half resolution (debayerHalf: each 2x2 cell becomes
+#  one RGB pixel), which is a few vectorized slice operations per preview frame.
+#
+#  Widths, heights and offsets must be even so every camera's image (and its
+#  place in the side by side composite) starts on the same Bayer phase.
+# =============================================================================
+
+import numpy as np
+
+BAYER_PATTERNS = {'BayerRG8': 'rggb', 'BayerGB8': 'gbrg', 'BayerGR8': 'grbg', 'BayerBG8': 'bggr'} #Spinnaker pixel format -> 2x2 cell, row by row
+
+def isBayer(pixelFormat):
+    return pixelFormat in BAYER_PATTERNS
+
+def bayerPixFmt(pixelFormat): #ffmpeg rawvideo pix_fmt of a Bayer pixel format, e.g. 'bayer_rggb8'
+    return 'bayer_' + BAYER_PATTERNS[pixelFormat] + '8'
+
+def debayerHalf(raw, pattern): #(height/2, width/2, 3) uint8 RGB image of a Bayer frame: red, mean of the two greens and blue of each 2x2 cell
+    sites = [raw[0::2, 0::2], raw[0::2, 1::2], raw[1::2, 0::2], raw[1::2, 1::2]]
+    greens = [site for site, color in zip(sites, pattern) if color == 'g']
+    rgb = np.empty(sites[0].shape + (3,), dtype=np.uint8)
+    rgb[..., 0] = sites[pattern.index('r')]
+    np.right_shift(greens[0].astype(np.uint16) + greens[1], 1, out=rgb[..., 1], casting='unsafe')
+    rgb[..., 2] = sites[pattern.index('b')]
+    return rgb
+
+def debayerComposite(frame, pixelFormats, widths): #half resolution RGB preview of side by side frames; non-Bayer cameras are subsampled (mono to gray)
+    parts = []
+    x = 0
+    for pixelFormat, width in zip(pixelFormats, widths):
+        raw = frame[:, x:x+width]
+        if isBayer(pixelFormat):
+            parts.append(debayerHalf(raw if raw.ndim == 2 else raw[:, :, 0], BAYER_PATTERNS[pixelFormat])) #3-D in a composite with RGB cameras (same value in each channel)
+        elif raw.ndim == 3:
+            parts.append(raw[0::2, 0::2])
+        else:
+            parts.append(np.repeat(raw[0::2, 0::2, np.newaxis], 3, axis=2))
+        x += width
+    return np.concatenate(parts, axis=1)
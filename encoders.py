@@ -0,0 +1,136 @@
+# =============================================================================
+#  Registry of the ffmpeg encoders that can be used by ffmpegWriter.FFmpegPipeWriter
+#  (software H.264/H.265, NVIDIA NVENC, Intel Quick Sync, VAAPI, FFV1 lossless
+#  and uncompressed raw), so the same script runs on GPU and CPU-only machines.
+#
+#  probeEncoder() checks that an encoder works on this machine and measures
+#  how many frames per second it encodes at a given resolution and pixel format,
+#  using synthetic frames. selectEncoder() probes a list of candidates and picks
+#  the fastest one that sustains the target frame rate; hardware encoders that
+#  are missing simply fail the probe, so CPU-only machines fall back to libx264.
+#
+#  Run this file to benchmark the encoders, e.g.
+#      python encoders.py --width 800 --height 400 --fps 250
+# =============================================================================
+
+import os, time, tempfile, argparse
+import numpy as np
+from ffmpegWriter import FFmpegPipeWriter
+
+class EncoderBackend: #ffmpeg options and container for one encoder
+    def __init__(self, name, outputdict, extension='.mp4', inputdict=None, hardware=False, lossless=False):
+        self.name = name
+        self.outputdict = outputdict #ffmpeg output options
+        self.extension = extension #container the encoder is written to
+        self.inputdict = inputdict or {} #ffmpeg options before the input, e.g. the VAAPI device
+        self.hardware = hardware #True if the encoder runs on a GPU or other dedicated hardware
+        self.lossless = lossless
+
+    def fileName(self, fileName): #fileName with this encoder's container extension
+        return os.path.splitext(fileName)[0] + self.extension
+
+    def writer(self, fileName, outputdict=None, **kwargs): #FFmpegPipeWriter for this encoder; outputdict adds to or overrides the defaults
+        options = dict(self.outputdict)
+        options.update(outputdict or {})
+        return FFmpegPipeWriter(fileName, outputdict=options, inputdict=self.inputdict, **kwargs)
+
+ENCODERS = {backend.name: backend for backend in [
+    EncoderBackend('libx264', {'-vcodec': 'libx264', '-crf': '21'}),
+    EncoderBackend('libx265', {'-vcodec': 'libx265', '-crf': '26'}),
+    EncoderBackend('h264_nvenc', {'-vcodec': 'h264_nvenc'}, hardware=True),
+    EncoderBackend('hevc_nvenc', {'-vcodec': 'hevc_nvenc'}, hardware=True),
+    EncoderBackend('h264_qsv', {'-vcodec': 'h264_qsv', '-pix_fmt': 'nv12'}, hardware=True),
+    EncoderBackend('h264_vaapi', {'-vf': 'format=nv12,hwupload', '-vcodec': 'h264_vaapi'},
+                   inputdict={'-vaapi_device': '/dev/dri/renderD128'}, hardware=True),
+    EncoderBackend('ffv1', {'-vcodec': 'ffv1', '-level': '3', '-g': '1'}, extension='.mkv', lossless=True),
+    EncoderBackend('raw', {'-vcodec': 'rawvideo'}, extension='.nut', lossless=True),
+]}
+AUTO_CANDIDATES = ('h264_nvenc', 'h264_qsv', 'h264_vaapi', 'libx264') #H.264 encoders tried by selectEncoder(); libx264 works everywhere
+
+def syntheticFrames(width, height, pixFmt='gray', numFrames=16): #moving gradient with sensor-like noise, precomputed so generating frames is not timed
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    frames = []
+    for i in range(numFrames):
+        frame = 128 + 60*np.sin((x + 4*i)/23.0) * np.cos((y - 3*i)/17.0) + rng.normal(0, 4, (height, width))
+        if pixFmt == 'gray16le':
+            frame = (np.clip(frame, 0, 255)*256).astype(np.uint16)
+        else:
+            frame = np.clip(frame, 0, 255).astype(np.uint8)
+        if pixFmt == 'rgb24':
+            frame = np.dstack([frame, frame[:, ::-1], frame[::-1]])
+        frames.append(frame)
+    return frames
+
+def probeEncoder(backend, width, height, pixFmt='gray', numFrames=300, warmupFrames=30, ffmpegPath=None, tempDir=None):
+    #frames per second the encoder sustains for synthetic frames, or None if it does not work on this machine
+    frames = syntheticFrames(width, height, pixFmt)
+    fd, fileName = tempfile.mkstemp(prefix='encoderProbe_', suffix=backend.extension, dir=tempDir)
+    os.close(fd)
+    writer = None
+    try:
+        writer = backend.writer(fileName, width=width, height=height, pixFmt=pixFmt, ffmpegPath=ffmpegPath, loglevel='quiet')
+        for i in range(warmupFrames): #encoder initialization (e.g. GPU context) is not counted
+            writer.writeFrame(frames[i % len(frames)])
+        t = time.perf_counter()
+        for i in range(numFrames):
+            writer.writeFrame(frames[i % len(frames)])
+        writer.close() #includes flushing the encoder's lookahead
+        elapsed = time.perf_counter() - t
+        if writer.returncode != 0 or os.path.getsize(fileName) == 0:
+            return None
+        return numFrames/elapsed
+    except OSError: #ffmpeg missing, or it exited because the encoder is not available (broken pipe)
+        if writer is not None:
+            writer.close()
+        return None
+    finally:
+        os.remove(fileName)
+
+def benchmarkEncoders(width, height, pixFmt='gray', names=None, numFrames=300, ffmpegPath=None): #list of (name, fps or None)
+    names = list(names) if names is not None else list(ENCODERS)
+    return [(name, probeEncoder(ENCODERS[name], width, height, pixFmt, numFrames, ffmpegPath=ffmpegPath)) for name in names]
+
+def benchmarkReport(results, targetFps=None): #one line per encoder
+    lines = []
+    for name, fps in results:
+        if fps is None:
+            lines.append('{:12s} not available'.format(name))
+        else:
+            ok = '' if targetFps is None else (' (sustains {:g}fps)'.format(targetFps) if fps >= targetFps else ' (too slow for {:g}fps)'.format(targetFps))
+            lines.append('{:12s} {:8.1f} fps{}'.format(name, fps, ok))
+    return lines
+
+def selectEncoder(width, height, pixFmt, targetFps, candidates=AUTO_CANDIDATES, headroom=1.2, numFrames=300, ffmpegPath=None):
+    #fastest candidate that encodes at least headroom*targetFps here; the fastest working one (with a warning) if none does
+    print('Benchmarking encoders at {}x{} {}...'.format(width, height, pixFmt))
+    results = benchmarkEncoders(width, height, pixFmt, candidates, numFrames, ffmpegPath)
+    for line in benchmarkReport(results, targetFps*headroom):
+        print('  ' + line)
+    working = [(fps, name) for name, fps in results if fps is not None]
+    if not working:
+        raise RuntimeError('none of the encoders {} work on this machine'.format(', '.join(candidates)))
+    sustaining = [(fps, name) for fps, name in working if fps >= targetFps*headroom]
+    fps, name = max(sustaining or working)
+    if not sustaining:
+        print('WARNING: no encoder sustains {:g}fps; using {} ({:.1f}fps), frames will queue up in the frame ring'.format(targetFps, name, fps))
+    print('Using encoder: {}'.format(name))
+    return ENCODERS[name]
+
+def getEncoder(name, width, height, pixFmt, targetFps): #EncoderBackend by name, or benchmarked with selectEncoder() if name is 'auto'
+    if name == 'auto':
+        return selectEncoder(width, height, pixFmt, targetFps)
+    return ENCODERS[name]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ffmpeg encoders on this machine with synthetic frames')
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=400)
+    parser.add_argument('--pixfmt', default='gray', choices=['gray', 'rgb24', 'gray16le', 'bayer_rggb8'])
+    parser.add_argument('--fps', type=float, default=None, help='target frame rate to check against')
+    parser.add_argument('--frames', type=int, default=300, help='frames encoded per encoder')
+    parser.add_argument('--encoders', default=None, help='comma separated names (default: all of {})'.format(', '.join(ENCODERS)))
+    args = parser.parse_args()
+    names = args.encoders.split(',') if args.encoders else None
+    for line in benchmarkReport(benchmarkEncoders(args.width, args.height, args.pixfmt, names, args.frames), args.fps):
+        print(line)
@@ -0,0 +1,169 @@
+# =============================================================================
+#  Minimal ffmpeg writer that replaces skvideo.io.FFmpegWriter. ffmpeg is
+#  launched once with an explicit rawvideo input (pix_fmt, size and rate), and
+#  frames are written to its stdin as raw memory (memoryview), without the
+#  per-frame dtype/shape checks and conversions done by skvideo.
+#
+#  writeFrame() writes each frame immediately, so it is a drop-in for the
+#  skvideo writer. When used as a CaptureEngine sink, consume(ring) is used
+#  instead: it takes every completed frame that is ready in the frame ring (up
+#  to batchFrames) and writes them with a single os.writev() call straight from
+#  the ring slots, which are only freed after the write.
+#
+#  Writes that block for longer than stallTime (ffmpeg not keeping up) are
+#  counted and reported when the writer is closed. If ffmpeg exits (e.g. a
+#  full disk or a bad option), consume() reports it once and keeps freeing the
+#  ring slots without writing, so the cameras and the engine can still finish.
+#
+#  ffmpeg is found from the ffmpegPath argument, then the FFMPEG_PATH
+#  environment variable, then the PATH, then the Windows location used by the
+#  original scripts (C:/Anaconda3/Lib/site-packages/ffmpeg).
+# =============================================================================
+
+import os, time, shutil, subprocess
+import numpy as np
+
+LEGACY_FFMPEG_DIR = 'C:/Anaconda3/Lib/site-packages/ffmpeg' #where the original scripts pointed skvideo.setFFmpegPath
+YUV420_CODECS = ('libx264', 'libx265', 'h264_nvenc', 'hevc_nvenc') #output defaults to yuv420p for these for player compatibility
+
+def findFFmpeg(ffmpegPath=None): #full path to the ffmpeg executable
+    candidates = [ffmpegPath, os.environ.get('FFMPEG_PATH'), shutil.which('ffmpeg'),
+                  os.path.join(LEGACY_FFMPEG_DIR, 'ffmpeg.exe')]
+    for candidate in candidates:
+        if candidate and os.path.isdir(candidate): #a folder, like skvideo.setFFmpegPath
+            candidate = shutil.which('ffmpeg', path=candidate)
+        if candidate and os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError('ffmpeg not found; install it on the PATH or set FFMPEG_PATH')
+
+def inputPixFmt(shape, dtype): #rawvideo pix_fmt for a frame of this numpy shape and dtype
+    if len(shape) == 3 and shape[2] == 3:
+        return 'rgb24'
+    if np.dtype(dtype).itemsize == 2:
+        return 'gray16le'
+    return 'gray'
+
+def writeAll(fd, buffers): #write a list of buffers to a file descriptor, handling partial writes
+    if hasattr(os, 'writev'):
+        remaining = [memoryview(b).cast('B') for b in buffers]
+        while remaining:
+            written = os.writev(fd, remaining)
+            while remaining and written >= len(remaining[0]):
+                written -= len(remaining[0])
+                remaining.pop(0)
+            if remaining and written:
+                remaining[0] = remaining[0][written:]
+    else: #Windows has no writev
+        for b in buffers:
+            view = memoryview(b).cast('B')
+            while len(view):
+                view = view[os.write(fd, view):]
+
+class FFmpegPipeWriter: #drop-in for skvideo.io.FFmpegWriter: writeFrame(frame) and close()
+    def __init__(self, fileName, outputdict=None, width=None, height=None, pixFmt=None, rate=25,
+                 ffmpegPath=None, batchFrames=8, stallTime=0.01, inputdict=None, loglevel='error'):
+        self.fileName = fileName
+        self.outputdict = dict(outputdict or {}) #ffmpeg output options, e.g. {'-vcodec': 'libx264', '-crf': '21'}
+        self.inputdict = dict(inputdict or {}) #ffmpeg options placed before the input, e.g. {'-vaapi_device': '/dev/dri/renderD128'}
+        self.loglevel = loglevel #ffmpeg -loglevel; 'quiet' when probing encoders that may not be available
+        self.width = width #taken from the first frame if not given
+        self.height = height
+        self.pixFmt = pixFmt #rawvideo input pix_fmt ('gray', 'rgb24', 'gray16le', or e.g. 'bayer_rggb8', debayered by ffmpeg); taken from the first frame if not given
+        self.rate = rate #frame rate written to the file; nonstandard rates slow down some encoders a lot
+        self.ffmpegPath = findFFmpeg(ffmpegPath)
+        self.batchFrames = batchFrames #maximum frames per write call in consume()
+        self.stallTime = stallTime #in seconds; writes blocking longer than this are counted as pipe stalls
+        self.proc = None
+        self.returncode = None #ffmpeg exit code once closed
+        self.failed = False #ffmpeg exited during consume(); the rest of the frames are not written
+        self.framesWritten = 0
+        self.writeCalls = 0
+        self.stalls = 0
+        self.stallTotal = 0.0
+        self.stallMax = 0.0
+        if width is not None and height is not None and pixFmt is not None:
+            self.open()
+
+    def command(self): #ffmpeg command line
+        outputdict = dict(self.outputdict)
+        if '-pix_fmt' not in outputdict and outputdict.get('-vcodec', 'libx264') in YUV420_CODECS:
+            outputdict['-pix_fmt'] = 'yuv420p'
+        cmd = [self.ffmpegPath, '-y', '-loglevel', self.loglevel]
+        for key, value in self.inputdict.items():
+            cmd += [key, str(value)]
+        cmd += ['-f', 'rawvideo', '-pix_fmt', self.pixFmt, '-s', '{}x{}'.format(self.width, self.height),
+                '-framerate', str(self.rate), '-i', '-']
+        for key, value in outputdict.items():
+            cmd += [key, str(value)]
+        return cmd + [self.fileName]
+
+    def open(self): #launch ffmpeg once; raw frames go to its stdin
+        self.proc = subprocess.Popen(self.command(), stdin=subprocess.PIPE, bufsize=0)
+        self.fd = self.proc.stdin.fileno()
+
+    def openFor(self, frame): #set size and pix_fmt from the first frame if they were not given
+        self.height = self.height or frame.shape[0]
+        self.width = self.width or frame.shape[1]
+        self.pixFmt = self.pixFmt or inputPixFmt(frame.shape, frame.dtype)
+        self.open()
+
+    def write(self, frames): #one write call for a list of frames, timing it to detect pipe stalls
+        if self.proc is None:
+            self.openFor(frames[0])
+        t = time.perf_counter()
+        writeAll(self.fd, [np.ascontiguousarray(frame) for frame in frames])
+        elapsed = time.perf_counter() - t
+        self.writeCalls += 1
+        self.framesWritten += len(frames)
+        if elapsed > self.stallTime:
+            self.stalls += 1
+            self.stallTotal += elapsed
+            self.stallMax = max(self.stallMax, elapsed)
+
+    def writeFrame(self, frame): #write one frame immediately
+        self.write([frame])
+
+    def consume(self, ring): #CaptureEngine saving thread: batch the ready frames of the ring into single writes
+        while True:
+            index, frame = ring.nextCompleted() #blocks for the first frame of a batch
+            if index is None: #ring has been drained after the end of acquisition
+                break
+            batch = []
+            while True:
+                if frame is None: #dropped by the ring's overflow policy
+                    ring.finishRead(index)
+                else:
+                    batch.append((index, ring.compositeOf(frame)))
+                    ring.handOff(index) #slot stays reserved until it is written
+                if len(batch) >= self.batchFrames or not ring.completedAvailable():
+                    break
+                index, frame = ring.nextCompleted()
+            try:
+                if batch and not self.failed:
+                    self.write([frame for index, frame in batch])
+            except OSError as error: #BrokenPipeError: ffmpeg has exited
+                self.writeFailed(error)
+            finally:
+                for index, frame in batch:
+                    ring.releaseRead(index)
+
+    def writeFailed(self, error): #report once that ffmpeg is gone; consume() then only frees the ring slots
+        self.failed = True
+        print('\nERROR: ffmpeg stopped taking frames for {} after {} frames ({}); the rest of the session is not written'
+              .format(self.fileName, self.framesWritten, error))
+
+    def report(self): #one line summary of pipe throughput and stalls
+        return ('ffmpeg pipe: {} frames in {} writes, {} stalls > {:.0f}ms (total {:.3f}sec, max {:.1f}ms)'
+                .format(self.framesWritten, self.writeCalls, self.stalls, self.stallTime*1000, self.stallTotal, self.stallMax*1000))
+
+    def close(self, quiet=False): #close ffmpeg's input and wait for it to finish writing the file; quiet=True skips the report
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError: #ffmpeg has already exited
+            pass
+        self.returncode = self.proc.wait()
+        self.proc = None
+        if not quiet and self.loglevel != 'quiet':
+            print(self.report())
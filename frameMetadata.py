@@ -0,0 +1,111 @@
+# =============================================================================
+#  Per-frame metadata sidecar for each camera: frame index in the video, FrameID,
+#  device timestamp, host receive time, and, with chunk data enabled on the
+#  camera (CameraSettings(chunkData=True)), the exposure time, gain and line
+#  status at the end of each exposure as sent along with the image. Checking
+#  FrameIDs and timestamps against the ExposureActive edges counted by the DAQ
+#  shows exactly which frames are missing instead of breaking alignment
+#  silently.
+#
+#  Rows are stored with scalar writes into a preallocated block of a numpy
+#  structured array (no Python objects are created per frame by this module),
+#  and each full block is appended to the file, so a crash loses at most one
+#  block. .npy files have their header rewritten after every block, so a sidecar
+#  is always loadable with
+#      meta = np.load('mouse12_2021_02_01_09_30_59_cam1_meta.npy')
+#      meta['frameID'], meta['timestamp'], meta['received'], ...
+#  .h5/.hdf5 files (needs h5py) hold the same rows in a 'frames' dataset.
+# =============================================================================
+
+import os, time, struct
+import numpy as np
+try:
+    import h5py
+except ImportError: #only needed for .h5 sidecars
+    h5py = None
+
+CHUNK_ENTRIES = ('FrameID', 'Timestamp', 'ExposureTime', 'Gain', 'ExposureEndLineStatusAll') #chunk data enabled by captureEngine.enableChunkData
+METADATA_DTYPE = np.dtype([('frame', np.int64), #frame index in the video (row of the composite frame)
+                           ('frameID', np.int64), #FrameID from the camera
+                           ('timestamp', np.uint64), #device timestamp in ns (camera clock)
+                           ('received', np.float64), #host time the image was received, in seconds since the epoch (like time.time())
+                           ('exposureTime', np.float32), #in microseconds; NaN without chunk data
+                           ('gain', np.float32), #in dB; NaN without chunk data
+                           ('lineStatus', np.int16)]) #line status bits at the end of exposure (bit n = Line n); -1 without chunk data
+BLOCK_ROWS = 4096 #rows written to the file at a time (about 8 seconds at 500Hz)
+HEADER_BYTES = 256 #fixed .npy header size, so the row count can be rewritten in place
+
+def npyHeader(dtype, rows): #.npy (version 1.0) header for a 1-D array of rows, padded to HEADER_BYTES
+    text = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(np.lib.format.dtype_to_descr(dtype), rows)
+    text = text.ljust(HEADER_BYTES - 10 - 1) + '\n' #10 bytes of magic string, version and header length before the text
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(text)) + text.encode('latin1')
+
+class FrameMetadata: #per-frame metadata of one camera, appended to a sidecar file block by block
+    def __init__(self, fileName, chunkData=False, blockRows=BLOCK_ROWS):
+        self.fileName = fileName
+        self.chunkData = chunkData #read exposure time, gain and line status from the image chunk data
+        self.block = np.zeros(blockRows, METADATA_DTYPE)
+        self.block['exposureTime'] = np.nan
+        self.block['gain'] = np.nan
+        self.block['lineStatus'] = -1
+        self.frame, self.frameID, self.timestamp, self.received = (self.block[name] for name in ('frame', 'frameID', 'timestamp', 'received'))
+        self.exposureTime, self.gain, self.lineStatus = (self.block[name] for name in ('exposureTime', 'gain', 'lineStatus'))
+        self.row = 0 #next row of the block
+        self.rowsWritten = 0
+        self.hasLineStatus = None
+        self.clockOffset = time.time() - time.perf_counter() #receive times are measured with perf_counter
+        self.h5 = None
+        if os.path.splitext(fileName)[1].lower() in ('.h5', '.hdf5'):
+            if h5py is None:
+                raise RuntimeError('writing .h5 metadata needs the h5py package')
+            self.h5 = h5py.File(fileName, 'w')
+            self.dataset = self.h5.create_dataset('frames', shape=(0,), maxshape=(None,), dtype=METADATA_DTYPE, chunks=(blockRows,))
+        else:
+            self.file = open(fileName, 'wb')
+            self.file.write(npyHeader(METADATA_DTYPE, 0))
+            self.file.flush()
+
+    def record(self, index, image, tReceived): #called by the camera thread for every image received
+        row = self.row
+        self.frame[row] = index
+        self.received[row] = tReceived + self.clockOffset
+        if self.chunkData:
+            chunk = image.GetChunkData()
+            self.frameID[row] = chunk.GetFrameID()
+            self.timestamp[row] = chunk.GetTimestamp()
+            self.exposureTime[row] = chunk.GetExposureTime()
+            self.gain[row] = chunk.GetGain()
+            if self.hasLineStatus is None: #not every camera model sends the line status chunk
+                self.hasLineStatus = hasattr(chunk, 'GetExposureEndLineStatusAll')
+            if self.hasLineStatus:
+                self.lineStatus[row] = chunk.GetExposureEndLineStatusAll()
+        else:
+            self.frameID[row] = image.GetFrameID()
+            self.timestamp[row] = image.GetTimeStamp()
+        self.row = row + 1
+        if self.row == len(self.block):
+            self.flush()
+
+    def flush(self): #append the recorded rows to the file
+        if self.row == 0:
+            return
+        rows = self.block[:self.row]
+        if self.h5 is not None:
+            self.dataset.resize((self.rowsWritten + self.row,))
+            self.dataset[self.rowsWritten:] = rows
+            self.h5.flush()
+        else:
+            self.file.write(rows.tobytes())
+            self.file.seek(0)
+            self.file.write(npyHeader(METADATA_DTYPE, self.rowsWritten + self.row)) #rows are complete before the header counts them
+            self.file.seek(0, os.SEEK_END)
+            self.file.flush()
+        self.rowsWritten += self.row
+        self.row = 0
+
+    def close(self):
+        self.flush()
+        if self.h5 is not None:
+            self.h5.close()
+        else:
+            self.file.close()
@@ -0,0 +1,340 @@
+# =============================================================================
+#  Preallocated ring of composite frame buffers for the capture engine. Each
+#  slot holds one combined frame with all cameras side by side, and each camera
+#  has a column slice (view) of every slot, so the camera threads copy the image
+#  from the SDK buffer straight into its place in the composite frame and the
+#  sink and preview stages read that same memory. This replaces the
+#  np.array(image.GetData()) + np.concatenate copies of the original scripts.
+#
+#  Free slots are claimed for a frame index by the first camera to deliver that
+#  index, and the other cameras write into the same slot. Once the
+#  FrameSynchronizer has completed a frame it calls complete(), and the sink
+#  reads completed frames in order with nextCompleted()/finishRead(), which
+#  frees the slot. The ring's condition variable is shared with the
+#  FrameSynchronizer, which does the claiming.
+#
+#  The ring never grows, so memory use is fixed at numSlots composite frames.
+#  When a camera needs a new slot and all slots still hold frames the sink has
+#  not written yet, the overflow policy decides what happens:
+#    'block'       - the camera thread waits for the sink (frames queue up in the camera/host buffers)
+#    'dropNewest'  - the incoming image is discarded (its slice is later filled with a blank frame)
+#    'dropOldest'  - the oldest unwritten frame is discarded and the sink skips it
+#    'spill'       - the oldest unwritten frame is moved to a spill file on disk and the sink reads it back from there
+#  Discarded frames are listed in overflowLog, and stats() reports fill levels.
+#  Spilling only copies the frame out of its slot while the ring is locked; a
+#  spill thread writes it to disk and the sink reads it back outside the lock,
+#  so camera threads never wait on disk I/O.
+#
+#  With layout='perCamera' each slot instead holds the cameras' frames one after
+#  the other, so every camera's frame is contiguous (and cameras may differ in
+#  size); sinks that write each camera to its own file (perCameraSink.py) read
+#  these directly, and compositeOf() builds the side by side frame on demand
+#  (as RGB if any camera is RGB, with mono and Bayer frames in every channel).
+#
+#  With shared=True the slots are allocated in a multiprocessing.shared_memory
+#  block, so another process (see processSink.py) can read the composite frames
+#  by slot number without pickling them.
+# =============================================================================
+
+import time, tempfile, threading, collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+try:
+    from multiprocessing import shared_memory
+except ImportError: #Python < 3.8; shared rings are not available
+    shared_memory = None
+
+OVERFLOW_POLICIES = ('block', 'dropNewest', 'dropOldest', 'spill')
+RING_LAYOUTS = ('sideBySide', 'perCamera') #how the camera frames are arranged in each slot
+
+class FrameRing: #fixed number of composite frames; cameras write into their own slice of each slot
+    def __init__(self, numSlots, shapes, dtype=np.uint8, layout='sideBySide', overflow='block', spillDir=None, shared=False):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('overflow must be one of {}'.format(OVERFLOW_POLICIES))
+        if layout not in RING_LAYOUTS:
+            raise ValueError('layout must be one of {}'.format(RING_LAYOUTS))
+        self.numSlots = numSlots
+        self.numCams = len(shapes)
+        self.layout = layout
+        self.cameraShapes = [tuple(shape) for shape in shapes] #numpy shape of each camera's frame
+        self.sizes = [int(np.prod(shape)) for shape in self.cameraShapes] #elements per camera frame
+        if layout == 'sideBySide':
+            if len(set(shape[0] for shape in shapes)) > 1 or len(set(shape[2:] for shape in shapes)) > 1:
+                raise ValueError('all cameras must have the same height and pixel format to be combined side by side')
+            self.widths = [shape[1] for shape in self.cameraShapes] #width of each camera, left to right
+            shape = (numSlots, self.cameraShapes[0][0], sum(self.widths)) + self.cameraShapes[0][2:]
+        else: #each camera's frame is contiguous, one after the other
+            shape = (numSlots, sum(self.sizes))
+        self.shm = None
+        if shared:
+            if shared_memory is None:
+                raise RuntimeError('a shared frame ring needs Python 3.8+ (multiprocessing.shared_memory)')
+            nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.slots = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+            self.slots[...] = 0
+        else:
+            self.slots = np.zeros(shape, dtype=dtype)
+        self.memoryBytes = self.slots.nbytes
+        self.views = [[self.cameraFrames(self.slots[s])[c] for s in range(numSlots)] for c in range(self.numCams)] #views[camera][slot]
+        self.cond = threading.Condition()
+        self.slotIndex = np.full(numSlots, -1, dtype=np.int64) #frame index whose data is in each slot (kept after release)
+        self.arrivals = np.full((numSlots, self.numCams), np.nan) #perf_counter time each camera's image arrived in each slot (NaN if filled)
+        self.busy = np.zeros(numSlots, dtype=bool) #claimed and not yet written by the sink
+        self.slotOf = {} #frame index -> slot, for all busy slots
+        self.freeSlots = collections.deque(range(numSlots))
+        self.reading = np.zeros(numSlots, dtype=bool) #currently being written by the sink, so it cannot be evicted
+        self.readIndex = None #next frame index the sink will write
+        self.completeIndex = None #one past the last frame index completed by the synchronizer
+        self.latestSlot = None #slot of the last completed frame, sampled by the preview
+        self.inputEnded = False #no more frames will be completed; the sink drains what is left
+        self.closed = False
+        self.trace = None #stageTrace.StageTrace recording when the sink reads and writes each frame, or None
+        self.overflow = overflow
+        self.spillDir = spillDir #directory for the spill file; system temp directory if None
+        self.spillFile = None
+        self.spiller = None #thread writing spilled frames to the spill file, started by the first spill
+        self.spillLock = threading.Lock() #spill file and spillBuffers; never taken while waiting on cond
+        self.spillBuffers = {} #position in spill file -> copy of a spilled frame not written to disk yet
+        self.spilled = collections.deque() #(frame index, position in spill file), oldest first
+        self.spilledArrivals = {} #frame index -> arrival times of a spilled frame, until it is read
+        self.spillWritten = 0
+        self.spillRead = 0
+        self.overflowLog = [] #(frame index, event) for every frame discarded because the ring was full
+        self.peakFill = 0
+        self.blockedCount = 0
+        self.blockedTime = 0.0 #in seconds, total time camera threads waited for a free slot
+        self.droppedNewest = 0
+        self.droppedOldest = 0
+
+    @classmethod
+    def forSettings(cls, numSlots, settings, overflow='block', spillDir=None, shared=False, layout='sideBySide'): #ring sized for a list of CameraSettings
+        dtypes = set(np.dtype(camSettings.frameDtype()) for camSettings in settings)
+        if len(dtypes) > 1:
+            raise ValueError('cameras in one session must all have 8-bit or all have high bit depth pixel formats')
+        return cls(numSlots, [camSettings.frameShape() for camSettings in settings], dtype=dtypes.pop(), layout=layout,
+                   overflow=overflow, spillDir=spillDir, shared=shared)
+
+    def cameraFrames(self, frame): #list of per-camera views of a slot-shaped frame (a ring slot or a spilled frame)
+        if self.layout == 'sideBySide':
+            edges = np.cumsum([0] + self.widths)
+            return [frame[:, edges[c]:edges[c+1]] for c in range(self.numCams)]
+        edges = np.cumsum([0] + self.sizes)
+        return [frame[edges[c]:edges[c+1]].reshape(self.cameraShapes[c]) for c in range(self.numCams)]
+
+    def compositeOf(self, frame, stride=1): #cameras side by side, as written by single-stream sinks and shown by the preview
+        #stride > 1 keeps every stride-th row and column (a downscaled view, no copy for the side by side layout)
+        if self.layout == 'sideBySide':
+            return frame if stride == 1 else frame[::stride, ::stride] #already side by side
+        frames = [f[::stride, ::stride] for f in self.cameraFrames(frame)]
+        height = max(f.shape[0] for f in frames)
+        channels = max(f.shape[2:] for f in frames) #(3,) if any camera is RGB; mono and Bayer frames are then repeated in each channel
+        composite = np.zeros((height, sum(f.shape[1] for f in frames)) + channels, dtype=frame.dtype)
+        x = 0
+        for f in frames:
+            composite[:f.shape[0], x:x+f.shape[1]] = f if f.ndim == composite.ndim else f[:, :, np.newaxis]
+            x += f.shape[1]
+        return composite
+
+    def slotFor(self, index): #slot claimed for a frame index, or None
+        return self.slotOf.get(index)
+
+    def canClaim(self, index): #True if a slot is free or already claimed for this frame index
+        return index in self.slotOf or len(self.freeSlots) > 0
+
+    def claim(self, index): #claim a slot for a frame index; caller must hold cond and check canClaim first
+        slot = self.slotOf.get(index)
+        if slot is not None:
+            return slot, False
+        slot = self.freeSlots.popleft()
+        self.slotOf[index] = slot
+        self.slotIndex[slot] = index
+        self.busy[slot] = True
+        fill = self.numSlots - len(self.freeSlots)
+        if fill > self.peakFill:
+            self.peakFill = fill
+        return slot, True #newly claimed
+
+    def free(self, index): #return the slot of a frame index to the free list; caller holds cond
+        slot = self.slotOf.pop(index)
+        self.busy[slot] = False
+        self.reading[slot] = False
+        self.freeSlots.append(slot)
+
+    def oldestUnread(self): #oldest completed frame still in a slot that the sink is not currently writing
+        if self.readIndex is None:
+            return None
+        for index in range(self.readIndex, self.completeIndex):
+            slot = self.slotOf.get(index)
+            if slot is not None and not self.reading[slot]:
+                return index
+        return None
+
+    def makeRoom(self, index): #apply the overflow policy when no slot is free for a new frame index; caller holds cond
+        #returns 'claim' if a slot was freed, 'drop' if the incoming image should be discarded, or 'wait'
+        if self.overflow == 'dropNewest':
+            self.droppedNewest += 1
+            self.overflowLog.append((index, 'droppedNewest'))
+            return 'drop'
+        oldIndex = self.oldestUnread()
+        if self.overflow == 'block' or oldIndex is None:
+            return 'wait'
+        if self.overflow == 'spill':
+            self.spill(self.slotOf[oldIndex], oldIndex)
+        else:
+            self.droppedOldest += 1
+            self.overflowLog.append((oldIndex, 'droppedOldest'))
+        self.free(oldIndex)
+        return 'claim'
+
+    def spill(self, slot, index): #move an unwritten frame out of its slot so the slot can be reused; caller holds cond
+        position = self.spillWritten #place reserved in the spill file
+        with self.spillLock:
+            self.spillBuffers[position] = self.slots[slot].copy() #memory copy only; the spill thread writes it to disk
+        if self.spiller is None:
+            self.spiller = ThreadPoolExecutor(max_workers=1, thread_name_prefix='frameRingSpill')
+        self.spiller.submit(self.writeSpilled, position)
+        self.spilled.append((index, position))
+        self.spilledArrivals[index] = self.arrivals[slot].copy()
+        self.spillWritten += 1
+        self.overflowLog.append((index, 'spilled'))
+
+    def writeSpilled(self, position): #spill thread: write a spilled frame to disk, without holding cond
+        with self.spillLock:
+            frame = self.spillBuffers.get(position)
+            if frame is None: #already read back by the sink
+                return
+            if self.spillFile is None:
+                self.spillFile = tempfile.TemporaryFile(prefix='frameRingSpill_', dir=self.spillDir)
+            self.spillFile.seek(position*frame.nbytes)
+            self.spillFile.write(frame.data)
+            del self.spillBuffers[position]
+
+    def readSpilled(self, position): #read a spilled frame back (from disk, or its copy if not written yet), without holding cond
+        with self.spillLock:
+            frame = self.spillBuffers.pop(position, None)
+            if frame is None:
+                frameBytes = self.slots[0].nbytes
+                self.spillFile.seek(position*frameBytes)
+                frame = np.frombuffer(self.spillFile.read(frameBytes), dtype=self.slots.dtype).reshape(self.slots.shape[1:])
+        self.spillRead += 1
+        return frame
+
+    def waitForSlot(self, wakeInterval): #camera thread waits for the sink to free a slot; caller holds cond
+        self.blockedCount += 1
+        t = time.perf_counter()
+        self.cond.wait(wakeInterval)
+        self.blockedTime += time.perf_counter() - t
+
+    def complete(self, index): #called by the synchronizer (holding cond) when the frame at index is ready for the sink
+        if self.readIndex is None:
+            self.readIndex = index
+        self.completeIndex = index + 1
+        self.latestSlot = self.slotOf.get(index)
+        self.cond.notify_all()
+
+    def sampleLatest(self, stride=1): #(index, downscaled copy) of the last completed frame, or (None, None); never holds up the sink
+        with self.cond:
+            if self.closed or self.latestSlot is None:
+                return None, None
+            index = self.completeIndex - 1
+            if self.slotIndex[self.latestSlot] != index: #slot already reused for a newer frame that is not complete yet
+                return None, None
+            return index, np.array(self.compositeOf(self.slots[self.latestSlot], stride)) #small copy, so the slot can be reused right away
+
+    def nextCompleted(self, wakeInterval=0.5): #sink: wait for the next completed frame; (index, frame) or (None, None) once drained
+        with self.cond:
+            while self.readIndex is None or self.readIndex >= self.completeIndex:
+                if self.closed or (self.inputEnded and (self.readIndex is None or self.readIndex >= self.completeIndex)):
+                    return None, None
+                self.cond.wait(wakeInterval)
+            index = self.readIndex
+            position = None
+            if self.spilled and self.spilled[0][0] == index:
+                position = self.spilled.popleft()[1]
+            else:
+                slot = self.slotOf.get(index)
+                if slot is None:
+                    return index, None #frame was dropped by the overflow policy
+                self.reading[slot] = True
+            if self.trace is not None:
+                self.trace.mark(index, 'read', time.perf_counter())
+            if position is None:
+                return index, self.slots[slot]
+        return index, self.readSpilled(position) #disk read outside the lock, so the cameras are not held up
+
+    def arrivalsOf(self, index): #perf_counter arrival time of each camera's image for a frame being read (NaN for filled images)
+        with self.cond:
+            slot = self.slotOf.get(index)
+            if slot is not None:
+                return self.arrivals[slot].copy()
+            return self.spilledArrivals.pop(index, np.full(self.numCams, np.nan))
+
+    def completedAvailable(self): #True if nextCompleted() would return a frame without waiting
+        with self.cond:
+            return self.readIndex is not None and self.readIndex < self.completeIndex
+
+    def finishRead(self, index): #sink is done with the frame at index, so its slot can be reused
+        if self.trace is not None:
+            self.trace.markWritten(index, time.perf_counter())
+        with self.cond:
+            if index in self.slotOf:
+                self.free(index)
+            self.readIndex = index + 1
+            self.cond.notify_all()
+
+    def handOff(self, index): #sink has passed the frame at index on (e.g. to another process) but still needs its slot
+        with self.cond:
+            self.readIndex = index + 1
+            self.cond.notify_all()
+
+    def releaseRead(self, index): #a frame passed on with handOff() has been written, so its slot can be reused
+        if self.trace is not None:
+            self.trace.markWritten(index, time.perf_counter())
+        with self.cond:
+            if index in self.slotOf and self.reading[self.slotOf[index]]:
+                self.free(index)
+                self.cond.notify_all()
+
+    def endInput(self): #no more frames will be completed; nextCompleted() returns (None, None) once the sink has caught up
+        with self.cond:
+            self.inputEnded = True
+            self.cond.notify_all()
+
+    def close(self): #wake any thread waiting on the ring so it can stop
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.spiller is not None:
+            self.spiller.shutdown()
+        if self.spillFile is not None:
+            self.spillFile.close()
+        if self.shm is not None: #views into shared memory must be dropped before it can be closed
+            self.views = None
+            self.slots = None
+            try:
+                self.shm.close()
+            except BufferError: #a frame is still referenced elsewhere (e.g. by the preview); freed when that goes away
+                pass
+            self.shm.unlink()
+            self.shm = None
+
+    def fillLevel(self): #number of slots currently claimed
+        return self.numSlots - len(self.freeSlots)
+
+    def unreadCount(self): #completed frames the sink has not started reading
+        if self.readIndex is None:
+            return 0
+        return self.completeIndex - self.readIndex
+
+    def stats(self): #fill-level and overflow metrics
+        return {'capacity': self.numSlots, 'fill': self.fillLevel(), 'peakFill': self.peakFill,
+                'blockedCount': self.blockedCount, 'blockedTime': self.blockedTime,
+                'droppedNewest': self.droppedNewest, 'droppedOldest': self.droppedOldest,
+                'spilled': self.spillWritten, 'spillPending': len(self.spilled),
+                'memoryMB': self.memoryBytes/1e6}
+
+    def report(self): #one line summary of stats()
+        s = self.stats()
+        return ('frame ring: {capacity} slots ({memoryMB:.1f}MB), peak fill {peakFill}, blocked {blockedCount}x for {blockedTime:.3f}sec, '
+                'dropped {droppedNewest} newest / {droppedOldest} oldest, spilled {spilled} to disk').format(**s)
@@ -0,0 +1,257 @@
+# =============================================================================
+#  Event-driven frame synchronizer for the capture engine. Each camera thread
+#  put()s its images together with a frame index, and the main loop get()s the
+#  next composite frame with one image per camera. The main loop sleeps on a
+#  condition variable and is only notified when every camera can provide the
+#  next index, so waiting for the first trigger costs no CPU and there is no
+#  polling jitter.
+#
+#  Images are copied straight from the SDK buffer into the camera's column slice
+#  of a FrameRing slot (frameRing.py), so the combined frame is never built with
+#  np.concatenate; get() returns the slot holding the composite frame and marks
+#  it complete on the ring, from where the sink reads it (see FrameRing.nextCompleted).
+#  If the ring is full, the ring's overflow policy decides whether put() waits or
+#  discards a frame.
+#
+#  Frames are matched across cameras by their index rather than arrival order.
+#  The camera threads derive the index from the image FrameID (which counts
+#  triggers on the camera, so it skips ahead when a frame is dropped), from the
+#  chunk timestamp, or from arrival order (see CameraWorker.frameIndex). If a
+#  camera is missing an index, its slice is filled with a blank frame or a
+#  duplicate of its previous frame so the combined video stays aligned with the
+#  DAQ, and every fill is recorded in a drop log that can be written to CSV.
+#  For each matched set, the time each camera's frame waited for the last
+#  camera is recorded to show which camera is lagging.
+#
+#  A camera that is lost mid-session (e.g. a USB hiccup) is disconnect()ed: the
+#  other cameras keep being paired and its slice is filled, logged as
+#  'disconnected', until it is reconnect()ed at a new frame index. Since a
+#  re-acquired camera restarts its FrameID count, indexAt() finds the frame
+#  index the other cameras received closest to a given time to realign it.
+# =============================================================================
+
+import time, collections
+import numpy as np
+
+WAKE_INTERVAL = 0.5 #in seconds; wait() wakes this often when idle so Ctrl-C is still handled on Windows
+FILL_MODES = ('blank', 'duplicate') #what to put in place of a dropped frame
+
+class FrameSynchronizer: #matches frames from N cameras by frame index in a FrameRing, filling gaps left by dropped frames
+    def __init__(self, ring, fill='blank'):
+        if fill not in FILL_MODES:
+            raise ValueError('fill must be one of {}'.format(FILL_MODES))
+        self.ring = ring
+        self.numCams = numCams = ring.numCams
+        self.fill = fill
+        self.cond = ring.cond
+        self.filled = np.zeros((ring.numSlots, numCams), dtype=bool) #which cameras have written each slot
+        self.arrivals = ring.arrivals #perf_counter time each camera finished writing each slot, kept with the frame for the sink
+        self.firstIndex = [None]*numCams
+        self.latestIndex = [-1]*numCams #highest frame index written by each camera
+        self.lastReal = [-1]*numCams #last frame index each camera actually delivered, for duplicate filling
+        self.lastRealSlot = [0]*numCams #slot that held it
+        self.ended = [False]*numCams
+        self.disconnected = [False]*numCams #lost mid-session; treated like an ended camera until reconnect()
+        self.gapStart = [0]*numCams #first frame index missed by a disconnected camera
+        self.lastPut = [None]*numCams #perf_counter time each camera last stored an image
+        self.gaps = [] #(camera index, first frame index, last frame index or None) of every disconnection
+        self.recentArrivals = collections.deque(maxlen=4*ring.numSlots) #(frame index, first arrival time) of recently matched frames
+        self.closed = False
+        self.nextIndex = None #frame index of the next frame returned by get(); starts at the lowest first index of all cameras
+        self.dropLog = [] #(frame index, camera index, event) for every dropped or late frame
+        self.dropCounts = [0]*numCams
+        self.lateCounts = [0]*numCams
+        self.framesMatched = 0
+        self.lastWaits = [0.0]*numCams #in seconds, for the most recent set
+        self.waitTotals = [0.0]*numCams
+        self.waitMax = [0.0]*numCams
+
+    def inWindow(self, frameIndex): #slots may only be claimed for indexes less than one ring length ahead of the consumer
+        return self.nextIndex is None or frameIndex < self.nextIndex + self.ring.numSlots
+
+    def put(self, camIndex, data, frameIndex, unpack=None): #called from camera threads; copies the image into the ring (with unpack(data, slot view) if given)
+        ring = self.ring
+        with self.cond:
+            while not (self.closed or ring.closed):
+                if self.nextIndex is not None and frameIndex < self.nextIndex: #out of order or repeated FrameID
+                    self.dropLog.append((frameIndex, camIndex, 'late'))
+                    self.lateCounts[camIndex] += 1
+                    return False
+                if self.inWindow(frameIndex):
+                    if ring.canClaim(frameIndex):
+                        break
+                    action = ring.makeRoom(frameIndex) #slot still holds a frame the sink has not written
+                    if action == 'claim':
+                        break
+                    if action == 'drop': #image discarded; the consumer fills its slice once this camera moves on
+                        self.latestIndex[camIndex] = max(self.latestIndex[camIndex], frameIndex)
+                        return False
+                    ring.waitForSlot(WAKE_INTERVAL) #ring is full, wait for the sink to release a slot
+                else: #too far ahead of the other cameras
+                    if frameIndex - 1 > self.latestIndex[camIndex]: #e.g. after a host buffer overflow: the skipped indexes can be filled meanwhile
+                        self.latestIndex[camIndex] = frameIndex - 1
+                        self.cond.notify_all()
+                    self.cond.wait(WAKE_INTERVAL)
+            else:
+                return False
+            slot, new = ring.claim(frameIndex)
+            if new:
+                self.filled[slot] = False
+                self.arrivals[slot] = np.nan
+        if unpack is None:
+            ring.views[camIndex][slot][...] = data.reshape(ring.cameraShapes[camIndex]) #the only copy of the image
+        else:
+            unpack(data, ring.views[camIndex][slot]) #e.g. Mono12Packed to uint16, in the same single pass
+        with self.cond:
+            self.filled[slot, camIndex] = True
+            self.arrivals[slot, camIndex] = self.lastPut[camIndex] = time.perf_counter()
+            if self.firstIndex[camIndex] is None:
+                self.firstIndex[camIndex] = frameIndex
+            self.latestIndex[camIndex] = max(self.latestIndex[camIndex], frameIndex)
+            if self.ready():
+                self.cond.notify_all()
+        return True
+
+    def end(self, camIndex): #called from a camera thread when its stream has ended
+        with self.cond:
+            self.ended[camIndex] = True
+            self.cond.notify_all()
+
+    def disconnect(self, camIndex): #camera lost mid-session; the others carry on and its frames are filled until reconnect()
+        with self.cond:
+            self.disconnected[camIndex] = True
+            self.gapStart[camIndex] = self.latestIndex[camIndex] + 1
+            self.gaps.append((camIndex, self.gapStart[camIndex], None))
+            self.cond.notify_all()
+
+    def reconnect(self, camIndex, firstIndex): #camera is back and delivers frame indexes from firstIndex on
+        with self.cond:
+            gap = self.gaps.index((camIndex, self.gapStart[camIndex], None))
+            self.gaps[gap] = (camIndex, self.gapStart[camIndex], firstIndex - 1)
+            self.latestIndex[camIndex] = max(self.latestIndex[camIndex], firstIndex - 1)
+            self.disconnected[camIndex] = False
+            self.cond.notify_all()
+
+    def inGap(self, camIndex, index): #True if the camera was disconnected at this frame index
+        return any(c == camIndex and start <= index and (end is None or index <= end) for c, start, end in self.gaps)
+
+    def othersReceiving(self, camIndex, since): #True if another camera stored an image after time since (perf_counter)
+        return any(t is not None and t > since for c, t in enumerate(self.lastPut) if c != camIndex)
+
+    def indexAt(self, t): #frame index the other cameras received (or would receive) closest to time t (perf_counter), or None
+        with self.cond:
+            candidates = list(self.recentArrivals)
+            for index, slot in list(self.ring.slotOf.items()):
+                arrivals = self.arrivals[slot][self.filled[slot]]
+                if len(arrivals):
+                    candidates.append((index, arrivals.min()))
+        if not candidates:
+            return None
+        candidates.sort()
+        index, arrival = min(candidates, key=lambda candidate: abs(candidate[1] - t))
+        periods = [(a2 - a1)/(i2 - i1) for (i1, a1), (i2, a2) in zip(candidates[:-1], candidates[1:]) if i2 > i1]
+        if periods: #t may be after the last frame the others have delivered so far
+            index += int(round((t - arrival)/np.median(periods)))
+        return index
+
+    def close(self): #release a main loop blocked in get(), e.g. when stopping early
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def cameraReady(self, camIndex, index, slot): #this camera has written the index, moved past it, or ended
+        return ((slot is not None and self.filled[slot, camIndex])
+                or self.latestIndex[camIndex] > index or self.ended[camIndex] or self.disconnected[camIndex])
+
+    def finished(self): #all cameras ended (or were lost) and nothing at or after the next index was delivered
+        return all(ended or lost for ended, lost in zip(self.ended, self.disconnected)) and all(latest < self.nextIndex for latest in self.latestIndex)
+
+    def ready(self): #True when the next index can be returned (or capture has ended)
+        if self.nextIndex is None:
+            return all(first is not None or ended or lost for first, ended, lost in zip(self.firstIndex, self.ended, self.disconnected))
+        index = self.nextIndex
+        if not self.ring.canClaim(index): #nobody delivered this index yet and all slots are still held by the sink
+            return self.finished()
+        slot = self.ring.slotFor(index)
+        return all(self.cameraReady(c, index, slot) for c in range(self.numCams))
+
+    def get(self): #block until every camera can provide the next index; returns (index, slot), or None if capture has ended
+        with self.cond:
+            while not self.ready():
+                if self.closed:
+                    return None
+                self.cond.wait(WAKE_INTERVAL)
+            if self.closed:
+                return None
+            if self.nextIndex is None:
+                firsts = [first for first in self.firstIndex if first is not None]
+                if not firsts: #all cameras ended without delivering anything
+                    return None
+                self.nextIndex = min(firsts)
+            if self.finished():
+                return None
+            index = self.nextIndex
+            slot, new = self.ring.claim(index)
+            if new:
+                self.filled[slot] = False
+                self.arrivals[slot] = np.nan
+            for c in range(self.numCams):
+                if self.filled[slot, c]:
+                    self.lastReal[c] = index
+                    self.lastRealSlot[c] = slot
+                else:
+                    self.fillFrame(c, index, slot)
+            self.recordWaits(slot)
+            if self.filled[slot].any():
+                self.recentArrivals.append((index, np.nanmin(self.arrivals[slot])))
+            self.nextIndex += 1
+            self.framesMatched += 1
+            self.ring.complete(index) #hand to the sink; also wakes camera threads, since the claim window moved
+        return index, slot
+
+    def fillFrame(self, camIndex, index, slot): #placeholder for a frame this camera dropped
+        self.dropLog.append((index, camIndex, 'disconnected' if self.inGap(camIndex, index) else 'dropped'))
+        self.dropCounts[camIndex] += 1
+        view = self.ring.views[camIndex][slot]
+        lastSlot = self.lastRealSlot[camIndex]
+        if (self.fill == 'duplicate' and self.lastReal[camIndex] >= 0
+                and self.ring.slotIndex[lastSlot] == self.lastReal[camIndex]): #previous frame not yet overwritten
+            view[...] = self.ring.views[camIndex][lastSlot]
+        else:
+            view[...] = 0
+
+    def recordWaits(self, slot): #time each camera's frame waited for the last camera in this set
+        cams = np.flatnonzero(self.filled[slot])
+        if len(cams) == 0:
+            return
+        arrivals = self.arrivals[slot, cams]
+        tLast = arrivals.max()
+        for c, arrival in zip(cams, arrivals):
+            wait = tLast - arrival
+            self.lastWaits[c] = wait
+            self.waitTotals[c] += wait
+            if wait > self.waitMax[c]:
+                self.waitMax[c] = wait
+
+    def waitReport(self, names): #per-camera mean and max time (ms) spent waiting for the other cameras
+        lines = []
+        for name, total, maximum in zip(names, self.waitTotals, self.waitMax):
+            mean = total/self.framesMatched if self.framesMatched else 0.0
+            lines.append('{} waited mean {:.3f}ms, max {:.3f}ms for other cameras'.format(name, mean*1000, maximum*1000))
+        return lines
+
+    def dropReport(self, names): #per-camera count of filled and discarded frames, and every disconnection
+        lines = ['{}: {} dropped frames filled ({}), {} late frames discarded'.format(name, dropped, self.fill, late)
+                 for name, dropped, late in zip(names, self.dropCounts, self.lateCounts)]
+        for camIndex, start, end in self.gaps:
+            if end is None:
+                lines.append('{}: disconnected from frame {} on, not reconnected'.format(names[camIndex], start))
+            else:
+                lines.append('{}: disconnected for frames {}-{} ({} frames filled)'.format(names[camIndex], start, end, end - start + 1))
+        return lines
+
+    def writeDropLog(self, fileName, names): #one CSV row per dropped or late frame
+        with open(fileName, 'w') as f:
+            f.write('frame,camera,event\n')
+            for index, camIndex, event in self.dropLog:
+                f.write('{},{},{}\n'.format(index, names[camIndex], event))
@@ -0,0 +1,174 @@
+# =============================================================================
+#  Transform stage between the frame ring and the writers, to cut encode cost:
+#  encoding time grows with the number of pixels, and closed-loop tracking or
+#  a long term archive rarely needs every pixel of every frame. Each output
+#  stream of a TransformSink has its own writer and, per camera:
+#      crop     (x, y, width, height) region of the camera's image
+#      binning  mean of each binning x binning block (2 for 2x2 binning)
+#  and, for the whole stream, every: only frames whose index is a multiple of
+#  every are written (temporal decimation). E.g. a full frame rate, 2x2 binned
+#  stream for tracking plus a full resolution archive of every 5th frame:
+#      TransformSink([TransformStream(FFmpegPipeWriter('m1_tracking.mp4'), FrameTransform(binning=2)),
+#                     TransformStream(FFmpegPipeWriter('m1.mp4'), every=5)], indexName='m1_index.csv')
+#
+#  Transforms read the ring slots in place: a crop is a view, and binning adds
+#  strided views of the slot into a preallocated accumulator and writes the
+#  means into a preallocated output buffer, so no frame is copied before it is
+#  reduced and nothing is allocated per frame. A stream without transforms
+#  gets the ring's composite frames as they are, as with a plain writer.
+#
+#  Binning on the sensor is cheaper still (fewer pixels on USB, in the host
+#  buffers and in the ring), but then applies to every stream: use
+#  CameraSettings(binning=2) when no stream needs full resolution. Cameras
+#  without binning nodes are binned in software by the camera thread with
+#  meanPool, straight into the ring slot.
+#
+#  Software binning mixes the colors of a Bayer image, so Bayer cameras can
+#  only be cropped (at even offsets).
+# =============================================================================
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from segmentedSink import SegmentedSink
+
+def accumulatorDtype(dtype): #integer type that holds the sum of up to 16 pixels (4x4 binning) without overflow
+    return np.uint16 if np.dtype(dtype).itemsize == 1 else np.uint32
+
+def meanPool(frame, factor, out, acc=None): #write the mean of each factor x factor block of frame (rounded) into out, of shape (height/factor, width/factor[, 3])
+    acc = acc if acc is not None else np.empty(out.shape, accumulatorDtype(frame.dtype))
+    height, width = out.shape[0]*factor, out.shape[1]*factor
+    acc[...] = factor*factor//2 #rounds to the nearest value
+    for dy in range(factor):
+        for dx in range(factor):
+            acc += frame[dy:height:factor, dx:width:factor] #strided view of the frame, added in place
+    np.floor_divide(acc, factor*factor, out=out, casting='unsafe')
+    return out
+
+class FrameTransform: #crop and bin one camera's frames
+    def __init__(self, crop=None, binning=1):
+        if binning < 1 or binning > 4:
+            raise ValueError('binning must be 1, 2, 3 or 4')
+        self.crop = tuple(crop) if crop is not None else None #(x, y, width, height) in the camera's image, or None for all of it
+        self.binning = binning #1 for none, 2 for 2x2 binning
+        self.acc = None #sum of each block, allocated for the first frame
+
+    def region(self, frame): #cropped view of a camera's frame (no copy)
+        if self.crop is None:
+            return frame
+        x, y, width, height = self.crop
+        if x < 0 or y < 0 or x + width > frame.shape[1] or y + height > frame.shape[0]:
+            raise ValueError('crop {} is outside the {}x{} image'.format(self.crop, frame.shape[1], frame.shape[0]))
+        return frame[y:y+height, x:x+width]
+
+    def outputShape(self, shape): #shape of the transformed frame for a camera frame of this shape
+        height, width = shape[:2] if self.crop is None else self.crop[3:1:-1]
+        return (height//self.binning, width//self.binning) + tuple(shape[2:])
+
+    def apply(self, frame, out): #write the transformed frame into out
+        region = self.region(frame)
+        if self.binning == 1:
+            out[...] = region
+        else:
+            if self.acc is None:
+                self.acc = np.empty(out.shape, accumulatorDtype(frame.dtype))
+            meanPool(region, self.binning, out, self.acc)
+        return out
+
+class TransformStream: #one output of a TransformSink: a writer, the transform of each camera and the decimation
+    def __init__(self, writer, transforms=None, every=1):
+        self.writer = writer #object with write(frames) or writeFrame(frame), and close(), e.g. ffmpegWriter.FFmpegPipeWriter
+        self.transforms = transforms #one FrameTransform for all cameras, a list with one per camera (None leaves a camera out), or None for the frames as they are
+        self.every = every #write only frames whose index is a multiple of every
+        self.buffers = None #preallocated output frames, one per frame of a batch
+        self.edges = None #first column of each camera in the output frame
+        self.framesWritten = 0
+
+    def prepare(self, ring, batchFrames): #allocate the output frames for the ring's cameras
+        if self.transforms is None:
+            return
+        if isinstance(self.transforms, FrameTransform):
+            self.transforms = [self.transforms] + [FrameTransform(self.transforms.crop, self.transforms.binning) for c in range(ring.numCams - 1)]
+        if len(self.transforms) != ring.numCams:
+            raise ValueError('give one transform per camera ({} cameras)'.format(ring.numCams))
+        shapes = [transform.outputShape(shape) if transform is not None else None for transform, shape in zip(self.transforms, ring.cameraShapes)]
+        widths = [shape[1] if shape is not None else 0 for shape in shapes]
+        channels = next(shape[2:] for shape in shapes if shape is not None)
+        self.edges = np.cumsum([0] + widths)
+        self.buffers = np.zeros((batchFrames, max(shape[0] for shape in shapes if shape is not None), self.edges[-1]) + channels,
+                                dtype=ring.slots.dtype) #cameras of different heights leave black below the shorter ones
+
+    def frameOf(self, ring, frame, k): #output frame for a ring frame, written into buffer k of the batch
+        if self.transforms is None:
+            return ring.compositeOf(frame)
+        out = self.buffers[k]
+        for c, (transform, cameraFrame) in enumerate(zip(self.transforms, ring.cameraFrames(frame))):
+            if transform is not None:
+                shape = transform.outputShape(cameraFrame.shape)
+                transform.apply(cameraFrame, out[:shape[0], self.edges[c]:self.edges[c+1]])
+        return out
+
+    def write(self, frames, indexes): #writers must be done with the frames when this returns, as the buffers are reused
+        if isinstance(self.writer, SegmentedSink): #lists the frame indexes of each segment in its manifest
+            self.writer.write(frames, indexes)
+        elif hasattr(self.writer, 'write'): #FFmpegPipeWriter: one write call for the batch
+            self.writer.write(frames)
+        else:
+            for frame in frames:
+                self.writer.writeFrame(frame)
+        self.framesWritten += len(frames)
+
+class TransformSink: #sink for CaptureEngine that writes transformed (cropped, binned, decimated) copies of the ring frames to several writers
+    def __init__(self, streams, indexName=None, batchFrames=8):
+        self.streams = list(streams) #TransformStreams
+        self.indexName = indexName #CSV mapping each frame index to its frame number in each stream (empty if not written), or None
+        self.batchFrames = batchFrames #maximum frames per write call
+        self.framesRead = 0
+
+    def consume(self, ring): #called by the engine's saving thread; returns once the ring is drained and all writers are closed
+        for stream in self.streams:
+            stream.prepare(ring, self.batchFrames)
+        indexFile = None
+        if self.indexName is not None:
+            indexFile = open(self.indexName, 'w')
+            indexFile.write(','.join(['frameIndex'] + [os.path.basename(getattr(stream.writer, 'fileName', 'stream' + str(n+1)))
+                                                       for n, stream in enumerate(self.streams)]) + '\n')
+        try:
+            while True:
+                index, frame = ring.nextCompleted() #blocks for the first frame of a batch
+                if index is None: #ring has been drained after the end of acquisition
+                    break
+                batch = []
+                while True:
+                    if frame is None: #dropped by the ring's overflow policy
+                        ring.finishRead(index)
+                    else:
+                        batch.append((index, frame))
+                        ring.handOff(index) #slot stays reserved until every stream has written it
+                    if len(batch) >= self.batchFrames or not ring.completedAvailable():
+                        break
+                    index, frame = ring.nextCompleted()
+                numbers = {index: [] for index, frame in batch} #frame number of each frame index in each stream
+                for stream in self.streams:
+                    kept = [(index, frame) for index, frame in batch if index % stream.every == 0]
+                    for index, frame in batch:
+                        numbers[index].append(str(stream.framesWritten + [i for i, f in kept].index(index)) if index % stream.every == 0 else '')
+                    if kept:
+                        stream.write([stream.frameOf(ring, frame, k) for k, (index, frame) in enumerate(kept)], [index for index, frame in kept])
+                if indexFile is not None:
+                    for index, frame in batch:
+                        indexFile.write(','.join([str(index)] + numbers[index]) + '\n')
+                self.framesRead += len(batch)
+                for index, frame in batch:
+                    ring.releaseRead(index)
+        finally:
+            with ThreadPoolExecutor(max_workers=max(1, len(self.streams))) as pool: #all encoders flush at once
+                list(pool.map(lambda stream: stream.writer.close(), self.streams))
+            if indexFile is not None:
+                indexFile.close()
+
+    def writeFrame(self, frame):
+        raise RuntimeError('TransformSink reads frames from the frame ring; use it as a CaptureEngine sink')
+
+    def close(self): #the writers are closed at the end of consume()
+        pass
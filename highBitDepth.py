@@ -0,0 +1,67 @@
+# =============================================================================
+#  10/12/16-bit mono capture. initCam sets AdcBitDepth to Bit10/Bit12, but
+#  Mono8 throws the extra bits away; with these pixel formats they are kept:
+#      Mono12Packed, Mono12p  2 pixels in 3 bytes (1.5 bytes per pixel on USB and in the host buffers)
+#      Mono16                 2 bytes per pixel
+#  Frames are stored in the frame ring as uint16, most significant bit aligned
+#  (12-bit values are shifted up by 4, as the camera does for Mono16), so every
+#  format reads the same downstream and a gray16le video shows the full range.
+#  The camera thread unpacks each image straight into its ring slot with a few
+#  vectorized NumPy operations that write the high and low byte of every pixel
+#  (no temporary arrays, in place of the plain copy made for 8-bit formats).
+#
+#  For lossless storage use the ffv1 encoder (FFV1 accepts gray16le) or raw
+#  capture (rawCapture.py keeps the uint16 frames in its memory-mapped files);
+#  H.264/H.265 encoders reduce the video to 8 bits.
+# =============================================================================
+
+import numpy as np
+
+HIGH_BIT_FORMATS = {'Mono12Packed': 12, 'Mono12p': 12, 'Mono16': 16} #pixel format -> bits per pixel sent by the camera
+
+def isHighBitDepth(pixelFormat):
+    return pixelFormat in HIGH_BIT_FORMATS
+
+def imageBytes(pixelFormat, height, width): #bytes of one image as sent by the camera
+    return height*width*HIGH_BIT_FORMATS[pixelFormat]//8
+
+def pixelBytes(out): #(low byte, high byte) views of the even and odd pixels of a uint16 frame (little endian), to write without temporaries
+    pairs = out.view(np.uint8).reshape(out.shape[0], -1, 2, 2) #a view, also for a camera's column slice of a side by side ring slot
+    return pairs[..., 0, 0], pairs[..., 0, 1], pairs[..., 1, 0], pairs[..., 1, 1]
+
+def unpackMono12Packed(raw, out): #GigE Vision Mono12Packed: byte 0 = p0 bits 11-4, byte 1 = p1 bits 3-0 | p0 bits 3-0, byte 2 = p1 bits 11-4
+    triples = raw.reshape(out.shape[0], -1, 3)
+    low0, high0, low1, high1 = pixelBytes(out)
+    high0[...] = triples[..., 0]
+    np.left_shift(triples[..., 1], 4, out=low0)
+    high1[...] = triples[..., 2]
+    np.bitwise_and(triples[..., 1], 0xF0, out=low1)
+
+def unpackMono12p(raw, out): #PFNC Mono12p: byte 0 = p0 bits 7-0, byte 1 = p1 bits 3-0 | p0 bits 11-8, byte 2 = p1 bits 11-4
+    triples = raw.reshape(out.shape[0], -1, 3)
+    low0, high0, low1, high1 = pixelBytes(out)
+    np.left_shift(triples[..., 1], 4, out=high0)
+    high0 |= triples[..., 0] >> 4
+    np.left_shift(triples[..., 0], 4, out=low0)
+    high1[...] = triples[..., 2]
+    np.bitwise_and(triples[..., 1], 0xF0, out=low1)
+
+def copyMono16(raw, out): #Mono16 image, delivered as uint16 or as its bytes
+    out[...] = raw.view(np.uint16).reshape(out.shape)
+
+UNPACKERS = {'Mono12Packed': unpackMono12Packed, 'Mono12p': unpackMono12p, 'Mono16': copyMono16} #called as unpack(raw image data, ring slot view)
+
+def packMono12(values, pixelFormat): #inverse of the unpackers for 12-bit formats: flat uint8 image data from MSB aligned uint16 values
+    pairs = (np.asarray(values, dtype=np.uint16) >> 4).reshape(-1, 2)
+    raw = np.empty((len(pairs), 3), dtype=np.uint8)
+    if pixelFormat == 'Mono12Packed':
+        raw[:, 0] = pairs[:, 0] >> 4
+        raw[:, 1] = (pairs[:, 0] & 0x0F) | ((pairs[:, 1] & 0x0F) << 4)
+    else:
+        raw[:, 0] = pairs[:, 0] & 0xFF
+        raw[:, 1] = (pairs[:, 0] >> 8) | ((pairs[:, 1] & 0x0F) << 4)
+    raw[:, 2] = pairs[:, 1] >> 4
+    return raw.ravel()
+
+def preview8(frame): #8-bit copy of a uint16 frame for display
+    return (frame >> 8).astype(np.uint8)
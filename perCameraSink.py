@@ -0,0 +1,125 @@
+# =============================================================================
+#  Sink stage that writes each camera to its own video file instead of one
+#  side by side stream. Every camera gets its own writer (by default an
+#  ffmpegWriter.FFmpegPipeWriter, i.e. its own ffmpeg process) fed by its own
+#  thread, so the cameras are encoded in parallel, the encoder width no longer
+#  grows with the number of cameras, and downstream tools (e.g. pose tracking)
+#  can read one view without decoding the others.
+#
+#  The capture engine allocates its frame ring with a per-camera layout for this
+#  sink (ringLayout = 'perCamera'), so every camera's frame is contiguous in the
+#  ring slot and is written from there without a copy. A slot is freed once all
+#  camera writers are done with it.
+#
+#  Every composite frame is written to every file (dropped frames are filled,
+#  see frameSync.py), so frame n of one file was captured with frame n of the
+#  others. A small sidecar CSV index lists, for each frame index (FrameID,
+#  timestamp or arrival index) the frame number in each file, which keeps the
+#  files aligned with the DAQ even if the ring's overflow policy skips frames.
+#
+#  Cameras with different pixel formats (e.g. a Bayer color camera next to a
+#  mono one) can share a session this way, with pixFmts giving each writer its
+#  own ffmpeg input format.
+#
+#  At the end of the session all writers are closed at once, so the cameras'
+#  encoders flush (and write their file index) in parallel.
+#
+#  e.g. PerCameraSink(['m1_cam1.mp4', 'm1_cam2.mp4'], outputdict={'-vcodec': 'libx264'}, indexName='m1_index.csv')
+# =============================================================================
+
+import os, queue, threading
+from concurrent.futures import ThreadPoolExecutor
+from ffmpegWriter import FFmpegPipeWriter
+
+class PerCameraSink: #sink for CaptureEngine that encodes each camera to a separate file in parallel
+    ringLayout = 'perCamera' #tells the engine to keep each camera's frame contiguous in the ring
+
+    def __init__(self, fileNames, factory=None, indexName=None, batchFrames=8, pixFmts=None, **kwargs):
+        self.fileNames = list(fileNames) #one output file per camera, in camera order
+        self.pixFmts = list(pixFmts) if pixFmts is not None else None #ffmpeg input pix_fmt per camera (e.g. CameraSettings.pixFmt()), or None to infer it from the frames
+        self.factory = factory or FFmpegPipeWriter #called as factory(fileName, **kwargs) for each camera
+        self.kwargs = kwargs
+        self.indexName = indexName #sidecar CSV mapping frame indexes to frame numbers in each file, or None
+        self.batchFrames = batchFrames #maximum frames per write call for writers that have write(frames)
+        self.writers = []
+        self.lock = threading.Lock()
+        self.pending = {} #frame index -> number of camera writers still using its ring slot
+        self.framesWritten = 0
+
+    def writeCamera(self, ring, writer, frames): #one thread per camera: write its frames in order and free ring slots
+        while True:
+            batch = [frames.get()]
+            while batch[-1] is not None and len(batch) < self.batchFrames and not frames.empty():
+                batch.append(frames.get())
+            done = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                if hasattr(writer, 'write'): #FFmpegPipeWriter: one write call for the batch
+                    writer.write([frame for index, frame in batch])
+                else:
+                    for index, frame in batch:
+                        writer.writeFrame(frame)
+                for index, frame in batch:
+                    self.release(ring, index)
+            if done:
+                break
+
+    def release(self, ring, index): #one camera is done with the frame at index; free the slot after the last one
+        with self.lock:
+            if index not in self.pending: #spilled frame, not in a ring slot
+                return
+            self.pending[index] -= 1
+            if self.pending[index] > 0:
+                return
+            del self.pending[index]
+        ring.releaseRead(index)
+
+    def consume(self, ring): #called by the engine's saving thread; returns once the ring is drained and all writers are closed
+        if self.pixFmts is None:
+            self.writers = [self.factory(fileName, **self.kwargs) for fileName in self.fileNames]
+        else:
+            self.writers = [self.factory(fileName, pixFmt=pixFmt, **self.kwargs) for fileName, pixFmt in zip(self.fileNames, self.pixFmts)]
+        queues = [queue.Queue(self.batchFrames) for writer in self.writers] #bounded, so unwritten frames stay in the ring where its overflow policy applies
+        threads = [threading.Thread(target=self.writeCamera, args=(ring, writer, frames), name='writer' + str(c+1), daemon=True)
+                   for c, (writer, frames) in enumerate(zip(self.writers, queues))]
+        for thread in threads:
+            thread.start()
+        indexFile = None
+        if self.indexName is not None:
+            indexFile = open(self.indexName, 'w')
+            indexFile.write(','.join(['frameIndex'] + [os.path.basename(name) for name in self.fileNames]) + '\n')
+        try:
+            while True:
+                index, frame = ring.nextCompleted()
+                if index is None: #ring has been drained after the end of acquisition
+                    break
+                if frame is None: #dropped by the ring's overflow policy
+                    ring.finishRead(index)
+                    continue
+                inSlot = ring.slotFor(index) is not None #False for a spilled frame read back from disk
+                if inSlot:
+                    with self.lock:
+                        self.pending[index] = len(self.writers)
+                    ring.handOff(index) #slot stays reserved until every camera has written it
+                else:
+                    ring.finishRead(index)
+                for frames, cameraFrame in zip(queues, ring.cameraFrames(frame)):
+                    frames.put((index, cameraFrame))
+                if indexFile is not None:
+                    indexFile.write(','.join([str(index)] + [str(self.framesWritten)]*len(self.writers)) + '\n')
+                self.framesWritten += 1
+        finally:
+            for frames in queues:
+                frames.put(None)
+            for thread in threads:
+                thread.join()
+            with ThreadPoolExecutor(max_workers=max(1, len(self.writers))) as pool: #all ffmpeg processes flush their encoders at once
+                list(pool.map(lambda writer: writer.close(), self.writers))
+            if indexFile is not None:
+                indexFile.close()
+
+    def writeFrame(self, frame):
+        raise RuntimeError('PerCameraSink reads frames from the frame ring; use it as a CaptureEngine sink')
+
+    def close(self): #the writers are closed at the end of consume()
+        pass
@@ -0,0 +1,35 @@
+# =============================================================================
+#  Preview stages for the capture engine. TkPreview is the non-blocking tkinter
+#  window (i.e. without mainloop) used by the capture scripts to output the
+#  combined camera images to the screen; update() must be called from the main thread.
+# =============================================================================
+
+import tkinter as tk
+from PIL import Image, ImageTk
+
+class TkPreview: #simple GUI to display the combined images and a line of status text
+    def __init__(self, width, height, title="camera acquisition", text="waiting for trigger..."):
+        self.window = tk.Tk()
+        self.window.title(title)
+        geomStrWidth = str(width + 25)
+        geomStrHeight = str(height + 35)
+        self.window.geometry(geomStrWidth + 'x' + geomStrHeight) # width+25 x height+35; large enough for frames + text
+        self.textlbl = tk.Label(self.window, text=text)
+        self.textlbl.grid(column=0, row=0)
+        self.imglabel = tk.Label(self.window) # make Label widget to hold image
+        self.imglabel.place(x=10, y=20) #pixels from top-left
+        self.window.update() #update TCL tasks to make window appear
+
+    def update(self, frame, text):
+        self.textlbl.configure(text=text)
+        I = ImageTk.PhotoImage(Image.fromarray(frame))
+        self.imglabel.configure(image=I)
+        self.imglabel.image = I #keep reference to image
+        self.window.update() #update on screen (this must be called from main thread)
+
+    def setStatus(self, text):
+        self.textlbl.configure(text=text)
+        self.window.update()
+
+    def close(self):
+        self.window.destroy()
@@ -0,0 +1,204 @@
+# =============================================================================
+#  Headless preview stage for rigs without a display (e.g. in dark enclosures):
+#  instead of a tkinter window, the latest combined frame is served as an MJPEG
+#  stream over HTTP, so it can be watched in any browser on the network:
+#      http://<rig address>:8080/          page with the stream and status line
+#      http://<rig address>:8080/stream    MJPEG stream (?fps=5 to lower the rate)
+#      http://<rig address>:8080/frame.jpg latest frame
+#      http://<rig address>:8080/status    status text
+#
+#  update() only stores a reference to the frame (the engine already passes a
+#  downscaled copy), so it costs nothing in the capture engine's main thread.
+#  JPEG compression happens in a separate thread, once per frame for all
+#  clients, and only while someone is watching. Each client is served by its own
+#  thread at no more than its frame-rate cap and always gets the newest frame, so
+#  a slow client just skips frames and never backs up the pipeline.
+#
+#  Run this file to try it on localhost with synthetic frames:
+#      python previewServer.py --port 8080
+# =============================================================================
+
+import io, time, threading, argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from PIL import Image
+
+WAKE_INTERVAL = 0.5 #in seconds; waiting threads wake this often to check for close()
+PAGE = '''<html><head><title>{title}</title></head>
+<body style="background:#222; color:#ddd; font-family:sans-serif">
+<div id="status">{status}</div><img src="/stream">
+<script>setInterval(function() {{ fetch('/status').then(function(r) {{ return r.text(); }})
+  .then(function(t) {{ document.getElementById('status').textContent = t; }}); }}, 1000);</script>
+</body></html>'''
+
+class PreviewRequestHandler(BaseHTTPRequestHandler): #one thread per connection; self.server.preview is the PreviewServer
+    timeout = 10 #in seconds; drop clients that stop reading
+
+    def do_GET(self):
+        preview = self.server.preview
+        url = urlparse(self.path)
+        if url.path == '/':
+            self.sendBody(PAGE.format(title=preview.title, status=preview.status).encode(), 'text/html')
+        elif url.path == '/status':
+            self.sendBody(preview.status.encode(), 'text/plain')
+        elif url.path == '/frame.jpg':
+            jpeg = preview.latestJpeg()
+            if jpeg is None:
+                self.send_error(503, 'no frame yet')
+            else:
+                self.sendBody(jpeg, 'image/jpeg')
+        elif url.path == '/stream':
+            try:
+                fps = float(parse_qs(url.query).get('fps', [preview.maxFps])[0])
+            except ValueError:
+                fps = 0.0
+            if not fps > 0: #also rejects nan
+                self.send_error(400, 'fps must be a number > 0')
+            else:
+                self.stream(preview, min(fps, preview.maxFps))
+        else:
+            self.send_error(404)
+
+    def sendBody(self, body, contentType):
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, preview, fps): #MJPEG: send the newest frame, at most fps times per second
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        preview.addClient()
+        try:
+            seq = 0
+            tNext = time.perf_counter()
+            while True:
+                jpeg, seq = preview.nextJpeg(seq)
+                if jpeg is None: #preview closed
+                    break
+                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+                tNext = max(tNext + 1.0/fps, time.perf_counter()) #a client that fell behind does not catch up with a burst
+                time.sleep(max(0.0, tNext - time.perf_counter()))
+        except (OSError, ValueError): #client went away or timed out
+            pass
+        finally:
+            preview.removeClient()
+
+    def log_message(self, format, *args): #no per-request logging on the console
+        pass
+
+class PreviewServer: #preview stage for CaptureEngine that serves the latest frame as MJPEG over HTTP
+    def __init__(self, port=8080, host='127.0.0.1', maxFps=10, stride=1, quality=75, title="camera acquisition", text="waiting for trigger..."):
+        self.maxFps = maxFps #per-client frame-rate cap
+        self.stride = stride #additional downscaling before JPEG compression
+        self.quality = quality #JPEG quality, 1-95
+        self.title = title
+        self.status = text
+        self.cond = threading.Condition()
+        self.frame = None #latest frame from update(), not yet compressed
+        self.frameSeq = 0
+        self.jpeg = None
+        self.jpegSeq = 0 #frameSeq of the frame in self.jpeg
+        self.clients = 0
+        self.closed = False
+        self.framesEncoded = 0
+        self.server = ThreadingHTTPServer((host, port), PreviewRequestHandler) #host '0.0.0.0' to serve other machines
+        self.server.daemon_threads = True
+        self.server.preview = self
+        self.serverThread = threading.Thread(target=self.server.serve_forever, name='previewServer', daemon=True)
+        self.serverThread.start()
+        self.encodeThread = threading.Thread(target=self.encodeLoop, name='previewEncoder', daemon=True)
+        self.encodeThread.start()
+        print('Preview at http://{}:{}/'.format(host, self.server.server_address[1]))
+
+    def update(self, frame, text): #called by the engine; only keeps the newest frame, compression happens in encodeLoop
+        with self.cond:
+            self.frame = frame
+            self.frameSeq += 1
+            self.status = text
+            self.cond.notify_all()
+
+    def setStatus(self, text):
+        self.status = text
+
+    def addClient(self):
+        with self.cond:
+            self.clients += 1
+            self.cond.notify_all()
+
+    def removeClient(self):
+        with self.cond:
+            self.clients -= 1
+
+    def nextJpeg(self, seq): #wait for a frame newer than seq; (jpeg bytes, its seq), or (None, seq) once closed
+        with self.cond:
+            while self.jpegSeq <= seq and not self.closed:
+                self.cond.wait(WAKE_INTERVAL)
+            if self.closed:
+                return None, seq
+            return self.jpeg, self.jpegSeq
+
+    def latestJpeg(self): #JPEG of the newest frame at the time of the call, or None if there is no frame yet
+        self.addClient() #frames are only compressed while someone is watching
+        try:
+            with self.cond:
+                seq = self.frameSeq
+                while self.jpegSeq < seq and not self.closed:
+                    self.cond.wait(WAKE_INTERVAL)
+                return self.jpeg
+        finally:
+            self.removeClient()
+
+    def encodeLoop(self): #compress each new frame once for all clients, only while someone is watching
+        encodedSeq = 0
+        while True:
+            with self.cond:
+                while not self.closed and (self.frameSeq == encodedSeq or self.clients == 0):
+                    self.cond.wait(WAKE_INTERVAL)
+                if self.closed:
+                    return
+                frame, encodedSeq = self.frame, self.frameSeq
+            jpeg = self.encode(frame)
+            with self.cond:
+                self.jpeg = jpeg
+                self.jpegSeq = encodedSeq
+                self.framesEncoded += 1
+                self.cond.notify_all()
+
+    def encode(self, frame): #numpy frame -> JPEG bytes
+        frame = frame[::self.stride, ::self.stride]
+        if frame.dtype != np.uint8: #e.g. 16-bit frames; keep the top 8 bits
+            frame = (frame >> (8*(frame.dtype.itemsize - 1))).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(np.ascontiguousarray(frame)).save(buffer, format='JPEG', quality=self.quality)
+        return buffer.getvalue()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__': #serve synthetic frames to try the preview on localhost
+    from encoders import syntheticFrames
+    parser = argparse.ArgumentParser(description='Serve a synthetic preview stream')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--fps', type=float, default=10, help='per-client frame-rate cap')
+    args = parser.parse_args()
+    preview = PreviewServer(args.port, args.host, args.fps)
+    frames = syntheticFrames(800, 400)
+    i = 0
+    try:
+        while True:
+            preview.update(frames[i % len(frames)], 'synthetic frame #: ' + str(i+1))
+            i += 1
+            time.sleep(1.0/30)
+    except KeyboardInterrupt:
+        preview.close()
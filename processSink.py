@@ -0,0 +1,142 @@
+# =============================================================================
+#  Sink stage that runs the encoder/writer in a separate process, so that
+#  compression and the Python-side feeding of ffmpeg never compete with the
+#  acquisition threads for the GIL (TO DO item 4 in cameraCapture2cams.py).
+#
+#  The capture engine allocates its frame ring in shared memory when the sink
+#  has sharedMemory = True and calls sink.consume(ring) in its saving thread.
+#  Only slot numbers travel to the encoder process, which reads the composite
+#  frame straight from the shared ring slot and sends the frame index back once
+#  it is written, at which point the slot is freed for the cameras. Frames the
+#  ring spilled to disk are the exception and are sent through the pipe.
+#
+#  If the encoder process dies (e.g. the writer factory raises or ffmpeg exits),
+#  its pipes break instead of blocking: the slots it still held are freed and
+#  the rest of the session is read from the ring without being written, so
+#  acquisition never stalls on a dead encoder.
+#
+#  Camera acquisition and composition stay in the capture process, since the
+#  PySpin camera objects belong to the process that opened the Spinnaker system.
+#
+#  The writer is created inside the encoder process from a picklable factory
+#  (a class or top-level function) and its arguments, e.g.
+#      ProcessSink(FFmpegPipeWriter, movieName, outputdict={'-vcodec': 'h264_nvenc'})
+# =============================================================================
+
+import threading
+import multiprocessing as mp
+import numpy as np
+
+def encoderMain(shmName, shape, dtype, slotConn, ackConn, factory, args, kwargs): #runs in the encoder process
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shmName) #the capture process owns the block and unlinks it
+    slots = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    writer = None
+    try:
+        writer = factory(*args, **kwargs)
+        while True:
+            msg = slotConn.recv()
+            if msg is None:
+                break
+            index, slot, frame = msg
+            writer.writeFrame(slots[slot] if frame is None else frame) #call to ffmpeg, reading shared memory in place
+            ackConn.send(index)
+    finally:
+        if writer is not None:
+            writer.close()
+        del slots
+        shm.close()
+        ackConn.send(None)
+
+class ProcessSink: #sink for CaptureEngine that writes frames from a shared frame ring in a separate process
+    sharedMemory = True #tells the engine to put its frame ring in shared memory
+
+    def __init__(self, factory, *args, **kwargs):
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+        self.process = None
+        self.framesWritten = 0
+        self.pending = set() #indexes of ring slots handed to the encoder process and not yet acknowledged
+        self.lock = threading.Lock()
+        self.failed = False #True once the encoder process has exited early; frames are then no longer written
+
+    def receiveAcks(self, ring, ackConn): #free ring slots as the encoder process finishes with them
+        while True:
+            try:
+                index = ackConn.recv()
+            except EOFError: #encoder process exited without its final acknowledgement
+                self.encoderLost(ring)
+                break
+            if index is None:
+                break
+            with self.lock:
+                held = index in self.pending
+                self.pending.discard(index)
+            if held: #not already freed by encoderLost
+                ring.releaseRead(index)
+            self.framesWritten += 1
+
+    def send(self, slotConn, msg): #send to the encoder process; False if it has exited
+        if self.failed or not self.process.is_alive():
+            return False
+        try:
+            slotConn.send(msg)
+            return True
+        except OSError: #BrokenPipeError: the encoder process exited, possibly while this send was blocked on a full pipe
+            return False
+
+    def encoderLost(self, ring): #free the slots a dead encoder process still held, so the cameras can carry on
+        with self.lock:
+            pending, self.pending = sorted(self.pending), set()
+            report = not self.failed
+            self.failed = True
+        for index in pending:
+            ring.releaseRead(index)
+        if report:
+            self.process.join()
+            print('ERROR: encoder process exited (exit code {}) after {} frames; the rest of the session is not written'
+                  .format(self.process.exitcode, self.framesWritten))
+
+    def consume(self, ring): #called by the engine's saving thread; returns once the ring is drained and the writer closed
+        slotRecv, slotSend = mp.Pipe(duplex=False)
+        ackRecv, ackSend = mp.Pipe(duplex=False)
+        self.process = mp.Process(target=encoderMain, name='encoder', daemon=True,
+                                  args=(ring.shm.name, ring.slots.shape, ring.slots.dtype.str, slotRecv, ackSend,
+                                        self.factory, self.args, self.kwargs))
+        self.process.start()
+        slotRecv.close() #only the encoder process holds these ends now, so the pipes break if it exits
+        ackSend.close()
+        ackThread = threading.Thread(target=self.receiveAcks, args=(ring, ackRecv,), daemon=True)
+        ackThread.start()
+        try:
+            while True:
+                index, frame = ring.nextCompleted()
+                if index is None: #ring has been drained after the end of acquisition
+                    break
+                slot = ring.slotFor(index)
+                if frame is None or self.failed: #dropped by the ring's overflow policy, or no encoder left to write it
+                    ring.finishRead(index)
+                elif slot is not None: #frame is the ring slot itself
+                    with self.lock:
+                        self.pending.add(index)
+                    ring.handOff(index) #slot stays reserved until the encoder process acknowledges it
+                    if not self.send(slotSend, (index, slot, None)):
+                        self.encoderLost(ring)
+                else: #spilled frame read back from disk, not in shared memory
+                    if not self.send(slotSend, (index, -1, frame)):
+                        self.encoderLost(ring)
+                    ring.finishRead(index)
+        finally:
+            self.send(slotSend, None)
+            ackThread.join()
+            self.process.join()
+            if self.pending or self.process.exitcode: #e.g. exited while writing the last frames
+                self.encoderLost(ring)
+            slotSend.close()
+
+    def writeFrame(self, frame):
+        raise RuntimeError('ProcessSink reads frames from the shared frame ring; use it as a CaptureEngine sink')
+
+    def close(self): #the writer is closed by the encoder process at the end of consume()
+        pass
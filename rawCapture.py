@@ -0,0 +1,200 @@
+# =============================================================================
+#  "Record raw, compress later" mode. During the session RawSink appends every
+#  camera's frames to its own preallocated, memory-mapped .raw file, which is
+#  just a copy into the page cache, so capture runs at the full bandwidth the
+#  cameras deliver and compression is off the critical path. After the session
+#  the raw files are transcoded to H.264/H.265 (or any encoder in encoders.py)
+#  in parallel, e.g.
+#      python rawCapture.py mouse1_cam1.raw mouse1_cam2.raw --encoder libx264 --jobs 2
+#
+#  File layout: a 4096 byte header (magic line + JSON with the frame shape,
+#  dtype, frame count and, for Bayer cameras, the ffmpeg pix_fmt such as
+#  bayer_rggb8, so the colors are only interpolated when transcoding), the frames back to back, then after the frames the
+#  frame index (int64) and host arrival time (float64, seconds since the epoch,
+#  NaN for a dropped frame that was filled) of every frame. The header is
+#  rewritten when the file is closed; if the capture crashed, openRaw() still
+#  recovers the frames from the file size, without timestamps.
+#
+#  A raw file is only deleted (--delete) once ffmpeg has exited cleanly and
+#  written a non-empty video file for it; failures are listed and the command
+#  exits with status 1.
+#
+#  The file is grown in steps of growFrames (preallocated on disk where the OS
+#  supports it) unless maxFrames is given, in which case it is allocated once.
+# =============================================================================
+
+import os, sys, json, time, argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from ffmpegWriter import inputPixFmt
+from encoders import ENCODERS
+
+RAW_MAGIC = b'pySpinCapture raw\n'
+HEADER_BYTES = 4096 #frames start here, so they are page aligned for the memory map
+GROW_FRAMES = 1000 #frames added each time a file without maxFrames fills up
+
+def preallocate(f, size): #reserve disk space so the capture does not stall on allocation or run out of space halfway
+    f.truncate(size)
+    if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(f.fileno(), 0, size)
+
+class RawFileWriter: #appends frames of one camera to a memory-mapped raw file
+    def __init__(self, fileName, shape, dtype, maxFrames=None, growFrames=GROW_FRAMES, pixFmt=None):
+        self.fileName = fileName
+        self.frameShape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.pixFmt = pixFmt #ffmpeg pix_fmt for transcoding, or None to infer it from shape and dtype
+        self.frameBytes = int(np.prod(self.frameShape))*self.dtype.itemsize
+        self.growFrames = growFrames
+        self.file = open(fileName, 'w+b')
+        self.frames = None
+        self.capacity = 0
+        self.count = 0
+        self.indexes = [] #frame index (e.g. FrameID) of each frame
+        self.times = [] #host arrival time of each frame, seconds since the epoch
+        self.writeHeader(complete=False)
+        self.grow(maxFrames or growFrames)
+
+    def writeHeader(self, complete, indexOffset=None):
+        header = {'version': 1, 'shape': list(self.frameShape), 'dtype': self.dtype.str, 'frameBytes': self.frameBytes,
+                  'dataOffset': HEADER_BYTES, 'frameCount': self.count, 'complete': complete, 'indexOffset': indexOffset, 'pixFmt': self.pixFmt}
+        data = RAW_MAGIC + json.dumps(header).encode()
+        self.file.seek(0)
+        self.file.write(data.ljust(HEADER_BYTES, b' '))
+
+    def grow(self, capacity): #remap the file with room for capacity frames
+        if self.frames is not None:
+            self.frames.flush()
+            self.frames = None
+        preallocate(self.file, HEADER_BYTES + capacity*self.frameBytes)
+        self.frames = np.memmap(self.file, dtype=self.dtype, mode='r+', offset=HEADER_BYTES, shape=(capacity,) + self.frameShape)
+        self.capacity = capacity
+
+    def write(self, frame, index=-1, timestamp=np.nan): #copy one frame into the file
+        if self.count == self.capacity:
+            self.grow(self.capacity + self.growFrames)
+        self.frames[self.count] = frame
+        self.indexes.append(index)
+        self.times.append(timestamp)
+        self.count += 1
+
+    def close(self): #trim unused preallocated space and write the frame indexes, timestamps and final header
+        if self.file is None:
+            return
+        self.frames.flush()
+        self.frames = None
+        indexOffset = HEADER_BYTES + self.count*self.frameBytes
+        self.file.truncate(indexOffset)
+        self.file.seek(indexOffset)
+        self.file.write(np.asarray(self.indexes, dtype=np.int64).tobytes())
+        self.file.write(np.asarray(self.times, dtype=np.float64).tobytes())
+        self.writeHeader(complete=True, indexOffset=indexOffset)
+        self.file.close()
+        self.file = None
+
+def openRaw(fileName): #(frames as a read-only memmap, header dict, frame indexes, timestamps); indexes/timestamps are None after a crash
+    with open(fileName, 'rb') as f:
+        data = f.read(HEADER_BYTES)
+    if not data.startswith(RAW_MAGIC):
+        raise ValueError('{} is not a raw capture file'.format(fileName))
+    header = json.loads(data[len(RAW_MAGIC):].decode())
+    shape = tuple(header['shape'])
+    indexes = times = None
+    if header['complete']:
+        count = header['frameCount']
+        indexes = np.fromfile(fileName, dtype=np.int64, count=count, offset=header['indexOffset'])
+        times = np.fromfile(fileName, dtype=np.float64, count=count, offset=header['indexOffset'] + 8*count)
+    else: #capture did not finish; frames written so far are still in the file (plus unused preallocated space)
+        count = (os.path.getsize(fileName) - HEADER_BYTES)//header['frameBytes']
+        print('WARNING: {} was not closed; recovered up to {} frames without timestamps'.format(fileName, count))
+    if count == 0: #an empty file cannot be memory mapped
+        frames = np.empty((0,) + shape, dtype=np.dtype(header['dtype']))
+    else:
+        frames = np.memmap(fileName, dtype=np.dtype(header['dtype']), mode='r', offset=HEADER_BYTES, shape=(count,) + shape)
+    return frames, header, indexes, times
+
+class RawSink: #sink for CaptureEngine that writes each camera to its own raw file, to be transcoded after the session
+    ringLayout = 'perCamera' #each camera's frame is contiguous in the ring, so it is copied to its file in one piece
+
+    def __init__(self, fileNames, maxFrames=None, growFrames=GROW_FRAMES, pixFmts=None):
+        self.fileNames = list(fileNames) #one .raw file per camera, in camera order
+        self.pixFmts = list(pixFmts) if pixFmts is not None else [None]*len(self.fileNames) #ffmpeg pix_fmt per camera, saved for transcoding
+        self.maxFrames = maxFrames #frames to preallocate, e.g. FRAMES_TO_RECORD; None to grow as needed
+        self.growFrames = growFrames
+        self.writers = []
+        self.framesWritten = 0
+
+    def consume(self, ring): #called by the engine's saving thread; returns once the ring is drained and all files are closed
+        epochOffset = time.time() - time.perf_counter() #ring arrival times are perf_counter times
+        self.writers = [RawFileWriter(fileName, shape, ring.slots.dtype, self.maxFrames, self.growFrames, pixFmt)
+                        for fileName, shape, pixFmt in zip(self.fileNames, ring.cameraShapes, self.pixFmts)]
+        try:
+            while True:
+                index, frame = ring.nextCompleted()
+                if index is None: #ring has been drained after the end of acquisition
+                    break
+                if frame is not None: #None if dropped by the ring's overflow policy
+                    arrivals = ring.arrivalsOf(index) + epochOffset
+                    for writer, cameraFrame, arrival in zip(self.writers, ring.cameraFrames(frame), arrivals):
+                        writer.write(cameraFrame, index, arrival)
+                    self.framesWritten += 1
+                ring.finishRead(index)
+        finally:
+            with ThreadPoolExecutor(max_workers=max(1, len(self.writers))) as pool: #flush every camera's memory map to disk at once
+                list(pool.map(lambda writer: writer.close(), self.writers))
+
+    def writeFrame(self, frame):
+        raise RuntimeError('RawSink reads frames from the frame ring; use it as a CaptureEngine sink')
+
+    def close(self): #the files are closed at the end of consume()
+        pass
+
+# OFFLINE TRANSCODING ##########################################################################################################
+def transcodeRaw(fileName, encoderName='libx264', outName=None, outputdict=None, rate=25, batchFrames=64):
+    #compress one raw file; also writes a _frames.csv with the frame index and timestamp of every frame
+    #returns the video file name, or None if ffmpeg failed (the raw file is then the only copy of the recording)
+    frames, header, indexes, times = openRaw(fileName)
+    encoder = ENCODERS[encoderName]
+    outName = outName or encoder.fileName(fileName)
+    writer = encoder.writer(outName, outputdict=outputdict, width=frames.shape[2], height=frames.shape[1],
+                            pixFmt=header.get('pixFmt') or inputPixFmt(frames.shape[1:], frames.dtype), rate=rate)
+    t = time.time()
+    try:
+        for start in range(0, len(frames), batchFrames):
+            writer.write(list(frames[start:start+batchFrames])) #read straight from the memory map
+    except OSError: #BrokenPipeError: ffmpeg exited, reported below with its exit code
+        pass
+    writer.close()
+    if writer.returncode != 0 or not os.path.exists(outName) or os.path.getsize(outName) == 0:
+        print('ERROR: {} -> {} failed (ffmpeg exit code {}); the raw file is kept'.format(fileName, outName, writer.returncode))
+        del frames
+        return None
+    if indexes is not None:
+        with open(os.path.splitext(outName)[0] + '_frames.csv', 'w') as f:
+            f.write('frame,frameIndex,time\n')
+            for n, (index, timestamp) in enumerate(zip(indexes, times)):
+                f.write('{},{},{:.6f}\n'.format(n, index, timestamp))
+    print('{} -> {}: {} frames in {:.1f}sec'.format(fileName, outName, len(frames), time.time() - t))
+    del frames
+    return outName
+
+def transcodeAll(fileNames, encoderName='libx264', jobs=None, deleteRaw=False, **kwargs): #transcode raw files in parallel (one ffmpeg per file)
+    #returns the video file names, None for each file that failed; deleteRaw only deletes raw files that were transcoded
+    with ThreadPoolExecutor(max_workers=jobs or len(fileNames)) as pool: #ffmpeg does the work, so threads are enough
+        outNames = list(pool.map(lambda fileName: transcodeRaw(fileName, encoderName, **kwargs), fileNames))
+    if deleteRaw:
+        for fileName, outName in zip(fileNames, outNames):
+            if outName is not None:
+                os.remove(fileName)
+    return outNames
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Transcode raw capture files to compressed video in parallel')
+    parser.add_argument('files', nargs='+', help='.raw files written by RawSink')
+    parser.add_argument('--encoder', default='libx264', choices=list(ENCODERS))
+    parser.add_argument('--jobs', type=int, default=None, help='files transcoded at the same time (default: all)')
+    parser.add_argument('--rate', type=float, default=25, help='frame rate written to the video files')
+    parser.add_argument('--delete', action='store_true', help='delete the raw files once all are transcoded')
+    args = parser.parse_args()
+    outNames = transcodeAll(args.files, args.encoder, args.jobs, args.delete, rate=args.rate)
+    sys.exit(1 if None in outNames else 0)
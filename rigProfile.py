@@ -0,0 +1,137 @@
+# =============================================================================
+#  Rig profiles: everything the capture scripts hard-code as module-level
+#  constants (save folder, file naming, frame rate and count, encoder, preview)
+#  plus the ROI, exposure, gain, pixel format and trigger mode of each camera
+#  and its serial number, in one YAML (.yaml/.yml) or TOML (.toml) file, e.g.
+#
+#      session:
+#        saveFolder: C:/video/2021_02_test
+#        fileName: '{subject}_{date}_{time}'   # fields: subject, rig, date, time
+#        framesPerSecond: 250
+#        seconds: 600                          # or framesToRecord
+#        encoder: libx264                      # naming the encoder skips the startup probe of 'auto'
+#        preview: none                         # 'tk', 'none' or a port number for previewServer.py
+#      defaults:                               # camera settings shared by all cameras
+#        exposureTime: 500
+#        width: 400
+#        height: 400
+#      cameras:
+#        - {name: camTop, serial: '21253509', offsetX: 160, offsetY: 72}
+#        - {name: camSide, serial: '21253501', offsetX: 160, offsetY: 72, gain: 6}
+#
+#  Unknown keys are errors rather than being ignored, so a typo in a profile
+#  stops the session before any camera is touched. See capture.py for the
+#  command line entry point that runs a session from a profile.
+# =============================================================================
+
+import os
+from datetime import datetime
+from captureEngine import CameraSettings
+try:
+    import yaml
+except ImportError: #only needed for YAML profiles
+    yaml = None
+try:
+    import tomllib
+except ImportError: #Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+SESSION_DEFAULTS = {
+    'rig': '', #rig name, available as {rig} in fileName
+    'saveFolder': 'C:/video',
+    'fileName': '{subject}_{date}_{time}', #without extension; the encoder adds it
+    'framesPerSecond': 250, #trigger rate from the behavior controller
+    'framesToRecord': None, #frames to capture; framesPerSecond*seconds if not given
+    'seconds': 600,
+    'camTimeout': 1000, #in ms; time to wait for another image before aborting
+    'reconnect': True, #re-acquire a camera lost mid-session while the others keep recording (see cameraRegistry.py)
+    'reconnectTimeout': None, #in seconds; how long to look for a lost camera, None for the rest of the session
+    'configCache': None, #JSON file of the settings last applied to each camera, so only changed nodes are written
+    'userSet': None, #e.g. 'UserSet1' to save the settings on the cameras, so the next session loads them in one call
+    'encoder': 'auto', #name from encoders.ENCODERS, or 'auto' to probe at startup
+    'crf': 21, #libx264 quality
+    'ffmpegThreads': 4, #threads for software encoders
+    'rawCapture': False, #write .raw files and compress after the session (rawCapture.py)
+    'separateFiles': False, #one video file per camera (perCameraSink.py)
+    'segmentSeconds': None, #e.g. 60 to start a new video file every minute, so a crash costs at most one segment (segmentedSink.py)
+    'trackingBinning': None, #e.g. 2 to also write a 2x2 binned <movie>_tracking file at the full frame rate, for closed-loop tracking (frameTransform.py)
+    'archiveEvery': 1, #keep every k-th frame in the full resolution file(s), e.g. 5 next to a tracking file
+    'preview': 'tk', #'tk', 'none' or a port number for the MJPEG preview server
+    'ringSlots': 64,
+    'overflow': 'block',
+    'dropLog': True, #write <movie>_drops.csv
+    'trace': True, #write <movie>_trace.npy
+    'streamLog': True, #write <movie>_stream.csv (camera stream counters, see streamStats.py)
+    'metadata': 'npy', #write <movie>_<camera>_meta.npy (per-frame metadata, see frameMetadata.py); 'h5' for HDF5, 'none' for no sidecar
+}
+CAMERA_KEYS = ('name', 'serial', 'trackingCrop') #per-camera keys besides the CameraSettings parameters
+SETTINGS_KEYS = tuple(CameraSettings().__dict__) #exposureTime, gain, gamma, adcBitDepth, pixelFormat, width, height, offsetX, offsetY, triggered, acquisition, bufferCount, chunkData, binning
+
+def loadFile(fileName): #dict from a YAML or TOML file
+    extension = os.path.splitext(fileName)[1].lower()
+    if extension == '.toml':
+        if tomllib is None:
+            raise RuntimeError('reading TOML profiles needs Python 3.11+ or the tomli package')
+        with open(fileName, 'rb') as f:
+            return tomllib.load(f)
+    if extension in ('.yaml', '.yml'):
+        if yaml is None:
+            raise RuntimeError('reading YAML profiles needs the PyYAML package')
+        with open(fileName) as f:
+            return yaml.safe_load(f) or {}
+    raise ValueError('{}: rig profiles must be .yaml, .yml or .toml files'.format(fileName))
+
+def checkKeys(section, values, allowed): #raise for keys that are not known (most likely typos)
+    unknown = sorted(set(values) - set(allowed))
+    if unknown:
+        raise ValueError('unknown {} key(s) {} in rig profile; valid keys are: {}'.format(section, ', '.join(unknown), ', '.join(allowed)))
+
+class RigProfile: #session options and per-camera settings of one rig
+    def __init__(self, profile, fileName=None):
+        self.fileName = fileName
+        checkKeys('top level', profile, ('session', 'defaults', 'cameras'))
+        session = profile.get('session') or {}
+        checkKeys('session', session, SESSION_DEFAULTS)
+        self.session = dict(SESSION_DEFAULTS)
+        self.session.update(session)
+        if self.session['framesToRecord'] is None:
+            self.session['framesToRecord'] = int(round(self.session['framesPerSecond']*self.session['seconds']))
+        defaults = profile.get('defaults') or {}
+        checkKeys('defaults', defaults, SETTINGS_KEYS)
+        cameras = profile.get('cameras') or []
+        if not cameras:
+            raise ValueError('rig profile lists no cameras')
+        self.names = []
+        self.serials = [] #serial number of each camera as a string, or None to take cameras in enumeration order
+        self.trackingCrops = [] #[x, y, width, height] of each camera's image in the tracking file, or None for all of it
+        self.settings = []
+        for n, camera in enumerate(cameras):
+            checkKeys('camera', camera, CAMERA_KEYS + SETTINGS_KEYS)
+            values = dict(defaults)
+            values.update({key: value for key, value in camera.items() if key in SETTINGS_KEYS})
+            self.names.append(str(camera.get('name', 'cam' + str(n+1))))
+            self.serials.append(str(camera['serial']) if camera.get('serial') is not None else None)
+            self.trackingCrops.append(camera.get('trackingCrop'))
+            self.settings.append(CameraSettings(**values))
+
+    @classmethod
+    def load(cls, fileName):
+        return cls(loadFile(fileName), fileName)
+
+    def __getitem__(self, key): #session option, e.g. profile['framesPerSecond']
+        return self.session[key]
+
+    def movieName(self, subject, now=None): #base file name (no extension) from the fileName pattern
+        now = now or datetime.now()
+        return self.session['fileName'].format(subject=subject, rig=self.session['rig'], date=now.strftime('%Y_%m_%d'), time=now.strftime('%H_%M_%S'))
+
+    def saveFolder(self, subject, now=None): #saveFolder may use the same fields as fileName, e.g. C:/video/{date}
+        now = now or datetime.now()
+        return self.session['saveFolder'].format(subject=subject, rig=self.session['rig'], date=now.strftime('%Y_%m_%d'), time=now.strftime('%H_%M_%S'))
+
+    def previewPort(self): #port number for the preview server, or None
+        preview = self.session['preview']
+        return None if preview in (None, 'none', 'tk', False) else int(preview)
@@ -0,0 +1,202 @@
+# =============================================================================
+#  Sink stage that splits a session into a series of video files (segments)
+#  instead of one long file, e.g. mouse12_2021_02_01_09_30_59_000.mp4, _001.mp4,
+#  ..., rotating every segmentFrames frames (or segmentSeconds at frameRate).
+#  An .mp4 is only playable once ffmpeg has written its index (moov atom) on
+#  close, so if the process dies, one long file is lost entirely; with segments
+#  a crash costs at most the segment being written.
+#
+#  No frame is lost at a boundary: the writer for the next segment (its own
+#  ffmpeg process) is started in the background while the current one is
+#  written, so rotating is just switching writers between two frames. The
+#  finished writer is closed (ffmpeg flushes the encoder and writes the index)
+#  by a background thread, so rotation never stalls the saving thread. The
+#  writers' own reports are kept until close(), so nothing is printed over the
+#  engine's status line during capture.
+#
+#  A JSON manifest lists every segment with its first frame number in the
+#  session, its frame count, the first and last frame index (FrameID, timestamp
+#  or arrival index, to align with the DAQ) and its status (recording,
+#  finalizing, complete or failed). It is rewritten (atomically) at every
+#  change, so after a crash it shows which segments are complete.
+#
+#  Used as a CaptureEngine sink it reads the frame ring itself (consume). It is
+#  also a plain writer (write(frames), writeFrame(frame), close()), e.g. as the
+#  factory product of perCameraSink.PerCameraSink to segment each camera's file.
+#
+#  e.g. SegmentedSink('m1.mp4', factory=ENCODERS['libx264'].writer, segmentSeconds=60, frameRate=250, manifestName='m1_segments.json')
+# =============================================================================
+
+import os, json, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from ffmpegWriter import FFmpegPipeWriter
+
+SEGMENT_STATES = ('recording', 'finalizing', 'complete', 'failed')
+
+def closeQuietly(writer): #close a segment's writer without printing its report
+    if isinstance(writer, FFmpegPipeWriter):
+        writer.close(quiet=True)
+    else:
+        writer.close()
+
+class SegmentedSink: #sink for CaptureEngine that rotates to a new file every segmentFrames frames
+    def __init__(self, fileName, factory=None, segmentFrames=None, segmentSeconds=None, frameRate=None, manifestName=None,
+                 batchFrames=8, **kwargs):
+        if segmentFrames is None:
+            if segmentSeconds is None or not frameRate:
+                raise ValueError('give segmentFrames, or segmentSeconds and frameRate')
+            segmentFrames = int(round(segmentSeconds*frameRate))
+        if segmentFrames < 1:
+            raise ValueError('segments must hold at least one frame')
+        self.fileName = fileName #segments are named <root>_000<ext>, <root>_001<ext>, ...
+        self.factory = factory or FFmpegPipeWriter #called as factory(fileName, **kwargs) for each segment
+        self.kwargs = kwargs
+        self.segmentFrames = segmentFrames
+        self.frameRate = frameRate
+        self.manifestName = manifestName #JSON list of segments, or None
+        self.batchFrames = batchFrames #maximum frames per write call in consume()
+        self.segments = [] #manifest entry of each segment
+        self.writer = None #writer of the current segment
+        self.next = None #future of the writer for the next segment, started in the background
+        self.opener = ThreadPoolExecutor(max_workers=1, thread_name_prefix='segmentOpener')
+        self.finalizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='segmentFinalizer') #two, so a slow close never holds up the next
+        self.pending = [] #futures of segments being finalized
+        self.writerReports = [] #(segment file, report of its writer), printed by close() once capture has ended
+        self.lock = threading.Lock() #segment entries are updated by the finalizer threads
+        self.framesWritten = 0
+        self.finalizeMax = 0.0 #in seconds, longest time a segment took to finalize
+        self.closed = False
+        self.writeManifest()
+
+    def segmentName(self, n):
+        root, extension = os.path.splitext(self.fileName)
+        return '{}_{:03d}{}'.format(root, n, extension)
+
+    def openKwargs(self, writer): #arguments for the next writer, with the frame size and format of the first one so it starts right away
+        kwargs = dict(self.kwargs)
+        for name in ('width', 'height', 'pixFmt'):
+            if getattr(writer, name, None) is not None:
+                kwargs.setdefault(name, getattr(writer, name))
+        return kwargs
+
+    def startSegment(self): #switch to the writer of the next segment; the first one is opened here
+        n = len(self.segments)
+        if self.next is not None:
+            self.writer = self.next.result() #normally already running
+            self.next = None
+        else:
+            self.writer = self.factory(self.segmentName(n), **self.kwargs)
+        with self.lock:
+            self.segments.append({'file': os.path.basename(self.segmentName(n)), 'firstFrame': self.framesWritten, 'frames': 0,
+                                  'firstIndex': None, 'lastIndex': None, 'status': 'recording'})
+            self.writeManifest()
+
+    def prepareNext(self): #start the writer of the segment after the current one in the background
+        self.next = self.opener.submit(self.factory, self.segmentName(len(self.segments)), **self.openKwargs(self.writer))
+
+    def endSegment(self): #hand the current writer to a finalizer thread
+        writer, segment = self.writer, self.segments[-1]
+        self.writer = None
+        with self.lock:
+            segment['status'] = 'finalizing'
+            self.writeManifest()
+        self.pending.append(self.finalizer.submit(self.finalize, writer, segment))
+
+    def finalize(self, writer, segment): #finalizer thread: close the writer, e.g. wait for ffmpeg to write the file index
+        t = time.perf_counter()
+        try:
+            closeQuietly(writer)
+            failed = getattr(writer, 'returncode', 0) not in (0, None)
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - t
+        with self.lock:
+            if hasattr(writer, 'report') and getattr(writer, 'loglevel', None) != 'quiet':
+                self.writerReports.append((segment['file'], writer.report()))
+            self.finalizeMax = max(self.finalizeMax, elapsed)
+            segment['status'] = 'failed' if failed else 'complete'
+            self.writeManifest()
+
+    def writeManifest(self): #rewrite the manifest atomically (callers hold the lock, except in __init__)
+        if self.manifestName is None:
+            return
+        manifest = {'version': 1, 'fileName': os.path.basename(self.fileName), 'segmentFrames': self.segmentFrames, 'frameRate': self.frameRate,
+                    'framesWritten': self.framesWritten, 'complete': self.closed, 'segments': self.segments}
+        temporary = self.manifestName + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(temporary, self.manifestName) #a reader or a crash never sees a half written manifest
+
+    def write(self, frames, indexes=None): #write a list of frames (with their frame indexes, if known), rotating at segment boundaries
+        start = 0
+        while start < len(frames):
+            if self.writer is None:
+                self.startSegment()
+            segment = self.segments[-1]
+            count = min(len(frames) - start, self.segmentFrames - segment['frames'])
+            part = frames[start:start+count]
+            if hasattr(self.writer, 'write'): #FFmpegPipeWriter: one write call for the part
+                self.writer.write(part)
+            else:
+                for frame in part:
+                    self.writer.writeFrame(frame)
+            if self.next is None and not self.closed: #frame size and format are known once the first frame is written
+                self.prepareNext()
+            with self.lock:
+                segment['frames'] += count
+                if indexes is not None:
+                    if segment['firstIndex'] is None:
+                        segment['firstIndex'] = int(indexes[start])
+                    segment['lastIndex'] = int(indexes[start + count - 1])
+                self.framesWritten += count
+            if segment['frames'] == self.segmentFrames:
+                self.endSegment()
+            start += count
+
+    def writeFrame(self, frame, index=None):
+        self.write([frame], None if index is None else [index])
+
+    def consume(self, ring): #CaptureEngine saving thread: batch the ready frames of the ring into writes, as FFmpegPipeWriter.consume
+        while True:
+            index, frame = ring.nextCompleted() #blocks for the first frame of a batch
+            if index is None: #ring has been drained after the end of acquisition
+                break
+            batch = []
+            while True:
+                if frame is None: #dropped by the ring's overflow policy
+                    ring.finishRead(index)
+                else:
+                    batch.append((index, ring.compositeOf(frame)))
+                    ring.handOff(index) #slot stays reserved until it is written
+                if len(batch) >= self.batchFrames or not ring.completedAvailable():
+                    break
+                index, frame = ring.nextCompleted()
+            if batch:
+                self.write([frame for index, frame in batch], [index for index, frame in batch])
+                for index, frame in batch:
+                    ring.releaseRead(index)
+
+    def report(self): #one line summary of the segments
+        counts = {state: sum(1 for segment in self.segments if segment['status'] == state) for state in SEGMENT_STATES}
+        return ('segments: {} frames in {} files ({} complete, {} failed), longest finalization {:.2f}sec'
+                .format(self.framesWritten, len(self.segments), counts['complete'], counts['failed'], self.finalizeMax))
+
+    def close(self): #finalize the last segment, wait for all finalizations and mark the manifest complete
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer is not None:
+            self.endSegment()
+        if self.next is not None: #started for a segment that never received a frame
+            closeQuietly(self.next.result())
+            self.next = None
+            if os.path.exists(self.segmentName(len(self.segments))):
+                os.remove(self.segmentName(len(self.segments)))
+        for future in self.pending:
+            future.result()
+        self.opener.shutdown()
+        self.finalizer.shutdown()
+        with self.lock:
+            self.writeManifest()
+        lines = ['{}: {}'.format(fileName, report) for fileName, report in sorted(self.writerReports)] + [self.report()]
+        print('\n'.join(lines)) #one call, so the reports of sinks closed at the same time do not interleave
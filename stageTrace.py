@@ -0,0 +1,146 @@
+# =============================================================================
+#  Per-frame stage timestamps for the capture engine, to find which stage a
+#  session that falls behind is waiting on. For every frame index, each camera
+#  thread records when it called GetNextImage, when the image arrived and when
+#  it had been copied into the frame ring; the acquisition loop records when the
+#  frame was complete (all cameras matched), and the frame ring records when the
+#  sink started reading it and when it had been written. From these, the
+#  per-stage latencies are
+#      grab   GetNextImage call -> image received (includes waiting for the trigger)
+#      copy   image received -> copied into the ring (includes waiting for a free slot)
+#      match  last camera copied -> frame complete
+#      queue  frame complete -> sink starts reading it
+#      write  sink starts reading -> frame written (e.g. by ffmpeg)
+#      total  first image received -> frame written
+#
+#  Timestamps are time.perf_counter() values stored in preallocated numpy blocks
+#  of BLOCK_FRAMES rows, so recording a stage is a single array store and the
+#  trace can stay on in production at 500Hz. statusLine() gives rolling p50/p99
+#  latencies, per-stage fps and queue depths over the last frames for a live
+#  status line; report() summarizes the whole session, and save() writes the
+#  trace as CSV (.csv) or as a numpy structured array (.npy, compact binary).
+# =============================================================================
+
+import threading, warnings
+import numpy as np
+
+BLOCK_FRAMES = 1 << 14 #rows allocated at a time
+CAMERA_STAGES = ('requested', 'received', 'copied') #timestamps recorded by each camera thread
+FRAME_STAGES = ('completed', 'read', 'written') #timestamps recorded once per frame
+STAGES = ('grab', 'copy', 'match', 'queue', 'write', 'total')
+
+def rate(t): #events per second from a set of timestamps, ignoring NaN
+    t = t[t == t]
+    if len(t) < 2 or t.max() == t.min():
+        return 0.0
+    return (len(t) - 1)/(t.max() - t.min())
+
+class StageTrace: #timestamps of every pipeline stage for every frame index
+    def __init__(self, names, window=500):
+        self.names = list(names) #camera names
+        self.numCams = len(self.names)
+        self.columns = ['{}_{}'.format(name, stage) for name in self.names for stage in CAMERA_STAGES] + list(FRAME_STAGES)
+        self.frameColumn = {stage: 3*self.numCams + n for n, stage in enumerate(FRAME_STAGES)}
+        self.window = window #frames used for the rolling statistics
+        self.blocks = {} #index // BLOCK_FRAMES -> (BLOCK_FRAMES, columns) array of timestamps, NaN if not reached
+        self.lock = threading.Lock() #only taken to allocate a block
+        self.firstIndex = None
+        self.lastIndex = None
+
+    def row(self, index): #(block, row) holding a frame index, allocating the block if needed
+        key, row = divmod(index, BLOCK_FRAMES)
+        block = self.blocks.get(key)
+        if block is None:
+            with self.lock:
+                block = self.blocks.get(key)
+                if block is None:
+                    block = self.blocks[key] = np.full((BLOCK_FRAMES, len(self.columns)), np.nan)
+        return block, row
+
+    def markCamera(self, index, camIndex, requested, received, copied): #called by each camera thread once per image
+        block, row = self.row(index)
+        block[row, 3*camIndex:3*camIndex+3] = (requested, received, copied)
+
+    def mark(self, index, stage, t): #'completed', 'read' or 'written'
+        block, row = self.row(index)
+        block[row, self.frameColumn[stage]] = t
+        if stage == 'completed':
+            if self.firstIndex is None:
+                self.firstIndex = index
+            self.lastIndex = index
+
+    def markWritten(self, index, t): #only for frames the sink actually read (not frames the ring dropped)
+        block, row = self.row(index)
+        if block[row, self.frameColumn['read']] == block[row, self.frameColumn['read']]: #not NaN
+            block[row, self.frameColumn['written']] = t
+
+    def rows(self, start, stop): #timestamps of frame indexes start..stop-1
+        if stop <= start:
+            return np.empty((0, len(self.columns)))
+        parts = []
+        index = start
+        while index < stop:
+            block, row = self.row(index)
+            n = min(stop - index, BLOCK_FRAMES - row)
+            parts.append(block[row:row+n])
+            index += n
+        return np.concatenate(parts)
+
+    def latencies(self, times): #dict of stage -> per-frame latency in seconds (NaN where a stage was not reached)
+        cams = times[:, :3*self.numCams].reshape(len(times), self.numCams, 3)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) #all-NaN rows, e.g. a frame no camera delivered
+            lastCopied = np.nanmax(cams[:, :, 2], axis=1)
+            firstReceived = np.nanmin(cams[:, :, 1], axis=1)
+        completed, read, written = (times[:, self.frameColumn[stage]] for stage in FRAME_STAGES)
+        return {'grab': (cams[:, :, 1] - cams[:, :, 0]).ravel(), 'copy': (cams[:, :, 2] - cams[:, :, 1]).ravel(),
+                'match': completed - lastCopied, 'queue': read - completed, 'write': written - read, 'total': written - firstReceived}
+
+    def stageRates(self, times): #frames per second through each stage; grab is the slowest camera
+        received = times[:, 1:3*self.numCams:3]
+        return {'grab': min(rate(received[:, c]) for c in range(self.numCams)),
+                'complete': rate(times[:, self.frameColumn['completed']]), 'write': rate(times[:, self.frameColumn['written']])}
+
+    def summary(self, times): #stage -> (p50, p99) in ms
+        stats = {}
+        for stage, values in self.latencies(times).items():
+            values = values[values == values]
+            stats[stage] = tuple(np.percentile(values, [50, 99])*1000) if len(values) else (np.nan, np.nan)
+        return stats
+
+    def statusLine(self, ring=None): #rolling p50/p99 latencies, stage rates and queue depths, e.g. for a live console line
+        if self.lastIndex is None:
+            return 'waiting for frames...'
+        times = self.rows(max(self.firstIndex, self.lastIndex - self.window + 1), self.lastIndex + 1)
+        rates = self.stageRates(times)
+        stats = self.summary(times)
+        line = 'fps grab {grab:.0f} complete {complete:.0f} write {write:.0f} | p50/p99 ms '.format(**rates)
+        line += ' '.join('{} {:.1f}/{:.1f}'.format(stage, *stats[stage]) for stage in STAGES)
+        if ring is not None:
+            line += ' | ring {}/{} unwritten {}'.format(ring.fillLevel(), ring.numSlots, ring.unreadCount())
+        return line
+
+    def report(self): #whole-session summary lines
+        if self.lastIndex is None:
+            return ['stage trace: no frames']
+        times = self.rows(self.firstIndex, self.lastIndex + 1)
+        stats = self.summary(times)
+        lines = ['stage latency p50/p99 (ms): ' + ', '.join('{} {:.2f}/{:.2f}'.format(stage, *stats[stage]) for stage in STAGES)]
+        lines.append('stage rates (fps): ' + ', '.join('{} {:.1f}'.format(stage, fps) for stage, fps in self.stageRates(times).items()))
+        return lines
+
+    def save(self, fileName): #whole trace as CSV (times in ms from the first image) or as a .npy structured array (perf_counter seconds)
+        if self.lastIndex is None:
+            return
+        times = self.rows(self.firstIndex, self.lastIndex + 1)
+        indexes = np.arange(self.firstIndex, self.lastIndex + 1)
+        if fileName.endswith('.csv'):
+            t0 = np.nanmin(times)
+            np.savetxt(fileName, np.column_stack([indexes, (times - t0)*1000]), fmt=['%d'] + ['%.3f']*len(self.columns),
+                       delimiter=',', header=','.join(['frame'] + self.columns), comments='')
+        else:
+            trace = np.zeros(len(times), dtype=[('frame', np.int64)] + [(column, np.float64) for column in self.columns])
+            trace['frame'] = indexes
+            for n, column in enumerate(self.columns):
+                trace[column] = times[:, n]
+            np.save(fileName, trace)
@@ -0,0 +1,165 @@
+# =============================================================================
+#  Transport layer (stream) statistics of each camera, to tell where missing
+#  frames were lost. For every camera stream, Spinnaker counts the images
+#  delivered, the images the host dropped because no buffer was free (the
+#  program did not take images out fast enough), the images lost on the way
+#  (missing block IDs, i.e. USB), incomplete images and buffer underruns.
+#  StreamMonitor reads these counters once per interval during acquisition (they
+#  are host-side nodes, so reading them costs no USB traffic), optionally logs
+#  them to a CSV file, and at the end of a session breaks each camera's missing
+#  frames down into
+#      camera     triggers that never produced an image (e.g. exposure longer than the trigger period)
+#      transfer   lost on the USB link
+#      host       dropped because all host buffers were full (our code too slow to take images)
+#      late       arrived after the frame had already been written (capture engine)
+#  and suggests a host buffer count (CameraSettings(bufferCount=...)) from each
+#  camera's frame rate and frame size and the longest backlog of images that
+#  built up in its host buffers (BacklogMeter).
+# =============================================================================
+
+import math, time, threading
+
+STREAM_COUNTERS = ('StreamDeliveredFrameCount', 'StreamDroppedFrameCount', 'StreamLostFrameCount', 'StreamIncompleteFrameCount',
+                   'StreamBufferUnderrunCount')
+STREAM_INTERVAL = 1.0 #in seconds; how often the counters are read during acquisition
+BACKLOG_WINDOW = 10.0 #in seconds; the camera to host clock offset is re-estimated this often, so clock drift does not look like a backlog
+BUFFER_MARGIN = 2.0 #suggested buffers cover this many times the longest backlog
+MIN_BUFFER_COUNT = 10 #Spinnaker's default manual buffer count
+
+def readCounters(cam): #current value of each stream counter the camera's transport layer provides
+    counters = {}
+    for name in STREAM_COUNTERS:
+        try:
+            counters[name] = int(getattr(cam.TLStream, name).GetValue())
+        except Exception: #not provided by this transport layer, or camera lost
+            pass
+    return counters
+
+def bufferCountOf(cam): #host buffers the stream is using, or None if unknown
+    try:
+        return int(cam.TLStream.StreamBufferCountResult.GetValue())
+    except Exception:
+        return None
+
+def suggestBufferCount(backlog, frameRate, margin=BUFFER_MARGIN): #host buffers needed to ride out a backlog of backlog seconds at frameRate
+    return max(MIN_BUFFER_COUNT, int(math.ceil(backlog*frameRate*margin)) + 1)
+
+class BacklogMeter: #longest time images waited in the host buffers of one camera, from image timestamps vs arrival times
+    def __init__(self):
+        self.backlog = 0.0 #in seconds
+        self.count = 0
+        self.tFirst = None
+        self.tLast = None
+        self.restart()
+
+    def restart(self): #camera clock restarted (e.g. camera re-acquired)
+        self.windowMin = None
+        self.previousMin = None
+        self.windowEnd = None
+
+    def add(self, tReceived, timestamp): #tReceived in perf_counter seconds, timestamp in ns on the camera clock (0 if unknown)
+        self.count += 1
+        if self.tFirst is None:
+            self.tFirst = tReceived
+        self.tLast = tReceived
+        if not timestamp:
+            return
+        delay = tReceived - timestamp*1e-9 #clock offset + transfer time + time spent waiting in the host buffers
+        if self.windowEnd is None or tReceived >= self.windowEnd:
+            self.previousMin, self.windowMin, self.windowEnd = self.windowMin, delay, tReceived + BACKLOG_WINDOW
+        elif delay < self.windowMin:
+            self.windowMin = delay
+        base = self.windowMin if self.previousMin is None else min(self.windowMin, self.previousMin)
+        if delay - base > self.backlog:
+            self.backlog = delay - base
+
+    def rate(self): #images per second received
+        if self.count < 2 or self.tLast == self.tFirst:
+            return None
+        return (self.count - 1)/(self.tLast - self.tFirst)
+
+class StreamMonitor(threading.Thread): #reads the stream counters of every camera during acquisition
+    def __init__(self, workers, names, interval=STREAM_INTERVAL, logName=None):
+        threading.Thread.__init__(self, name='streamMonitor', daemon=True)
+        self.workers = workers #CameraWorkers; their cam may be replaced by a re-acquired camera
+        self.names = list(names)
+        self.interval = interval
+        self.logName = logName #CSV file with the counters of every camera at every interval, or None
+        self.log = None
+        self.stopEvent = threading.Event()
+        self.lock = threading.Lock()
+        self.last = [{} for worker in workers] #counter values at the last read
+        self.totals = [dict.fromkeys(STREAM_COUNTERS, 0) for worker in workers] #since the session started, across camera restarts
+        self.seen = [False]*len(workers) #counters were read at least once
+        self.bufferCounts = [None]*len(workers)
+        self.tStart = None
+
+    def baseline(self): #counter values before acquisition begins; only increments after this are counted
+        self.tStart = time.perf_counter()
+        for c, worker in enumerate(self.workers):
+            self.last[c] = readCounters(worker.cam)
+            self.seen[c] = bool(self.last[c])
+        if self.logName is not None:
+            self.log = open(self.logName, 'w')
+            self.log.write(','.join(['time', 'camera'] + list(STREAM_COUNTERS)) + '\n')
+
+    def poll(self): #add the counter increments since the last read
+        with self.lock:
+            t = time.perf_counter() - self.tStart
+            for c, worker in enumerate(self.workers):
+                counters = readCounters(worker.cam)
+                for name, value in counters.items():
+                    last = self.last[c].get(name)
+                    if last is not None:
+                        self.totals[c][name] += value - last if value >= last else value #counters restart with the stream
+                    elif self.seen[c]: #camera was lost at the last read and has been re-acquired since
+                        self.totals[c][name] += value
+                self.last[c] = counters
+                self.seen[c] = self.seen[c] or bool(counters)
+                if counters and self.bufferCounts[c] is None:
+                    self.bufferCounts[c] = bufferCountOf(worker.cam)
+                if self.log is not None:
+                    self.log.write('{:.3f},{},'.format(t, self.names[c]) + ','.join(str(self.totals[c][name]) for name in STREAM_COUNTERS) + '\n')
+
+    def run(self):
+        while not self.stopEvent.wait(self.interval):
+            self.poll()
+
+    def stop(self): #final read, then close the log
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join()
+        self.poll()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def statusText(self): #short summary for the live status line
+        host = sum(totals['StreamDroppedFrameCount'] for totals in self.totals)
+        lost = sum(totals['StreamLostFrameCount'] for totals in self.totals)
+        return 'stream drops host {} usb {}'.format(host, lost)
+
+    def report(self, sync, settings, frameRate=None): #where each camera's missing frames were lost, and a suggested buffer count
+        lines = []
+        for c, (name, worker, totals) in enumerate(zip(self.names, self.workers, self.totals)):
+            disconnected = sum(1 for index, camIndex, event in sync.dropLog if camIndex == c and event == 'disconnected')
+            missing = sync.dropCounts[c] - disconnected
+            host = totals['StreamDroppedFrameCount']
+            transfer = totals['StreamLostFrameCount']
+            late = sync.lateCounts[c]
+            camera = max(0, missing - host - transfer - late)
+            lines.append('{}: {} frames missing: {} camera, {} transfer (USB), {} host buffers full ({} underruns), {} late; {} incomplete images'
+                         .format(name, missing, camera, transfer, host, totals['StreamBufferUnderrunCount'], late,
+                                 totals['StreamIncompleteFrameCount']))
+            rate = frameRate or worker.backlog.rate()
+            if rate is None:
+                continue
+            frameBytes = settings[c].imageBytes()
+            suggested = suggestBufferCount(worker.backlog.backlog, rate)
+            bufferCount = self.bufferCounts[c]
+            line = '{}: longest host buffer backlog {:.1f}ms ({:.0f} frames at {:.0f}fps), {} host buffers'.format(
+                name, worker.backlog.backlog*1000, math.ceil(worker.backlog.backlog*rate), rate, bufferCount if bufferCount is not None else 'unknown')
+            if host > 0 or bufferCount is None or suggested > bufferCount:
+                line += '; suggest bufferCount={} ({:.1f}MB)'.format(suggested, suggested*frameBytes/1e6)
+            lines.append(line)
+        return lines
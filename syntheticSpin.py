@@ -0,0 +1,531 @@
+# =============================================================================
+#  Synthetic stand-in for the PySpin module, so the capture pipeline can be run
+#  and benchmarked without cameras. It provides System/CameraList/Camera/
+#  ImagePtr objects with the calls used by the capture scripts and initCam
+#  (Init, the QuickSpin nodes, GetTLStreamNodeMap, CEnumerationPtr,
+#  BeginAcquisition, GetNextImage(timeout), GetData, GetHeight, GetFrameID,
+#  Release, ...), and the enumeration constants, which here are just the
+#  entry names (e.g. PixelFormat_Mono8 == 'Mono8'). Use it in place of PySpin:
+#      import syntheticSpin
+#      syntheticSpin.configure(numCameras=4, frameRate=500)
+#      system = syntheticSpin.System.GetInstance()
+#      cams = system.GetCameras()
+#      initCam(cams[0], settings, spin=syntheticSpin)
+#
+#  Each camera exposes frames at frameRate (the simulated trigger rate, the same
+#  for all cameras so FrameIDs line up) with the Width/Height/PixelFormat set on
+#  its nodes. Frames go into a host buffer of StreamBufferCountManual buffers
+#  (OldestFirst); if the program does not call GetNextImage fast enough the
+#  buffer fills and new frames are dropped, leaving a gap in FrameID, as with a
+#  real camera. Frames can also be dropped on purpose with dropEvery,
+#  dropFrames or dropProbability. Frames are generated lazily when
+#  GetNextImage is called, so the cameras cost no CPU of their own and the
+#  timing does not depend on extra threads. All cameras share one trigger clock
+#  (as with triggers from the DAQ), which starts startDelay after the first
+#  camera begins acquisition, so cameras armed within that time all get trigger
+#  0 as their first frame, and a camera that is disconnected (disconnectAt) and
+#  re-acquired receives the same triggers as the others. The first 4 bytes of
+#  every frame hold its FrameID and the next 4 the trigger number, so alignment
+#  across cameras can be checked.
+#
+#  Images can also be delivered as events, like PySpin: subclass ImageEventHandler,
+#  override OnImageEvent(image) and pass an instance to cam.RegisterEventHandler
+#  before BeginAcquisition. Each camera then runs one event thread that calls the
+#  handlers as images arrive and releases each image when they return, so a slow
+#  handler fills the host buffer just as a slow GetNextImage loop does.
+# =============================================================================
+
+import time, random, threading
+import numpy as np
+from highBitDepth import packMono12
+
+PIXEL_FORMATS = {'Mono8': (1, np.uint8), 'Mono16': (1, np.uint16), 'RGB8Packed': (3, np.uint8), 'RGB8': (3, np.uint8), 'BGR8': (3, np.uint8),
+                 'BayerRG8': (1, np.uint8), 'BayerGB8': (1, np.uint8), 'BayerGR8': (1, np.uint8), 'BayerBG8': (1, np.uint8),
+                 'Mono12Packed': (1, np.uint16), 'Mono12p': (1, np.uint16)} #channels and dtype of the unpacked image
+PACKED_FORMATS = ('Mono12Packed', 'Mono12p') #sent as 2 pixels in 3 bytes; GetData returns the packed bytes
+EVENT_TIMEOUT_INFINITE = None
+POLL_INTERVAL = 0.05 #in seconds; a blocked GetNextImage checks this often whether acquisition was ended
+_trigger = {'epoch': None} #perf_counter time of trigger 0 of the shared trigger clock, set when the first camera begins acquisition
+
+class SpinnakerException(Exception): #raised like PySpin.SpinnakerException on timeouts and misuse
+    pass
+
+# ENUMERATION CONSTANTS ########################################################################################################
+#entry values are their names, so the synthetic camera can read them back directly
+for _enum, _entries in {'UserSetSelector': ['Default', 'UserSet0', 'UserSet1'], 'UserSetDefault': ['Default', 'UserSet0', 'UserSet1'],
+                        'AcquisitionMode': ['Continuous', 'SingleFrame', 'MultiFrame'], 'ExposureAuto': ['Off', 'Once', 'Continuous'],
+                        'ExposureMode': ['Timed', 'TriggerWidth'], 'GainAuto': ['Off', 'Once', 'Continuous'],
+                        'AdcBitDepth': ['Bit8', 'Bit10', 'Bit12'], 'PixelFormat': list(PIXEL_FORMATS),
+                        'TriggerMode': ['Off', 'On'], 'TriggerOverlap': ['Off', 'ReadOut'], 'TriggerSource': ['Software', 'Line0', 'Line2', 'Line3'],
+                        'TriggerActivation': ['RisingEdge', 'FallingEdge', 'LevelHigh', 'LevelLow'], 'TriggerSelector': ['FrameStart', 'AcquisitionStart'],
+                        'LineSelector': ['Line0', 'Line1', 'Line2', 'Line3'], 'LineMode': ['Input', 'Output'],
+                        'LineSource': ['ExposureActive', 'Counter0Active', 'FrameTriggerWait', 'UserOutput1'],
+                        'ChunkSelector': ['Image', 'CRC', 'FrameID', 'Timestamp', 'ExposureTime', 'Gain', 'ExposureEndLineStatusAll']}.items():
+    for _entry in _entries:
+        globals()[_enum + '_' + _entry] = _entry
+
+# NODES #######################################################################################################################
+class Entry: #enumeration entry, as returned by GetEntryByName
+    def __init__(self, name):
+        self.name = name
+
+    def GetValue(self):
+        return self.name
+
+    def GetSymbolic(self):
+        return self.name
+
+class Node: #GenICam node with a value; getter makes a node computed by the camera (e.g. a counter), read only unless it has a setter
+    def __init__(self, camera, value=None, getter=None, setter=None):
+        self.camera = camera
+        self.value = value
+        self.getter = getter
+        self.setter = setter
+
+    def GetValue(self):
+        return self.getter() if self.getter is not None else self.value
+
+    def SetValue(self, value):
+        if self.getter is not None and self.setter is None:
+            raise SpinnakerException('node is read only')
+        if self.camera is not None:
+            self.camera.nodeWritten()
+        if self.setter is not None:
+            self.setter(value)
+        else:
+            self.value = value
+
+    GetIntValue = GetValue
+    SetIntValue = SetValue
+
+    def ToString(self):
+        return str(self.GetValue())
+
+    def GetEntryByName(self, name):
+        return Entry(name)
+
+    def GetCurrentEntry(self):
+        return Entry(self.GetValue())
+
+    def IsAvailable(self):
+        return True
+
+    def IsReadable(self):
+        return True
+
+    def IsWritable(self):
+        return self.getter is None or self.setter is not None
+
+def CEnumerationPtr(node): #PySpin wraps nodes in typed pointers; the synthetic nodes already do everything
+    return node
+
+CIntegerPtr = CFloatPtr = CBooleanPtr = CStringPtr = CCommandPtr = CValuePtr = CEnumerationPtr
+
+def IsAvailable(node):
+    return node is not None
+
+def IsReadable(node):
+    return node is not None
+
+def IsWritable(node):
+    return node is not None and node.IsWritable()
+
+class NodeMap: #GetTLStreamNodeMap()/GetTLDeviceNodeMap()/GetNodeMap(); also allows cam.TLStream.StreamBufferCountMode style access
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def GetNode(self, name):
+        return self.nodes.get(name)
+
+    def __getattr__(self, name):
+        nodes = self.__dict__.get('nodes', {})
+        if name in nodes:
+            return nodes[name]
+        raise AttributeError(name)
+
+class ImageEventHandler: #base class for image event handlers, like PySpin.ImageEventHandler
+    def OnImageEvent(self, image): #called on the camera's event thread for every image
+        pass
+
+class ChunkData: #chunk data sent with an image (ChunkModeActive and the entry's ChunkEnable must be on)
+    def __init__(self, frameID, timestamp, exposureTime, gain, lineStatus):
+        self.frameID = frameID
+        self.timestamp = timestamp
+        self.exposureTime = exposureTime
+        self.gain = gain
+        self.lineStatus = lineStatus
+
+    def GetFrameID(self):
+        return self.frameID
+
+    def GetTimestamp(self):
+        return self.timestamp
+
+    def GetExposureTime(self):
+        return self.exposureTime
+
+    def GetGain(self):
+        return self.gain
+
+    def GetExposureEndLineStatusAll(self):
+        return self.lineStatus
+
+# IMAGES ######################################################################################################################
+class ImagePtr: #one frame from GetNextImage
+    def __init__(self, data, height, width, pixelFormat, frameID, timestamp, camera):
+        self.data = data
+        self.height = height
+        self.width = width
+        self.pixelFormat = pixelFormat
+        self.frameID = frameID
+        self.timestamp = timestamp
+        self.camera = camera
+        self.released = False
+
+    def GetData(self): #flat array, like PySpin
+        return self.data
+
+    def GetNDArray(self):
+        if self.pixelFormat in PACKED_FORMATS: #not unpacked here
+            return self.data
+        channels, dtype = PIXEL_FORMATS[self.pixelFormat]
+        return self.data.reshape((self.height, self.width) if channels == 1 else (self.height, self.width, channels))
+
+    def GetHeight(self):
+        return self.height
+
+    def GetWidth(self):
+        return self.width
+
+    def GetFrameID(self):
+        return self.frameID
+
+    def GetTimeStamp(self): #in ns on the camera clock
+        return self.timestamp
+
+    def GetPixelFormatName(self):
+        return self.pixelFormat
+
+    def GetChunkData(self):
+        camera = self.camera
+        if not camera.ChunkModeActive.GetValue():
+            raise SpinnakerException('chunk mode is not active')
+        enabled = camera.chunkEnabled
+        return ChunkData(self.frameID if enabled['FrameID'] else 0, self.timestamp if enabled['Timestamp'] else 0,
+                         camera.ExposureTime.GetValue() if enabled['ExposureTime'] else 0.0, camera.Gain.GetValue() if enabled['Gain'] else 0.0,
+                         (1 << 2) | (self.frameID & 1) if enabled['ExposureEndLineStatusAll'] else 0) #Line2 pulled up; Line0 toggles with each trigger
+
+    def IsIncomplete(self):
+        return False
+
+    def GetImageStatus(self):
+        return 0
+
+    def Release(self):
+        if not self.released:
+            self.released = True
+            self.camera.imagesOut -= 1
+
+# CAMERAS #####################################################################################################################
+class Camera: #synthetic BlackFly S
+    def __init__(self, serial, frameRate=500, sensorWidth=720, sensorHeight=540, bufferCount=10, dropEvery=None, dropFrames=(),
+                 dropProbability=0.0, startDelay=0.2, nodeWriteTime=0.0, disconnectAt=None, disconnectTime=1.0, seed=0,
+                 sensorBinning=True):
+        self.serial = str(serial)
+        self.frameRate = frameRate #simulated trigger rate in Hz (or free-running rate)
+        self.dropEvery = dropEvery #drop every Nth frame (e.g. lost on the bus), or None
+        self.dropFrames = set(dropFrames) #FrameIDs that are never delivered
+        self.dropProbability = dropProbability #chance of each frame being lost
+        self.startDelay = startDelay #in seconds from the first camera's BeginAcquisition to the first trigger (the DAQ starting)
+        self.nodeWriteTime = nodeWriteTime #in seconds; simulated latency of each node write over USB
+        self.disconnectAt = disconnectAt #FrameID at which the camera drops off the bus (once), or None
+        self.disconnectTime = disconnectTime #in seconds until it can be found again with System.UpdateCameras()
+        self.offlineUntil = None #perf_counter time a disconnected camera comes back
+        self.random = random.Random(seed)
+        self.initialized = False
+        self.streaming = False
+        self.nodeWrites = 0
+        self.imagesOut = 0
+        self.lock = threading.Lock()
+        self.handlers = [] #registered ImageEventHandlers
+        self.eventThread = None
+        node = lambda value=None, getter=None, setter=None: Node(self, value, getter, setter)
+        self.nodes = {name: node(value) for name, value in [
+            ('UserSetSelector', 'Default'), ('UserSetDefault', 'Default'), ('AcquisitionMode', 'Continuous'),
+            ('ExposureAuto', 'Continuous'), ('ExposureMode', 'Timed'), ('ExposureTime', 5000.0),
+            ('AcquisitionFrameRateEnable', False), ('AcquisitionFrameRate', float(frameRate)), ('GainAuto', 'Continuous'), ('Gain', 0.0),
+            ('GammaEnable', False), ('Gamma', 0.8), ('AdcBitDepth', 'Bit10'), ('PixelFormat', 'Mono8'),
+            ('Width', sensorWidth), ('Height', sensorHeight), ('OffsetX', 0), ('OffsetY', 0), ('WidthMax', sensorWidth), ('HeightMax', sensorHeight),
+            ('TriggerMode', 'Off'), ('TriggerOverlap', 'Off'), ('TriggerSource', 'Software'), ('TriggerActivation', 'RisingEdge'),
+            ('TriggerSelector', 'FrameStart'), ('LineSelector', 'Line0'), ('LineMode', 'Input'), ('LineSource', 'ExposureActive'),
+            ('ChunkModeActive', False), ('ChunkSelector', 'Image')]}
+        if sensorBinning: #False for a model without binning nodes, which is binned in software
+            self.nodes.update(BinningHorizontal=node(1), BinningVertical=node(1))
+        self.chunkEnabled = {entry: entry == 'Image' for entry in ('Image', 'CRC', 'FrameID', 'Timestamp', 'ExposureTime', 'Gain', 'ExposureEndLineStatusAll')}
+        self.nodes['ChunkEnable'] = node(getter=lambda: self.chunkEnabled[self.ChunkSelector.GetValue()],
+                                         setter=lambda value: self.chunkEnabled.__setitem__(self.ChunkSelector.GetValue(), bool(value)))
+        self.userSets = {'Default': self.nodeValues()} #saved with UserSetSave, restored with UserSetLoad
+        self.nodes['DeviceSerialNumber'] = Node(None, self.serial)
+        self.TLDevice = NodeMap({'DeviceSerialNumber': self.nodes['DeviceSerialNumber'], 'DeviceModelName': Node(None, 'Synthetic BFS-U3-04S2M')})
+        self.TLStream = NodeMap({'StreamBufferHandlingMode': node('OldestFirst'), 'StreamBufferCountMode': node('Manual'),
+                                 'StreamBufferCountManual': node(bufferCount),
+                                 'StreamBufferCountResult': node(getter=lambda: self.bufferCount),
+                                 'StreamDroppedFrameCount': node(getter=lambda: self.droppedFull),
+                                 'StreamLostFrameCount': node(getter=lambda: self.droppedLost),
+                                 'StreamIncompleteFrameCount': node(getter=lambda: 0),
+                                 'StreamBufferUnderrunCount': node(getter=lambda: self.underruns),
+                                 'StreamDeliveredFrameCount': node(getter=lambda: self.delivered)})
+        self.resetStream()
+
+    def resetStream(self):
+        if self.TLStream.StreamBufferCountMode.GetValue() == 'Auto':
+            self.bufferCount = max(10, int(self.frameRate/10)) #about 100ms of frames
+        else:
+            self.bufferCount = self.TLStream.StreamBufferCountManual.GetValue()
+        self.overflowing = False
+        self.t0 = None
+        self.nextArrival = 0 #next FrameID to be exposed
+        self.buffered = [] #FrameIDs waiting in the host buffer, oldest first
+        self.buffers = []
+        self.droppedFull = 0 #frames dropped because the host buffer was full
+        self.droppedLost = 0 #frames dropped on purpose (drop pattern)
+        self.underruns = 0 #times the host buffer ran out of free buffers
+        self.delivered = 0
+
+    def __getattr__(self, name): #QuickSpin style node access, e.g. cam.PixelFormat.SetValue(...)
+        nodes = self.__dict__.get('nodes', {})
+        if name in nodes:
+            return nodes[name]
+        raise AttributeError(name)
+
+    def nodeWritten(self): #called by every node write
+        self.nodeWrites += 1
+        if self.nodeWriteTime:
+            time.sleep(self.nodeWriteTime)
+
+    def isOnline(self): #False while the camera is disconnected
+        return self.offlineUntil is None or time.perf_counter() >= self.offlineUntil
+
+    def unplug(self): #drop off the bus: acquisition stops and the camera must be re-initialized once it is back
+        self.offlineUntil = time.perf_counter() + self.disconnectTime
+        self.streaming = False
+        self.initialized = False
+
+    def Init(self):
+        if not self.isOnline():
+            raise SpinnakerException('device not connected')
+        self.initialized = True
+
+    def DeInit(self):
+        self.initialized = False
+
+    def IsInitialized(self):
+        return self.initialized
+
+    def IsValid(self):
+        return True
+
+    def IsStreaming(self):
+        return self.streaming
+
+    def nodeValues(self): #camera settings that user sets store
+        return {name: node.value for name, node in self.nodes.items() if name not in ('UserSetSelector', 'UserSetDefault')}
+
+    def UserSetLoad(self):
+        self.nodeWritten()
+        for name, value in self.userSets.get(self.UserSetSelector.GetValue(), self.userSets['Default']).items(): #never saved: factory settings
+            self.nodes[name].value = value
+
+    def UserSetSave(self):
+        if self.UserSetSelector.GetValue() == 'Default':
+            raise SpinnakerException('the Default user set is read only')
+        self.nodeWritten()
+        self.userSets[self.UserSetSelector.GetValue()] = self.nodeValues()
+
+    def GetTLStreamNodeMap(self):
+        return self.TLStream
+
+    def GetTLDeviceNodeMap(self):
+        return self.TLDevice
+
+    def GetNodeMap(self):
+        return NodeMap(self.nodes)
+
+    def GetUniqueID(self):
+        return self.serial
+
+    def frameShape(self): #(height, width, channels, dtype) from the current nodes
+        channels, dtype = PIXEL_FORMATS[self.PixelFormat.GetValue()]
+        return self.Height.GetValue(), self.Width.GetValue(), channels, dtype
+
+    def BeginAcquisition(self):
+        if not self.initialized:
+            raise SpinnakerException('camera not initialized')
+        if self.streaming:
+            raise SpinnakerException('acquisition already started')
+        self.resetStream()
+        height, width, channels, dtype = self.frameShape()
+        y, x = np.mgrid[0:height, 0:width]
+        pattern = (x + y) % 256
+        for n in range(self.bufferCount + 2): #one per host buffer, plus the ones held by the program
+            frame = np.empty((height, width, channels), dtype=dtype)
+            frame[...] = ((pattern + 8*n) % 256)[:, :, None]
+            if dtype == np.uint16: #most significant bit aligned, as the camera sends a 10/12-bit ADC in Mono16
+                frame <<= 8
+            if self.PixelFormat.GetValue() in PACKED_FORMATS:
+                self.buffers.append(packMono12(frame.ravel(), self.PixelFormat.GetValue()))
+            else:
+                self.buffers.append(frame.ravel())
+        self.period = 1.0/self.frameRate
+        if _trigger['epoch'] is None:
+            _trigger['epoch'] = time.perf_counter() + self.startDelay
+        self.firstTrigger = max(0, int(np.ceil((time.perf_counter() - _trigger['epoch'])/self.period))) #next trigger of the shared clock
+        self.t0 = _trigger['epoch'] + self.firstTrigger*self.period
+        self.streaming = True
+        if self.handlers:
+            self.startEvents()
+
+    def EndAcquisition(self): #returns once the event handlers have returned
+        if not self.streaming:
+            raise SpinnakerException('acquisition not started')
+        self.streaming = False
+        if self.eventThread is not None and self.eventThread is not threading.current_thread():
+            self.eventThread.join()
+
+    def RegisterEventHandler(self, handler):
+        if handler in self.handlers:
+            raise SpinnakerException('event handler already registered')
+        self.handlers.append(handler) #as with Spinnaker, images are only delivered as events if the handler was registered before BeginAcquisition
+
+    def UnregisterEventHandler(self, handler):
+        if handler not in self.handlers:
+            raise SpinnakerException('event handler not registered')
+        self.handlers.remove(handler)
+
+    def startEvents(self):
+        if self.eventThread is None or not self.eventThread.is_alive():
+            self.eventThread = threading.Thread(target=self.deliverEvents, name=self.serial + ' events', daemon=True)
+            self.eventThread.start()
+
+    def deliverEvents(self): #event thread: hand every image to the registered handlers, then release it
+        while self.streaming:
+            try:
+                image = self.GetNextImage(POLL_INTERVAL*1000)
+            except SpinnakerException: #timeout, end of acquisition or unplugged
+                continue
+            for handler in list(self.handlers):
+                handler.OnImageEvent(image)
+            image.Release()
+
+    def isDropped(self, frameID): #drop pattern
+        if frameID in self.dropFrames or (self.dropEvery and frameID % self.dropEvery == self.dropEvery - 1):
+            return True
+        return self.dropProbability > 0 and self.random.random() < self.dropProbability
+
+    def arrive(self, now): #expose all frames due by now into the host buffer, dropping what does not fit
+        due = int((now - self.t0)/self.period) if now >= self.t0 else -1
+        while self.nextArrival <= due:
+            frameID = self.nextArrival
+            self.nextArrival += 1
+            if self.isDropped(frameID):
+                self.droppedLost += 1
+            elif len(self.buffered) >= self.bufferCount: #OldestFirst: a full buffer drops the new frame
+                self.droppedFull += 1
+                if not self.overflowing:
+                    self.underruns += 1
+                    self.overflowing = True
+            else:
+                self.buffered.append(frameID)
+                self.overflowing = False
+
+    def GetNextImage(self, timeout=EVENT_TIMEOUT_INFINITE): #timeout in ms, like PySpin
+        tEnd = None if timeout is None else time.perf_counter() + timeout/1000.0
+        with self.lock:
+            while True:
+                if not self.streaming:
+                    raise SpinnakerException('acquisition stopped')
+                now = time.perf_counter()
+                self.arrive(now)
+                if self.disconnectAt is not None and self.buffered and self.buffered[0] >= self.disconnectAt:
+                    self.disconnectAt = None
+                    self.unplug()
+                    raise SpinnakerException('device removed')
+                if self.buffered:
+                    break
+                if tEnd is not None and now >= tEnd:
+                    raise SpinnakerException('timeout waiting for image')
+                tNext = self.t0 + self.nextArrival*self.period
+                wait = min(tNext - now, POLL_INTERVAL) if tEnd is None else min(tNext - now, tEnd - now, POLL_INTERVAL)
+                time.sleep(max(wait, 0.0))
+        frameID = self.buffered.pop(0)
+        height, width, channels, dtype = self.frameShape()
+        data = self.buffers[frameID % len(self.buffers)]
+        data.view(np.uint8)[:8] = np.frombuffer(np.array([frameID, self.firstTrigger + frameID], dtype=np.uint32).tobytes(), dtype=np.uint8)
+        self.delivered += 1
+        self.imagesOut += 1
+        timestamp = int((self.t0 + frameID*self.period)*1e9)
+        return ImagePtr(data, height, width, self.PixelFormat.GetValue(), frameID, timestamp, self)
+
+# SYSTEM ######################################################################################################################
+class CameraList:
+    def __init__(self, cameras):
+        self.cameras = list(cameras)
+
+    def __getitem__(self, i):
+        return self.cameras[i]
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def __iter__(self):
+        return iter(self.cameras)
+
+    def GetSize(self):
+        return len(self.cameras)
+
+    def GetByIndex(self, i):
+        return self.cameras[i]
+
+    def GetBySerial(self, serial):
+        for camera in self.cameras:
+            if camera.serial == str(serial):
+                return camera
+        return None
+
+    def Clear(self):
+        self.cameras = []
+
+_config = {'numCameras': 2, 'options': {}}
+
+def configure(numCameras=2, serials=None, **options): #cameras returned by System.GetCameras(); options are passed to Camera
+    _config['numCameras'] = numCameras
+    _config['serials'] = serials
+    _config['options'] = options
+    _trigger['epoch'] = None
+    System.instance = None
+
+class System:
+    instance = None
+
+    def __init__(self):
+        serials = _config.get('serials') or [str(20000000 + n) for n in range(_config['numCameras'])]
+        self.cameras = [Camera(serial, **_config['options']) for serial in serials]
+
+    @classmethod
+    def GetInstance(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def GetCameras(self): #cameras currently connected
+        return CameraList([camera for camera in self.cameras if camera.isOnline()])
+
+    def UpdateCameras(self): #re-enumerate; True if the list changed (always True here)
+        return True
+
+    def ReleaseInstance(self):
+        System.instance = None
+        _trigger['epoch'] = None
+
+    def GetLibraryVersion(self):
+        return 'synthetic'
@@ -0,0 +1,56 @@
+# =============================================================================
+#  End-to-end tests of the capture pipeline with synthetic cameras
+#  (syntheticSpin.py): cameras -> frame synchronizer -> frame ring -> sink, with
+#  the frames checked in the files that were written. Run with
+#      python -m pytest test_capturePipeline.py
+# =============================================================================
+
+import os
+import numpy as np
+import syntheticSpin
+from captureEngine import CaptureEngine, CameraSettings, initCam
+from rawCapture import RawSink, openRaw
+
+def capture(tempDir, numFrames, numCams=2, **options): #capture numFrames from synthetic cameras into raw files; (frames captured, [(frames, indexes, times)])
+    syntheticSpin.configure(numCams, frameRate=200, sensorWidth=160, sensorHeight=120, bufferCount=400, **options) #host buffers for 2sec: no drops from timer jitter
+    system = syntheticSpin.System.GetInstance()
+    cams = system.GetCameras()
+    settings = CameraSettings(width=160, height=120, offsetX=0, offsetY=0)
+    for cam in cams:
+        initCam(cam, settings, spin=syntheticSpin)
+    fileNames = [os.path.join(str(tempDir), 'cam{}.raw'.format(c+1)) for c in range(numCams)]
+    engine = CaptureEngine(cams, settings, sink=RawSink(fileNames), numFrames=numFrames, statusInterval=None, spin=syntheticSpin)
+    try:
+        framesCaptured = engine.run()
+    finally:
+        del engine
+        system.ReleaseInstance()
+    files = []
+    for fileName in fileNames:
+        frames, header, indexes, times = openRaw(fileName)
+        files.append((np.array(frames), indexes, times))
+        del frames
+    return framesCaptured, files
+
+def stamps(frames): #(FrameID, trigger number) written by syntheticSpin into the first 8 bytes of each frame
+    return np.ascontiguousarray(frames.reshape(len(frames), -1)[:, :8]).view(np.uint32)
+
+def test_rawSinkGetsEveryFrameInOrder(tmp_path):
+    framesCaptured, files = capture(tmp_path, 300)
+    assert framesCaptured == 300
+    for frames, indexes, times in files:
+        assert len(frames) == 300
+        assert (indexes == np.arange(300)).all()
+        assert (stamps(frames)[:, 0] == indexes).all() #each frame index holds the image with that FrameID
+        assert not np.isnan(times).any()
+    assert (stamps(files[0][0])[:, 1] == stamps(files[1][0])[:, 1]).all() #both cameras' frames come from the same trigger
+
+def test_droppedFramesAreFilledInPlace(tmp_path):
+    framesCaptured, files = capture(tmp_path, 100, dropFrames=(40, 41))
+    assert framesCaptured == 100
+    for frames, indexes, times in files:
+        assert (indexes == np.arange(100)).all()
+        assert np.isnan(times[[40, 41]]).all() #filled, not captured
+        real = ~np.isnan(times)
+        assert real.sum() == 98
+        assert (stamps(frames[real])[:, 0] == indexes[real]).all() #no frame after the gap is shifted